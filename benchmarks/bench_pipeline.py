@@ -0,0 +1,208 @@
+"""Offline benchmark for the OmniAgent pipeline.
+
+LLM calls are answered by a ReplayBackend (recorded fixtures), with a
+StubBackend for anything not recorded, so runs are deterministic and need
+no network. The demo.py scenarios plus a generated corpus are run through the
+real planner/SQL/serialization code against the local databases.
+
+    python benchmarks/bench_pipeline.py                       # replay, 50 generated queries
+    python benchmarks/bench_pipeline.py --record              # re-record fixtures (needs GROQ_API_KEY)
+    python benchmarks/bench_pipeline.py --strict              # CI: fail if a call is missing from the fixtures
+    python benchmarks/bench_pipeline.py --out run.json --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+# Benchmark queries must not end up in the index advisor's workload
+os.environ.setdefault("OMNI_QUERY_LOG", "")
+
+from src.orchestrator_groq import OmniAgent
+from src.metrics import Trace
+from src.llm_backends import (DEFAULT_FIXTURE_PATH, GroqBackend, RecordingBackend,
+                              ReplayBackend, StubBackend)
+from src.utils import get_result_cache, query_rows
+from demo import SCENARIOS
+
+STAGES = ["plan", "entity_resolution", "customer360", "sql_generation", "sql_execution", "serialization", "synthesis", "total"]
+
+CORPUS_TEMPLATES = [
+    "I am {name}. Where is my latest order right now?",
+    "I am {name}. What is my current wallet balance?",
+    "I am {name}. What is the status of my support ticket?",
+    "I am {name}. I ordered a '{product}'. Has it been delivered, and was I charged for it?",
+    "Check on {name}. Give me a complete update on the latest order, payment and tickets.",
+    "Check order #{order}. Tell me the tracking number and which warehouse it is at.",
+    "I am {name}. Did I leave a satisfaction survey for my last ticket?",
+    "I am {name}. Show me my recent transactions and my refund status.",
+]
+
+def generate_corpus(size: int, seed: int = 42):
+    """Realistic questions built from the users, products and orders in the local databases."""
+    rng = random.Random(seed)
+    names = [r["Name"] for r in query_rows("DB_ShopCore.db", "SELECT Name FROM Users ORDER BY UserID LIMIT 200")]
+    products = [r["Name"] for r in query_rows("DB_ShopCore.db", "SELECT Name FROM Products ORDER BY ProductID")]
+    orders = [r["OrderID"] for r in query_rows("DB_ShopCore.db", "SELECT OrderID FROM Orders ORDER BY OrderID LIMIT 500")]
+    corpus = []
+    for _ in range(size):
+        template = rng.choice(CORPUS_TEMPLATES)
+        corpus.append(template.format(name=rng.choice(names), product=rng.choice(products), order=rng.choice(orders)))
+    return corpus
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def reset_caches(agent: OmniAgent):
+    # The entity index and customer 360 store are persistent indexes, not per-query caches: they are
+    # built once before the suites (build_sidecars) and kept
+    agent.sql_cache.invalidate()
+    get_result_cache().clear()
+
+async def run_suite(agent: OmniAgent, queries, iterations: int, warm: bool, track_allocations: bool):
+    samples = {stage: [] for stage in STAGES}
+    allocations = []
+    for _ in range(iterations):
+        for query in queries:
+            if not warm:
+                reset_caches(agent)
+            trace = Trace()
+            if track_allocations:
+                tracemalloc.start()
+            start = time.perf_counter()
+            await agent.arun_query(query, trace=trace)
+            timings = trace.stage_totals()
+            timings["total"] = time.perf_counter() - start
+            if track_allocations:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                allocations.append(peak)
+            for stage in STAGES:
+                samples[stage].append(timings.get(stage, 0.0) * 1000)
+    return samples, allocations
+
+def summarize(samples, allocations):
+    summary = {}
+    for stage, values in samples.items():
+        summary[stage] = {
+            "mean_ms": round(statistics.fmean(values), 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+        }
+    if allocations:
+        summary["alloc_peak_kib"] = {
+            "mean": round(statistics.fmean(allocations) / 1024, 1),
+            "p95": round(percentile(allocations, 95) / 1024, 1),
+        }
+    return summary
+
+def print_summary(title: str, summary: dict):
+    print(f"\n=== {title} ===")
+    print(f"{'stage':<18}{'mean ms':>12}{'p50 ms':>12}{'p95 ms':>12}")
+    for stage in STAGES:
+        s = summary[stage]
+        print(f"{stage:<18}{s['mean_ms']:>12.3f}{s['p50_ms']:>12.3f}{s['p95_ms']:>12.3f}")
+    if "alloc_peak_kib" in summary:
+        a = summary["alloc_peak_kib"]
+        print(f"{'alloc peak KiB':<18}{a['mean']:>12.1f}{'':>12}{a['p95']:>12.1f}")
+
+def compare(results: dict, baseline_path: str, max_regression: float) -> bool:
+    """Prints % change of every mean vs a previous --out file. Returns False on a regression."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    ok = True
+    print(f"\n=== Compared with {baseline_path} ===")
+    for suite, summary in results["suites"].items():
+        old = baseline.get("suites", {}).get(suite)
+        if not old:
+            continue
+        for stage in STAGES:
+            before, after = old[stage]["mean_ms"], summary[stage]["mean_ms"]
+            if before <= 0:
+                continue
+            change = (after - before) / before * 100
+            flag = ""
+            # Sub-millisecond stages are too noisy to gate on
+            if change > max_regression and after - before > 0.5:
+                flag = "  <-- REGRESSION"
+                ok = False
+            print(f"{suite:<10}{stage:<18}{before:>10.3f} -> {after:>10.3f} ms  ({change:+.1f}%){flag}")
+    return ok
+
+def build_backend(args):
+    if args.record or args.record_stub:
+        return RecordingBackend(StubBackend() if args.record_stub else GroqBackend(), args.fixtures)
+    # Misses are counted even with --strict, so the run finishes and reports them instead of crashing
+    return ReplayBackend(args.fixtures, fallback=StubBackend(), latency=args.llm_latency)
+
+async def build_sidecars(agent: OmniAgent):
+    """Brings the entity index and customer 360 store up to date before anything is timed.
+
+    Otherwise the first queries would race their build, and which questions reach the
+    LLM (and so which fixtures are needed) would depend on timing.
+    """
+    await asyncio.to_thread(agent._build_sidecars)
+
+async def main_async(args):
+    backend = build_backend(args)
+    agent = OmniAgent(llm_backend=backend)
+    await build_sidecars(agent)
+    suites = {"demo": list(SCENARIOS), "corpus": generate_corpus(args.corpus_size)}
+
+    results = {"meta": {"iterations": args.iterations, "warm": args.warm, "corpus_size": args.corpus_size,
+                        "llm_latency_s": args.llm_latency, "fixtures": args.fixtures}, "suites": {}}
+    for name, queries in suites.items():
+        samples, _ = await run_suite(agent, queries, args.iterations, args.warm, track_allocations=False)
+        # Allocation tracing slows everything down, so it gets its own single pass
+        _, allocations = await run_suite(agent, queries, 1, args.warm, track_allocations=True)
+        summary = summarize(samples, allocations)
+        summary["queries"] = len(queries)
+        results["suites"][name] = summary
+        print_summary(f"{name} ({len(queries)} queries x {args.iterations})", summary)
+
+    if isinstance(backend, ReplayBackend):
+        results["meta"]["replay_hits"] = backend.hits
+        results["meta"]["replay_misses"] = backend.misses
+        print(f"\nReplay: {backend.hits} recorded responses, {backend.misses} answered by the stub backend.")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline record/replay benchmark for the OmniAgent pipeline.")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE_PATH, help="recorded LLM responses")
+    parser.add_argument("--record", action="store_true", help="call Groq live and (re)record the fixtures")
+    parser.add_argument("--record-stub", action="store_true",
+                        help="record the stub backend's answers instead (no network), e.g. to extend the committed set")
+    parser.add_argument("--strict", action="store_true", help="exit 1 if any LLM call is missing from the fixtures")
+    parser.add_argument("--corpus-size", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--warm", action="store_true", help="keep SQL template and result caches between queries")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per replayed LLM call")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="previous --out file to diff against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed %% slowdown per stage")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+    if args.strict and results["meta"].get("replay_misses"):
+        print(f"{results['meta']['replay_misses']} LLM calls were missing from {args.fixtures}")
+        sys.exit(1)
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
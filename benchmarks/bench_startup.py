@@ -0,0 +1,125 @@
+"""Cold-start benchmark for the API process: import to first response.
+
+Every run is a fresh interpreter that imports src.server, runs its startup
+(agent build and warm-up) and answers one question through the HTTP app.
+LLM calls go to the StubBackend (OMNI_LLM_MODE=stub) unless --live is given,
+so runs need no network.
+
+    python benchmarks/bench_startup.py                    # 5 runs, warm-up on, sidecars and snapshot kept
+    python benchmarks/bench_startup.py --cold             # no schema snapshot or sidecar files, like a fresh instance
+    python benchmarks/bench_startup.py --no-warmup --out startup.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ["import_ms", "startup_ms", "first_response_ms", "import_to_response_ms", "process_ms"]
+QUESTION = "I am Alice Johnson. Where is my latest order right now?"
+
+async def _post(app, path: str, payload: dict):
+    """One HTTP request straight through the ASGI app: no client library to import. Returns (status, body)."""
+    body = json.dumps(payload).encode()
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+               "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+               "headers": [(b"content-type", b"application/json")], "server": ("bench", 80), "client": ("bench", 1)},
+              receive, send)
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+async def _child_async(start: float):
+    sys.path.append(ROOT)
+    import src.server as server
+    imported = time.perf_counter()
+    async with server.app.router.lifespan_context(server.app):
+        started = time.perf_counter()
+        status, body = await _post(server.app, "/api/chat", {"message": QUESTION})
+        answered = time.perf_counter()
+    if status != 200:
+        raise RuntimeError(f"first request failed with {status}: {body[:500]!r}")
+    return {
+        "import_ms": (imported - start) * 1000,
+        "startup_ms": (started - imported) * 1000,
+        "first_response_ms": (answered - started) * 1000,
+        "import_to_response_ms": (answered - start) * 1000,
+    }
+
+def child():
+    """One measured cold start; prints its timings as JSON on the last line."""
+    start = time.perf_counter()
+    print(json.dumps(asyncio.run(_child_async(start))))
+
+def run_once(args, scratch: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OMNI_QUERY_LOG", "")
+    if not args.live:
+        env["OMNI_LLM_MODE"] = "stub"
+    if not args.warmup:
+        env["OMNI_WARMUP"] = "0"
+    if args.cold:
+        # Nothing on disk from earlier runs: schema snapshot and sidecars start empty
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+        env["OMNI_SCHEMA_SNAPSHOT"] = os.path.join(scratch, "schema_snapshot.json")
+        env["OMNI_ENTITY_INDEX"] = os.path.join(scratch, "entity_index.db")
+        env["OMNI_CUSTOMER360"] = os.path.join(scratch, "customer360.db")
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], env=env, cwd=ROOT,
+                         capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if out.returncode != 0:
+        raise RuntimeError(f"startup run failed:\n{out.stderr[-2000:]}")
+    timings = json.loads(out.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = elapsed
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-to-first-response benchmark for the API process.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="start every run without snapshot or sidecar files")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="set OMNI_WARMUP=0")
+    parser.add_argument("--live", action="store_true", help="use the configured LLM backend instead of the stub")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    scratch = tempfile.mkdtemp(prefix="omni-startup-")
+    try:
+        runs = [run_once(args, scratch) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    summary = {}
+    print(f"\n=== startup ({args.runs} runs, {'cold' if args.cold else 'warm files'}, "
+          f"warm-up {'on' if args.warmup else 'off'}) ===")
+    print(f"{'phase':<24}{'mean ms':>12}{'p50 ms':>12}{'max ms':>12}")
+    for phase in PHASES:
+        values = [r[phase] for r in runs]
+        summary[phase] = {"mean_ms": round(statistics.fmean(values), 1),
+                          "p50_ms": round(statistics.median(values), 1), "max_ms": round(max(values), 1)}
+        s = summary[phase]
+        print(f"{phase:<24}{s['mean_ms']:>12.1f}{s['p50_ms']:>12.1f}{s['max_ms']:>12.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"meta": {"runs": args.runs, "cold": args.cold, "warmup": args.warmup, "live": args.live},
+                       "runs": runs, "summary": summary}, f, indent=2)
+        print(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""HTTP load test for /api/chat against a stub LLM.
+
+Starts the stub LLM server (stub_llm_server.py) and one `uvicorn src.server:app`
+process pointed at it, then replays a query mix (the demo.py scenarios plus
+generated variants) either at a fixed arrival rate (open loop: --rate) or from
+a fixed number of users who each send their next question when the last one
+is answered (closed loop: --users). Reports throughput, p50/p95/p99 latency,
+error rates and LLM fallback counts, and writes everything to --out.
+
+    python benchmarks/load_test.py --users 20 --duration 30
+    python benchmarks/load_test.py --rate 15 --duration 60 --llm-latency 0.5 --rate-limit 0.1
+    python benchmarks/load_test.py --target http://127.0.0.1:8000 --users 10   # an already running API
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+# Load-test questions must not end up in the index advisor's workload
+os.environ.setdefault("OMNI_QUERY_LOG", "")
+
+import httpx
+from stub_llm_server import StubSettings, serve_in_thread
+from bench_pipeline import generate_corpus, percentile
+from demo import SCENARIOS
+
+DEFAULT_OUT = os.path.join(ROOT, "benchmarks", "load_results.json")
+_METRIC = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_api(port: int, llm_url: str, workers: int):
+    """A separate API process, so the load generator doesn't compete with it for the event loop."""
+    env = dict(os.environ, GROQ_BASE_URL=llm_url, GROQ_API_KEY=os.environ.get("GROQ_API_KEY") or "stub",
+               OMNI_LLM_MODE="live")
+    command = [sys.executable, "-m", "uvicorn", "src.server:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+        # Shared caches and LLM quota, in a fresh file so runs don't answer from each other's caches
+        env.update(OMNI_SHARED_STATE="1",
+                   OMNI_SHARED_STATE_PATH=os.path.join(tempfile.mkdtemp(prefix="omni-load-"), "shared_state.db"))
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+async def wait_ready(client: httpx.AsyncClient, target: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(f"{target}/metrics")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"API at {target} did not come up")
+        await asyncio.sleep(0.2)
+
+def parse_metrics(text: str) -> dict:
+    """LLM call and gateway counters from a /metrics scrape."""
+    counts = {"llm_calls": 0.0, "fallback_calls": 0.0, "gateway": {}}
+    for line in text.splitlines():
+        m = _METRIC.match(line)
+        if not m:
+            continue
+        name, labels, value = m.group(1), dict(_LABEL.findall(m.group(2))), float(m.group(3))
+        if name == "omni_llm_calls_total":
+            counts["llm_calls"] += value
+            if labels.get("fallback") == "true":
+                counts["fallback_calls"] += value
+        elif name == "omni_component_stat" and labels.get("component") == "llm_gateway":
+            counts["gateway"][labels["stat"]] = value
+    return counts
+
+def metrics_delta(before: dict, after: dict) -> dict:
+    return {
+        "llm_calls": after["llm_calls"] - before["llm_calls"],
+        "fallback_calls": after["fallback_calls"] - before["fallback_calls"],
+        # Counters only; gauges such as breaker state are reported as they ended
+        "gateway": {k: v - before["gateway"].get(k, 0) if not k.endswith(("_open", "_p95_ms")) else v
+                    for k, v in after["gateway"].items()},
+    }
+
+async def chat(client: httpx.AsyncClient, target: str, query: str, timeout: float, results: list, started_at: float):
+    start = time.perf_counter()
+    outcome = {"query": query, "sent_s": round(start - started_at, 3)}
+    try:
+        response = await client.post(f"{target}/api/chat", json={"message": query}, timeout=timeout)
+        outcome["status"] = response.status_code
+        if response.status_code != 200:
+            outcome["error"] = f"http_{response.status_code}"
+    except httpx.TimeoutException:
+        outcome["error"] = "timeout"
+    except httpx.HTTPError as e:
+        outcome["error"] = type(e).__name__
+    outcome["latency_ms"] = (time.perf_counter() - start) * 1000
+    results.append(outcome)
+
+async def open_loop(client, target, queries, rate: float, duration: float, timeout: float, rng):
+    """Arrivals at a fixed rate whether or not earlier requests have finished."""
+    results, tasks = [], []
+    started_at = time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = started_at + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(chat(client, target, rng.choice(queries), timeout, results, started_at)))
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - started_at
+
+async def closed_loop(client, target, queries, users: int, duration: float, timeout: float, rng):
+    """`users` clients, each sending its next question as soon as the last one is answered."""
+    results = []
+    started_at = time.perf_counter()
+    stop_at = started_at + duration
+
+    async def user():
+        while time.perf_counter() < stop_at:
+            await chat(client, target, rng.choice(queries), timeout, results, started_at)
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    return results, time.perf_counter() - started_at
+
+def summarize(results: list, elapsed: float) -> dict:
+    ok = [r["latency_ms"] for r in results if "error" not in r]
+    errors = {}
+    for r in results:
+        if "error" in r:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ok), 1) if ok else 0.0,
+            "p50": round(percentile(ok, 50), 1),
+            "p95": round(percentile(ok, 95), 1),
+            "p99": round(percentile(ok, 99), 1),
+            "max": round(max(ok), 1) if ok else 0.0,
+        },
+    }
+
+def print_report(summary: dict, llm: dict, stub_stats: dict):
+    lat = summary["latency_ms"]
+    print("\n=== load test ===")
+    print(f"requests      {summary['requests']} ({summary['succeeded']} ok) in {summary['elapsed_s']}s")
+    print(f"throughput    {summary['throughput_rps']} req/s")
+    print(f"latency ms    p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    print(f"error rate    {summary['error_rate']:.2%}  {summary['errors'] or ''}")
+    if llm:
+        print(f"LLM calls     {llm['llm_calls']:.0f}, {llm['fallback_calls']:.0f} answered by the fallback model")
+        gateway = llm["gateway"]
+        print(f"gateway       retries {gateway.get('retries', 0):.0f}, "
+              f"primary 429s {gateway.get('primary_rate_limited', 0):.0f}, "
+              f"fallback 429s {gateway.get('fallback_rate_limited', 0):.0f}")
+    if stub_stats:
+        print(f"stub LLM      {stub_stats['requests']} calls, {stub_stats['rate_limited']} answered 429, "
+              f"by model {stub_stats['by_model']}")
+
+async def main_async(args):
+    rng = random.Random(args.seed)
+    queries = list(SCENARIOS) + generate_corpus(args.mix_size, seed=args.seed)
+    processes, stub = [], None
+    target = args.target
+    try:
+        if target is None:
+            llm_url = args.llm_url
+            if llm_url is None:
+                port = free_port()
+                stub = serve_in_thread(StubSettings(args.llm_latency, args.llm_jitter, args.rate_limit,
+                                                    args.rate_limit_model, args.retry_after, args.seed), port=port)
+                llm_url = f"http://127.0.0.1:{port}"
+            api_port = free_port()
+            processes.append(start_api(api_port, llm_url, args.workers))
+            target = f"http://127.0.0.1:{api_port}"
+
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(limits=limits) as client:
+            await wait_ready(client, target)
+            before = parse_metrics((await client.get(f"{target}/metrics")).text)
+            if args.rate:
+                results, elapsed = await open_loop(client, target, queries, args.rate, args.duration, args.timeout, rng)
+            else:
+                results, elapsed = await closed_loop(client, target, queries, args.users, args.duration,
+                                                     args.timeout, rng)
+            # With several workers each scrape reaches one of them, so LLM counters are partial there
+            after = parse_metrics((await client.get(f"{target}/metrics")).text)
+            stub_stats = {}
+            if stub is not None:
+                stub_stats = (await client.get(f"{llm_url}/stats")).json()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+        if stub is not None:
+            stub.should_exit = True
+
+    summary = summarize(results, elapsed)
+    llm = metrics_delta(before, after)
+    print_report(summary, llm, stub_stats)
+    return {
+        "meta": {"target": args.target or "local", "mode": "open" if args.rate else "closed", "rate": args.rate,
+                 "users": None if args.rate else args.users, "duration_s": args.duration, "workers": args.workers,
+                 "llm_latency_s": args.llm_latency, "llm_jitter_s": args.llm_jitter, "rate_limit": args.rate_limit,
+                 "rate_limit_model": args.rate_limit_model, "queries_in_mix": len(queries), "seed": args.seed,
+                 "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "summary": summary,
+        "llm": llm,
+        "stub_llm": stub_stats,
+        "requests": results if args.keep_requests else [],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/chat with a stub LLM.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rate", type=float, help="arrivals per second (open loop)")
+    mode.add_argument("--users", type=int, default=10, help="concurrent users (closed loop, default)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds before a request counts as timed out")
+    parser.add_argument("--mix-size", type=int, default=50, help="generated questions added to the demo scenarios")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the local API")
+    parser.add_argument("--target", help="base URL of a running API instead of starting one")
+    parser.add_argument("--llm-url", help="an LLM server to use instead of starting the stub")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="stub seconds per LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="stub +- seconds around --llm-latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of stub LLM calls answered with 429")
+    parser.add_argument("--rate-limit-model", help="only the stub's calls for this model get 429s")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds on stub 429s")
+    parser.add_argument("--keep-requests", action="store_true", help="include every request in the output file")
+    parser.add_argument("--out", default=DEFAULT_OUT, help="results file (JSON)")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Local stand-in for the Groq chat completions API, for load tests.
+
+Serves POST /openai/v1/chat/completions (plain and streamed) with the
+StubBackend's canned planner/SQL/synthesis answers, after a configurable
+latency, and answers a configurable share of calls with 429 so the gateway's
+rate-limit handling and model fallback get exercised. Point the API at it with
+GROQ_BASE_URL=http://127.0.0.1:<port>. GET /stats returns its counters.
+
+    python benchmarks/stub_llm_server.py --port 8100 --latency 0.4 --jitter 0.2 --rate-limit 0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from src.llm_backends import StubBackend
+
+class StubSettings:
+    def __init__(self, latency=0.3, jitter=0.1, rate_limit=0.0, rate_limit_model=None, retry_after=1.0, seed=None):
+        self.latency = latency                    # seconds before a response (or its first chunk)
+        self.jitter = jitter                      # +- uniform seconds around latency
+        self.rate_limit = rate_limit              # share of calls answered with 429
+        self.rate_limit_model = rate_limit_model  # only this model gets 429s, if set
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+def create_app(settings: StubSettings) -> FastAPI:
+    app = FastAPI(title="Stub LLM")
+    stub = StubBackend()
+    lock = threading.Lock()
+    stats = {"requests": 0, "streamed": 0, "rate_limited": 0, "by_model": {}}
+
+    def count(key, model=None):
+        with lock:
+            stats[key] += 1
+            if model is not None:
+                stats["by_model"][model] = stats["by_model"].get(model, 0) + 1
+
+    @app.post("/openai/v1/chat/completions")
+    async def completions(request: Request):
+        kwargs = await request.json()
+        model = kwargs.get("model", "stub")
+        count("requests", model)
+        delay = max(0.0, settings.latency + settings.random.uniform(-settings.jitter, settings.jitter))
+        await asyncio.sleep(delay)
+        limited = settings.rate_limit_model in (None, model) and settings.random.random() < settings.rate_limit
+        if limited:
+            count("rate_limited")
+            return JSONResponse(
+                {"error": {"message": f"Rate limit reached for model {model}", "type": "tokens",
+                           "code": "rate_limit_exceeded"}},
+                status_code=429, headers={"retry-after": f"{settings.retry_after:g}"})
+
+        content = stub.answer(kwargs)
+        prompt_tokens = sum(len(m.get("content") or "") for m in kwargs.get("messages") or []) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                 "total_tokens": prompt_tokens + len(content) // 4}
+        created = int(time.time())
+        if not kwargs.get("stream"):
+            return {"id": "stub", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": usage}
+
+        count("streamed")
+        words = content.split(" ")
+
+        async def events():
+            for i, word in enumerate(words):
+                last = i == len(words) - 1
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": word if last else word + " "},
+                                      "finish_reason": "stop" if last else None}]}
+                if last:
+                    chunk["x_groq"] = {"id": "stub", "usage": usage}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats_endpoint():
+        with lock:
+            return json.loads(json.dumps(stats))
+
+    return app
+
+def serve_in_thread(settings: StubSettings, host: str = "127.0.0.1", port: int = 8100):
+    """Runs the stub in a daemon thread; returns the uvicorn server once it accepts connections."""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(create_app(settings), host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="stub-llm", daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("stub LLM server did not start")
+        time.sleep(0.05)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Groq-compatible LLM server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+- seconds around --latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--rate-limit-model", help="only rate-limit this model")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds sent with 429s")
+    args = parser.parse_args()
+
+    import uvicorn
+    settings = StubSettings(args.latency, args.jitter, args.rate_limit, args.rate_limit_model, args.retry_after)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,21 @@ interface ChatResponse {
     thought_process: string[];
 }
 
+interface StreamEvent {
+    type: 'start' | 'plan' | 'sql' | 'rows' | 'thought' | 'token' | 'done' | 'error';
+    text?: string;
+    response?: string;
+    thought_process?: string[];
+    message?: string;
+}
+
+// crypto.randomUUID() only exists on secure origins (https, localhost); plain-http LAN hosts get getRandomValues
+function newSessionId(): string {
+    if (typeof crypto.randomUUID === 'function') return crypto.randomUUID();
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
 export default function OmniAgentUI() {
     // Shared send logic for text and voice
     const handleSendWithText = async (textToSubmit: string) => {
@@ -32,18 +47,63 @@ export default function OmniAgentUI() {
         setThoughts([]);
 
         try {
-            const res = await fetch('/api/chat', {
+            // One conversation per tab: a random ID, so no two users ever share session memory
+            if (!sessionIdRef.current) sessionIdRef.current = newSessionId();
+            // Stream progress and answer tokens so the first byte shows up long before synthesis finishes
+            const res = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message: textToSubmit, session_id: 'demo-user' })
+                body: JSON.stringify({ message: textToSubmit, session_id: sessionIdRef.current })
+            });
+            if (!res.ok || !res.body) throw new Error(`Stream failed with status ${res.status}`);
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let answer = '';
+            let final: ChatResponse | null = null;
+            setMessages(prev => [...prev, { role: 'agent', content: '' }]);
+
+            const showAnswer = (content: string) => setMessages(prev => {
+                const next = [...prev];
+                next[next.length - 1] = { role: 'agent', content };
+                return next;
             });
 
-            const data: ChatResponse = await res.json();
-            setThoughts(data.thought_process);
-            setMessages(prev => [...prev, { role: 'agent', content: data.response }]);
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // SSE frames are separated by a blank line
+                let boundary = buffer.indexOf('\n\n');
+                while (boundary !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    boundary = buffer.indexOf('\n\n');
+
+                    const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+                    if (!dataLine) continue;
+                    const event: StreamEvent = JSON.parse(dataLine.slice(6));
+
+                    if (event.type === 'thought' && event.text) {
+                        setThoughts(prev => [...prev, event.text as string]);
+                    } else if (event.type === 'token' && event.text) {
+                        answer += event.text;
+                        showAnswer(answer);
+                    } else if (event.type === 'done') {
+                        final = { response: event.response ?? answer, thought_process: event.thought_process ?? [] };
+                        showAnswer(final.response);
+                        setThoughts(final.thought_process);
+                    } else if (event.type === 'error') {
+                        throw new Error(event.message);
+                    }
+                }
+            }
+            if (!final) throw new Error('Stream ended before the answer was complete');
 
             // Secure one-time speech logic
-            const plainText = data.response.replace(/<[^>]*>/g, '').trim();
+            const plainText = final.response.replace(/<[^>]*>/g, '').trim();
             if (plainText !== lastSpokenRef.current) {
                 lastSpokenRef.current = plainText;
                 speak(plainText);
@@ -51,7 +111,11 @@ export default function OmniAgentUI() {
 
         } catch (error) {
             console.error(error);
-            setMessages(prev => [...prev, { role: 'agent', content: "Sorry, I lost connection to the Matrix." }]);
+            // Drop the empty bubble of an answer that never started streaming
+            setMessages(prev => [
+                ...prev.filter((m, i) => !(i === prev.length - 1 && m.role === 'agent' && m.content === '')),
+                { role: 'agent', content: "Sorry, I lost connection to the Matrix." }
+            ]);
         } finally {
             setLoading(false);
             isProcessingVoiceRef.current = false;
@@ -68,6 +132,7 @@ export default function OmniAgentUI() {
     const [permissionError, setPermissionError] = useState<string | null>(null);
     const recognitionRef = useRef<any>(null);
     const isProcessingVoiceRef = useRef<boolean>(false);
+    const sessionIdRef = useRef<string | null>(null);
     const lastSpokenRef = useRef<string>("");
 
     const messagesEndRef = useRef<HTMLDivElement>(null);
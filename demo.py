@@ -9,6 +9,29 @@ from src.orchestrator_groq import run_omni_query
 # Load env if present
 load_dotenv()
 
+# Scenario 1: The Missing Package & Ticket
+QUERY_MISSING_PACKAGE = (
+    "I am Alice Johnson. I ordered a 'Gaming Monitor' recently, but it hasn't arrived. "
+    "I opened a ticket about this. Can you tell me where the package is right now "
+    "and the status of my ticket?"
+)
+
+# Scenario 2: Refund Verification
+QUERY_REFUND = (
+    "I am Alice Johnson. I returned a 'Wireless Mouse'. "
+    "Can you check if a refund transaction appears in my wallet for that order, "
+    "and if the support ticket is marked as resolved?"
+)
+
+# Scenario 3: Cross-Domain Logistics
+QUERY_CROSS_DOMAIN = (
+    "Check on Bob Smith. Does he have any orders currently processing? "
+    "Also, based on his payment history, what is his current wallet balance?"
+)
+
+# Shared with the benchmark suite (benchmarks/bench_pipeline.py)
+SCENARIOS = [QUERY_MISSING_PACKAGE, QUERY_REFUND, QUERY_CROSS_DOMAIN]
+
 def main():
     print("Initializing Omni-Retail Multi-Agent System (Pure Groq)...")
     
@@ -16,27 +39,7 @@ def main():
         print("WARNING: GROQ_API_KEY not found in environment variables.")
         return
 
-    # Scenario 1: The Missing Package & Ticket
-    query1 = (
-        "I am Alice Johnson. I ordered a 'Gaming Monitor' recently, but it hasn't arrived. "
-        "I opened a ticket about this. Can you tell me where the package is right now "
-        "and the status of my ticket?"
-    )
-    
-    # Scenario 2: Refund Verification
-    query2 = (
-        "I am Alice Johnson. I returned a 'Wireless Mouse'. "
-        "Can you check if a refund transaction appears in my wallet for that order, "
-        "and if the support ticket is marked as resolved?"
-    )
-    
-    # Scenario 3: Cross-Domain Logistics
-    query3 = (
-        "Check on Bob Smith. Does he have any orders currently processing? "
-        "Also, based on his payment history, what is his current wallet balance?"
-    )
-
-    queries = [query1, query2, query3]
+    queries = SCENARIOS
     
     print("\n" + "="*50)
     print("STARTING DEMONSTRATION")
@@ -1,192 +1,345 @@
-import sqlite3
+"""Generates the four platform databases with synthetic, cross-consistent data.
+
+    python setup_dbs.py                                   # demo dataset (500 users, 2000 orders)
+    python setup_dbs.py --users 1000000 --orders 10000000 --tickets 2000000 --processes 4
+
+Orders are drawn once into compact arrays (user, product, status, day) that
+every database reads, so ShipStream, PayGuard and CareDesk always agree with
+ShopCore. Each database is written in one transaction with bulk-load pragmas,
+rows are streamed into executemany in chunks, and with --processes > 1 each
+database file is built by its own process. Files are built next to their
+target and renamed into place once complete.
+"""
 import os
+import re
+import sys
+import time
 import random
-from datetime import datetime, timedelta
+import sqlite3
+import argparse
+import itertools
+from array import array
+from datetime import date, datetime, timedelta
+from multiprocessing import Pool
 from faker import Faker
-
-fake = Faker()
-Faker.seed(42)
-random.seed(42)
+from src.index_advisor import create_baseline_indexes
 
 DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
 
-# Production-scale configuration (Massive Dataset Upgrade)
+# Defaults reproduce the original demo dataset size
 NUM_USERS = 500
 NUM_PRODUCTS = 100
 NUM_ORDERS = 2000
 NUM_WAREHOUSES = 20
-NUM_TICKETS = 500 # Increased
+NUM_TICKETS = 500
+CHUNK_SIZE = 50000
+
+# Repeats weight the draw towards Shipped/Delivered, so several codes share a name: test names, not codes
+ORDER_STATUSES = ["Processing", "Shipped", "Delivered", "Delivered", "Shipped"]
+SHIPPED = ORDER_STATUSES.index("Shipped")
+ORDER_WINDOW_DAYS = 30
 
-def create_connection(db_name):
-    db_path = os.path.join(DATA_DIR, db_name)
+SCHEMAS = {
+    "DB_ShopCore.db": [
+        "CREATE TABLE Users (UserID INTEGER PRIMARY KEY, Name TEXT, Email TEXT, PremiumStatus TEXT)",
+        "CREATE TABLE Products (ProductID INTEGER PRIMARY KEY, Name TEXT, Category TEXT, Price REAL)",
+        "CREATE TABLE Orders (OrderID INTEGER PRIMARY KEY, UserID INTEGER, ProductID INTEGER, OrderDate TEXT, Status TEXT)",
+    ],
+    "DB_ShipStream.db": [
+        "CREATE TABLE Shipments (ShipmentID INTEGER PRIMARY KEY, OrderID INTEGER, TrackingNumber TEXT, EstimatedArrival TEXT)",
+        "CREATE TABLE Warehouses (WarehouseID INTEGER PRIMARY KEY, Location TEXT, ManagerName TEXT)",
+        "CREATE TABLE TrackingEvents (EventID INTEGER PRIMARY KEY, ShipmentID INTEGER, WarehouseID INTEGER, Timestamp TEXT, StatusUpdate TEXT)",
+    ],
+    "DB_PayGuard.db": [
+        "CREATE TABLE Wallets (WalletID INTEGER PRIMARY KEY, UserID INTEGER, Balance REAL, Currency TEXT)",
+        "CREATE TABLE Transactions (TransactionID INTEGER PRIMARY KEY, WalletID INTEGER, OrderID INTEGER, Amount REAL, Type TEXT)",
+        "CREATE TABLE PaymentMethods (MethodID INTEGER PRIMARY KEY, WalletID INTEGER, Provider TEXT, ExpiryDate TEXT)",
+    ],
+    "DB_CareDesk.db": [
+        "CREATE TABLE Tickets (TicketID INTEGER PRIMARY KEY, UserID INTEGER, ReferenceID INTEGER, IssueType TEXT, Status TEXT)",
+        "CREATE TABLE TicketMessages (MessageID INTEGER PRIMARY KEY, TicketID INTEGER, Sender TEXT, Content TEXT, Timestamp TEXT)",
+        "CREATE TABLE SatisfactionSurveys (SurveyID INTEGER PRIMARY KEY, TicketID INTEGER, Rating INTEGER, Comments TEXT)",
+    ],
+}
+
+def create_connection(db_path):
+    """Fresh database file tuned for a one-shot bulk load (no journal, no fsync)."""
     if os.path.exists(db_path):
         os.remove(db_path)
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MiB, for the index builds
     return conn
 
-def generate_production_data():
-    print(f"Generating Comprehensive Production Data ({NUM_USERS} users, {NUM_ORDERS} orders)...")
-    
-    # 1. Users
-    users = []
-    users.append((1, "Alice Johnson", "alice.j@example.com", "Yes"))
-    for i in range(2, NUM_USERS + 1):
-        users.append((i, fake.name(), fake.unique.email(), random.choice(["Yes", "No"])))
-        
-    # 2. Products
-    products = []
-    products.append((1, "Gaming Monitor", "Electronics", 499.99))
-    product_names = ["Laptop", "Smartphone", "Headphones", "Desk Lamp", "Office Chair", "Keyboard", "Mouse", "Webcam"]
-    for i in range(2, NUM_PRODUCTS + 1):
-        products.append((i, f"{random.choice(['Pro', 'Ultra', 'Basic'])} {random.choice(product_names)}", "Retail", round(random.uniform(20, 1500), 2)))
-        
-    # 3. Warehouses
-    warehouses = []
-    for i in range(1, NUM_WAREHOUSES + 1):
-        warehouses.append((i, fake.city(), fake.name()))
-        
-    # 4. Orders, Shipments, Tracking
-    orders = []
-    shipments = []
-    tracking = []
-    trk_id_counter = 1
-    
-    # Alice's fixed order
-    orders.append((101, 1, 1, "2026-01-10", "Shipped"))
-    shipments.append((5001, 101, "TRK-ALICE-101", "2026-01-20"))
-    tracking.append((trk_id_counter, 5001, 1, "2026-01-11 08:00:00", "Package Picked Up"))
-    trk_id_counter += 1
-    tracking.append((trk_id_counter, 5001, 1, "2026-01-12 14:00:00", "In Transit - Distribution Center"))
-    trk_id_counter += 1
-
-    for i in range(2, NUM_ORDERS + 1):
-        order_id = i + 101
-        user_id = random.randint(1, NUM_USERS)
-        prod_id = random.randint(1, NUM_PRODUCTS)
-        # Higher chance of being Delivered/Shipped for 2000 orders
-        status = random.choice(["Processing", "Shipped", "Delivered", "Delivered", "Shipped"])
-        date = fake.date_between(start_date='-30d', end_date='today')
-        orders.append((order_id, user_id, prod_id, str(date), status))
-        
-        if status in ["Shipped", "Delivered"]:
-            shipment_id = 5000 + order_id
-            trk = fake.bothify(text='TRK-##########').upper()
-            shipments.append((shipment_id, order_id, trk, str(date + timedelta(days=5))))
-            tracking.append((trk_id_counter, shipment_id, random.randint(1, NUM_WAREHOUSES), str(date + timedelta(days=1)), "Picked Up"))
-            trk_id_counter += 1
-            if status == "Delivered":
-                tracking.append((trk_id_counter, shipment_id, random.randint(1, NUM_WAREHOUSES), str(date + timedelta(days=4)), "Delivered"))
+def insert_chunks(conn, table, rows, chunk_size=CHUNK_SIZE) -> int:
+    """Streams an iterable of tuples into `table` in chunks; returns the row count."""
+    total = 0
+    sql = None
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return total
+        if sql is None:
+            sql = f"INSERT INTO {table} VALUES ({','.join('?' * len(chunk[0]))})"
+        conn.executemany(sql, chunk)
+        total += len(chunk)
+
+def order_id(pos: int) -> int:
+    """OrderID of the order at array position `pos` (position 0 is Alice's order 101)."""
+    return 101 if pos == 0 else pos + 102
+
+class OrderSkeleton:
+    """Who bought what, in which state and when, for every order, as parallel arrays."""
+    def __init__(self, users, products, statuses, days):
+        self.users = users
+        self.products = products
+        self.statuses = statuses
+        self.days = days
+
+    def __len__(self):
+        return len(self.users)
+
+def build_orders(cfg) -> OrderSkeleton:
+    rng = random.Random(cfg.seed)
+    # Alice's fixed order 101 (values other than the user are ignored by the builders)
+    users, products = array("i", [1]), array("i", [1])
+    statuses, days = array("b", [SHIPPED]), array("h", [0])
+    user_ids, product_ids = range(1, cfg.users + 1), range(1, cfg.products + 1)
+    status_codes, day_offsets = range(len(ORDER_STATUSES)), range(ORDER_WINDOW_DAYS + 1)
+    remaining = cfg.orders - 1
+    while remaining > 0:
+        # Fixed draw size, so the data does not depend on --chunk-size
+        n = min(CHUNK_SIZE, remaining)
+        users.extend(rng.choices(user_ids, k=n))
+        products.extend(rng.choices(product_ids, k=n))
+        statuses.extend(rng.choices(status_codes, k=n))
+        days.extend(rng.choices(day_offsets, k=n))
+        remaining -= n
+    return OrderSkeleton(users, products, statuses, days)
+
+def user_order_index(orders: OrderSkeleton, num_users: int):
+    """CSR index: positions of user u's orders are positions[start[u]:start[u + 1]], ascending."""
+    start = array("q", bytes(8 * (num_users + 2)))
+    for u in orders.users:
+        start[u + 1] += 1
+    for u in range(1, num_users + 2):
+        start[u] += start[u - 1]
+    fill = array("q", start)
+    positions = array("i", bytes(4 * len(orders)))
+    for pos, u in enumerate(orders.users):
+        positions[fill[u]] = pos
+        fill[u] += 1
+    return start, positions
+
+def _day_strings(offset: int):
+    """OrderDate strings per day offset in the order window, shifted by `offset` days."""
+    first = date.today() - timedelta(days=ORDER_WINDOW_DAYS)
+    return [str(first + timedelta(days=d + offset)) for d in range(ORDER_WINDOW_DAYS + 1)]
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z]", "", text.lower())
+
+def populate_shopcore(conn, cfg, orders, rng, fake):
+    first_names = sorted({fake.first_name() for _ in range(1000)})
+    last_names = sorted({fake.last_name() for _ in range(1000)})
+
+    def users():
+        yield (1, "Alice Johnson", "alice.j@example.com", "Yes")
+        for i in range(2, cfg.users + 1):
+            first, last = rng.choice(first_names), rng.choice(last_names)
+            # Demo queries identify Alice by name, so keep it unique
+            while (first, last) == ("Alice", "Johnson"):
+                first, last = rng.choice(first_names), rng.choice(last_names)
+            yield (i, f"{first} {last}", f"{_slug(first)}.{_slug(last)}{i}@example.com", rng.choice(["Yes", "No"]))
+
+    def products():
+        yield (1, "Gaming Monitor", "Electronics", 499.99)
+        names = ["Laptop", "Smartphone", "Headphones", "Desk Lamp", "Office Chair", "Keyboard", "Mouse", "Webcam"]
+        for i in range(2, cfg.products + 1):
+            yield (i, f"{rng.choice(['Pro', 'Ultra', 'Basic'])} {rng.choice(names)}", "Retail", round(rng.uniform(20, 1500), 2))
+
+    def order_rows():
+        yield (101, 1, 1, "2026-01-10", "Shipped")
+        order_dates = _day_strings(0)
+        for pos in range(1, len(orders)):
+            yield (order_id(pos), orders.users[pos], orders.products[pos],
+                   order_dates[orders.days[pos]], ORDER_STATUSES[orders.statuses[pos]])
+
+    return {
+        "Users": insert_chunks(conn, "Users", users(), cfg.chunk_size),
+        "Products": insert_chunks(conn, "Products", products(), cfg.chunk_size),
+        "Orders": insert_chunks(conn, "Orders", order_rows(), cfg.chunk_size),
+    }
+
+def populate_shipstream(conn, cfg, orders, rng, fake):
+    warehouses = [(i, fake.city(), fake.name()) for i in range(1, cfg.warehouses + 1)]
+    arrival, picked_up, in_transit, delivered = _day_strings(5), _day_strings(1), _day_strings(2), _day_strings(4)
+    warehouse_ids = range(1, cfg.warehouses + 1)
+
+    def shipped_positions():
+        for pos in range(1, len(orders)):
+            if ORDER_STATUSES[orders.statuses[pos]] in ("Shipped", "Delivered"):
+                yield pos
+
+    def shipments():
+        yield (5001, 101, "TRK-ALICE-101", "2026-01-20")
+        for pos in shipped_positions():
+            oid = order_id(pos)
+            yield (5000 + oid, oid, f"TRK-{rng.randrange(10 ** 10):010d}", arrival[orders.days[pos]])
+
+    def tracking():
+        yield (1, 5001, 1, "2026-01-11 08:00:00", "Package Picked Up")
+        yield (2, 5001, 1, "2026-01-12 14:00:00", "In Transit - Distribution Center")
+        event_id = 3
+        for pos in shipped_positions():
+            shipment_id, day = 5000 + order_id(pos), orders.days[pos]
+            yield (event_id, shipment_id, rng.choice(warehouse_ids), picked_up[day], "Picked Up")
+            if ORDER_STATUSES[orders.statuses[pos]] == "Delivered":
+                yield (event_id + 1, shipment_id, rng.choice(warehouse_ids), delivered[day], "Delivered")
             else:
-                tracking.append((trk_id_counter, shipment_id, random.randint(1, NUM_WAREHOUSES), str(date + timedelta(days=2)), "In Transit"))
-            trk_id_counter += 1
-
-    # 5. PayGuard: Wallets, Transactions, PaymentMethods
-    wallets = []
-    transactions = []
-    payment_methods = []
-    tx_id_counter = 30001
-    
-    # Alice's wallet
-    wallets.append((10001, 1, 1500.00, "USD"))
-    payment_methods.append((20001, 10001, "Visa", "12/28"))
-    transactions.append((tx_id_counter, 10001, 101, 499.99, "Debit"))
-    tx_id_counter += 1
-
-    for i in range(1, NUM_USERS + 1):
-        if i == 1: continue # Alice already added
-        wallet_id = 10000 + i
-        wallets.append((wallet_id, i, round(random.uniform(100, 5000), 2), "USD"))
-        payment_methods.append((20000 + i, wallet_id, random.choice(["Visa", "MasterCard", "Amex"]), "10/27"))
-        
-        # Add transactions for ALL orders
-        for o in orders:
-            if o[1] == i:
-                transactions.append((tx_id_counter, wallet_id, o[0], round(random.uniform(20, 1000), 2), "Debit"))
-                tx_id_counter += 1
-
-    # 6. CareDesk: Tickets, Messages, Surveys
-    tickets = []
-    messages = []
-    surveys = []
-    msg_id_counter = 1
-    srv_id_counter = 8001
-    
-    # Alice's ticket
-    tickets.append((7001, 1, 101, "Late Delivery", "Open"))
-    messages.append((msg_id_counter, 7001, "Alice Johnson", "Where is my monitor? It has been 10 days!", "2026-01-11 10:00:00"))
-    msg_id_counter += 1
-    messages.append((msg_id_counter, 7001, "Support Agent", "We are looking into the shipment delay at the Distribution Center.", "2026-01-11 11:30:00"))
-    msg_id_counter += 1
-    surveys.append((srv_id_counter, 7001, 4, "Good response, but item still missing."))
-    srv_id_counter += 1
-
-    for i in range(2, NUM_TICKETS + 1):
-        ticket_id = 7000 + i
-        order_obj = random.choice(orders)
-        user_id = order_obj[1]
-        order_ref = order_obj[0]
-        issue = random.choice(["Refund", "Status", "Damaged", "Missing Item"])
-        status = random.choice(["Open", "Closed", "Closed"])
-        tickets.append((ticket_id, user_id, order_ref, issue, status))
-        
-        # Messages
-        num_msgs = random.randint(1, 3)
-        for _ in range(num_msgs):
-            messages.append((msg_id_counter, ticket_id, random.choice(["User", "Agent", "System"]), fake.sentence(), str(datetime.now() - timedelta(hours=random.randint(1, 100)))))
-            msg_id_counter += 1
-        
-        # Surveys for Closed tickets
-        if status == "Closed":
-            surveys.append((srv_id_counter, ticket_id, random.randint(1, 5), fake.sentence()))
-            srv_id_counter += 1
-
-    # --- DB POPULATION ---
-    # ShopCore
-    conn = create_connection("DB_ShopCore.db")
-    c = conn.cursor()
-    c.execute('CREATE TABLE Users (UserID INTEGER PRIMARY KEY, Name TEXT, Email TEXT, PremiumStatus TEXT)')
-    c.execute('CREATE TABLE Products (ProductID INTEGER PRIMARY KEY, Name TEXT, Category TEXT, Price REAL)')
-    c.execute('CREATE TABLE Orders (OrderID INTEGER PRIMARY KEY, UserID INTEGER, ProductID INTEGER, OrderDate TEXT, Status TEXT)')
-    c.executemany('INSERT INTO Users VALUES (?,?,?,?)', users)
-    c.executemany('INSERT INTO Products VALUES (?,?,?,?)', products)
-    c.executemany('INSERT INTO Orders VALUES (?,?,?,?,?)', orders)
-    conn.commit(); conn.close()
-    
-    # ShipStream
-    conn = create_connection("DB_ShipStream.db")
-    c = conn.cursor()
-    c.execute('CREATE TABLE Shipments (ShipmentID INTEGER PRIMARY KEY, OrderID INTEGER, TrackingNumber TEXT, EstimatedArrival TEXT)')
-    c.execute('CREATE TABLE Warehouses (WarehouseID INTEGER PRIMARY KEY, Location TEXT, ManagerName TEXT)')
-    c.execute('CREATE TABLE TrackingEvents (EventID INTEGER PRIMARY KEY, ShipmentID INTEGER, WarehouseID INTEGER, Timestamp TEXT, StatusUpdate TEXT)')
-    c.executemany('INSERT INTO Shipments VALUES (?,?,?,?)', shipments)
-    c.executemany('INSERT INTO Warehouses VALUES (?,?,?)', warehouses)
-    c.executemany('INSERT INTO TrackingEvents VALUES (?,?,?,?,?)', tracking)
-    conn.commit(); conn.close()
-    
-    # PayGuard
-    conn = create_connection("DB_PayGuard.db")
-    c = conn.cursor()
-    c.execute('CREATE TABLE Wallets (WalletID INTEGER PRIMARY KEY, UserID INTEGER, Balance REAL, Currency TEXT)')
-    c.execute('CREATE TABLE Transactions (TransactionID INTEGER PRIMARY KEY, WalletID INTEGER, OrderID INTEGER, Amount REAL, Type TEXT)')
-    c.execute('CREATE TABLE PaymentMethods (MethodID INTEGER PRIMARY KEY, WalletID INTEGER, Provider TEXT, ExpiryDate TEXT)')
-    c.executemany('INSERT INTO Wallets VALUES (?,?,?,?)', wallets)
-    c.executemany('INSERT INTO Transactions VALUES (?,?,?,?,?)', transactions)
-    c.executemany('INSERT INTO PaymentMethods VALUES (?,?,?,?)', payment_methods)
-    conn.commit(); conn.close()
-    
-    # CareDesk
-    conn = create_connection("DB_CareDesk.db")
-    c = conn.cursor()
-    c.execute('CREATE TABLE Tickets (TicketID INTEGER PRIMARY KEY, UserID INTEGER, ReferenceID INTEGER, IssueType TEXT, Status TEXT)')
-    c.execute('CREATE TABLE TicketMessages (MessageID INTEGER PRIMARY KEY, TicketID INTEGER, Sender TEXT, Content TEXT, Timestamp TEXT)')
-    c.execute('CREATE TABLE SatisfactionSurveys (SurveyID INTEGER PRIMARY KEY, TicketID INTEGER, Rating INTEGER, Comments TEXT)')
-    c.executemany('INSERT INTO Tickets VALUES (?,?,?,?,?)', tickets)
-    c.executemany('INSERT INTO TicketMessages VALUES (?,?,?,?,?)', messages)
-    c.executemany('INSERT INTO SatisfactionSurveys VALUES (?,?,?,?)', surveys)
-    conn.commit(); conn.close()
-    
-    print("Omni-Production Data Generated. 2000 Orders, 500 Tickets with Surveys.")
+                yield (event_id + 1, shipment_id, rng.choice(warehouse_ids), in_transit[day], "In Transit")
+            event_id += 2
+
+    return {
+        "Shipments": insert_chunks(conn, "Shipments", shipments(), cfg.chunk_size),
+        "Warehouses": insert_chunks(conn, "Warehouses", warehouses, cfg.chunk_size),
+        "TrackingEvents": insert_chunks(conn, "TrackingEvents", tracking(), cfg.chunk_size),
+    }
+
+def populate_payguard(conn, cfg, orders, rng, fake):
+    start, positions = user_order_index(orders, cfg.users)
+
+    def wallets():
+        yield (10001, 1, 1500.00, "USD")
+        for i in range(2, cfg.users + 1):
+            yield (10000 + i, i, round(rng.uniform(100, 5000), 2), "USD")
+
+    def payment_methods():
+        yield (20001, 10001, "Visa", "12/28")
+        for i in range(2, cfg.users + 1):
+            yield (20000 + i, 10000 + i, rng.choice(["Visa", "MasterCard", "Amex"]), "10/27")
+
+    def transactions():
+        yield (30001, 10001, 101, 499.99, "Debit")
+        tx_id = 30002
+        # One debit per order, grouped by the paying user's wallet
+        for i in range(2, cfg.users + 1):
+            for pos in positions[start[i]:start[i + 1]]:
+                yield (tx_id, 10000 + i, order_id(pos), round(rng.uniform(20, 1000), 2), "Debit")
+                tx_id += 1
+
+    return {
+        "Wallets": insert_chunks(conn, "Wallets", wallets(), cfg.chunk_size),
+        "Transactions": insert_chunks(conn, "Transactions", transactions(), cfg.chunk_size),
+        "PaymentMethods": insert_chunks(conn, "PaymentMethods", payment_methods(), cfg.chunk_size),
+    }
+
+def populate_caredesk(conn, cfg, orders, rng, fake):
+    sentences = [fake.sentence() for _ in range(1000)]
+    now = datetime.now()
+    sent_at = [str(now - timedelta(hours=h)) for h in range(1, 101)]
+    counts = {"Tickets": 1, "TicketMessages": 2, "SatisfactionSurveys": 1}
+
+    conn.execute("INSERT INTO Tickets VALUES (7001, 1, 101, 'Late Delivery', 'Open')")
+    conn.executemany("INSERT INTO TicketMessages VALUES (?,?,?,?,?)", [
+        (1, 7001, "Alice Johnson", "Where is my monitor? It has been 10 days!", "2026-01-11 10:00:00"),
+        (2, 7001, "Support Agent", "We are looking into the shipment delay at the Distribution Center.", "2026-01-11 11:30:00"),
+    ])
+    conn.execute("INSERT INTO SatisfactionSurveys VALUES (8001, 7001, 4, 'Good response, but item still missing.')")
+
+    # Tickets, their messages and surveys come from one draw, so they are built chunk by chunk together
+    msg_id, srv_id = 3, 8002
+    for chunk_start in range(2, cfg.tickets + 1, cfg.chunk_size):
+        tickets, messages, surveys = [], [], []
+        for i in range(chunk_start, min(chunk_start + cfg.chunk_size, cfg.tickets + 1)):
+            ticket_id = 7000 + i
+            pos = rng.randrange(len(orders))
+            status = rng.choice(["Open", "Closed", "Closed"])
+            tickets.append((ticket_id, orders.users[pos], order_id(pos), rng.choice(["Refund", "Status", "Damaged", "Missing Item"]), status))
+            for _ in range(rng.randint(1, 3)):
+                messages.append((msg_id, ticket_id, rng.choice(["User", "Agent", "System"]), rng.choice(sentences), rng.choice(sent_at)))
+                msg_id += 1
+            if status == "Closed":
+                surveys.append((srv_id, ticket_id, rng.randint(1, 5), rng.choice(sentences)))
+                srv_id += 1
+        for table, rows in (("Tickets", tickets), ("TicketMessages", messages), ("SatisfactionSurveys", surveys)):
+            counts[table] += insert_chunks(conn, table, rows, cfg.chunk_size)
+    return counts
+
+BUILDERS = {
+    "DB_ShopCore.db": populate_shopcore,
+    "DB_ShipStream.db": populate_shipstream,
+    "DB_PayGuard.db": populate_payguard,
+    "DB_CareDesk.db": populate_caredesk,
+}
+
+_worker_state = {}
+
+def _init_worker(cfg, orders):
+    _worker_state["cfg"] = cfg
+    _worker_state["orders"] = orders
+
+def build_database(db_name: str):
+    """Builds one database file from the shared order skeleton. Returns (db_name, row counts, seconds)."""
+    cfg, orders = _worker_state["cfg"], _worker_state["orders"]
+    started = time.perf_counter()
+    # Each database draws from its own seeded stream, so results don't depend on process scheduling
+    rng = random.Random(f"{cfg.seed}:{db_name}")
+    Faker.seed(cfg.seed)
+    fake = Faker()
+
+    db_path = os.path.join(cfg.data_dir, db_name)
+    tmp_path = db_path + ".building"
+    conn = create_connection(tmp_path)
+    conn.execute("BEGIN")
+    for statement in SCHEMAS[db_name]:
+        conn.execute(statement)
+    counts = BUILDERS[db_name](conn, cfg, orders, rng, fake)
+    # Indexes are cheaper to build once the rows are in; this also commits
+    create_baseline_indexes(conn, db_name)
+    conn.close()
+    os.replace(tmp_path, db_path)
+    return db_name, counts, time.perf_counter() - started
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the four Omni-Retail SQLite databases.")
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--products", type=int, default=NUM_PRODUCTS)
+    parser.add_argument("--orders", type=int, default=NUM_ORDERS)
+    parser.add_argument("--warehouses", type=int, default=NUM_WAREHOUSES)
+    parser.add_argument("--tickets", type=int, default=NUM_TICKETS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per executemany call")
+    parser.add_argument("--processes", type=int, default=1, help="build up to this many database files in parallel")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    args = parser.parse_args(argv)
+    if args.users < 1 or args.products < 1 or args.orders < 1 or args.warehouses < 1 or args.tickets < 1:
+        parser.error("--users, --products, --orders, --warehouses and --tickets must be at least 1")
+    return args
+
+def generate_production_data(cfg=None):
+    cfg = cfg or parse_args([])
+    os.makedirs(cfg.data_dir, exist_ok=True)
+    print(f"Generating Comprehensive Production Data ({cfg.users} users, {cfg.orders} orders, {cfg.tickets} tickets)...")
+    started = time.perf_counter()
+    orders = build_orders(cfg)
+    print(f"Order skeleton ready in {time.perf_counter() - started:.1f}s")
+
+    if cfg.processes > 1:
+        with Pool(min(cfg.processes, len(BUILDERS)), initializer=_init_worker, initargs=(cfg, orders)) as pool:
+            results = pool.map(build_database, list(BUILDERS))
+    else:
+        _init_worker(cfg, orders)
+        results = [build_database(db_name) for db_name in BUILDERS]
+
+    for db_name, counts, seconds in results:
+        summary = ", ".join(f"{count} {table}" for table, count in counts.items())
+        print(f"  {db_name}: {summary} ({seconds:.1f}s)")
+    print(f"Omni-Production Data Generated in {time.perf_counter() - started:.1f}s.")
 
 if __name__ == "__main__":
-    generate_production_data()
+    generate_production_data(parse_args(sys.argv[1:]))
@@ -0,0 +1,80 @@
+"""Single-flight coalescing of identical in-flight chat requests.
+
+Requests with the same normalized query and the same identity (the client's
+session_id) that arrive while a matching pipeline run is still in flight
+attach to it instead of starting their own: they get its progress events
+(replayed from the start) and its result. A run is cancelled only when every
+request waiting on it has gone away.
+
+Streaming and non-streaming requests never share a run: only a streaming run
+gets an emitter, so a plain /api/chat flight synthesizes in one call and keeps
+no events, just its result.
+"""
+import re
+import asyncio
+
+def coalesce_key(query: str, identity: str = None):
+    """Case, whitespace and trailing punctuation don't change the answer."""
+    normalized = re.sub(r"\s+", " ", query.strip().lower()).rstrip(" ?!.")
+    return (identity or "", normalized)
+
+class _Flight:
+    def __init__(self):
+        self.task = None
+        self.events = []
+        self.listeners = []
+        self.waiters = 0
+
+    def emit(self, event):
+        self.events.append(event)
+        for listener in list(self.listeners):
+            listener(event)
+
+class RequestCoalescer:
+    """Shares one execution of `start(emit)` among concurrent callers with the same key and mode."""
+    def __init__(self):
+        self._flights = {}
+        self.stats = {"leaders": 0, "followers": 0, "cancelled": 0}
+
+    async def run(self, key, start, emit=None):
+        """Returns the shared result; `emit` receives every event of the run, including earlier ones.
+
+        Without `emit` the run is started with `start(None)`, i.e. not streamed.
+        """
+        key = (key, emit is not None)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(start(flight.emit if emit is not None else None))
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["followers"] += 1
+
+        if emit is not None:
+            for event in flight.events:
+                emit(event)
+            flight.listeners.append(emit)
+        flight.waiters += 1
+        try:
+            # shield: one caller going away must not cancel the run for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if emit is not None:
+                flight.listeners.remove(emit)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self.stats["cancelled"] += 1
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def snapshot(self) -> dict:
+        total = self.stats["leaders"] + self.stats["followers"]
+        return dict(
+            self.stats,
+            in_flight=len(self._flights),
+            coalesced_rate=round(self.stats["followers"] / total, 3) if total else 0.0,
+        )
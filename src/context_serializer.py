@@ -0,0 +1,92 @@
+"""Compact, token-budgeted encoding of the data-node results for the synthesis prompt.
+
+Each database becomes a small pipe-separated table. Columns whose value is the
+same on every row are hoisted into a `same:` line. A constant join key (an ...ID
+column) is dropped entirely when an earlier database already reported that
+value (e.g. the OrderID ShopCore found); other columns that merely share a name
+across databases, like Status, are always kept.
+Rows are trimmed, largest table first, until the text fits the token budget.
+
+    ## ShipStream (2 of 5 rows)
+    same: ShipmentID=5001
+    Timestamp|StatusUpdate
+    2026-01-11 08:00:00|Package Picked Up
+"""
+import os
+import math
+
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("OMNI_CONTEXT_TOKEN_BUDGET", "3000"))
+DEFAULT_MAX_ROWS = int(os.environ.get("OMNI_CONTEXT_MAX_ROWS", "50"))
+# Llama tokenizers average roughly four characters per token on this kind of text
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    text = str(value)
+    return text.replace("|", "/").replace("\n", " ")
+
+def _is_key(column: str) -> bool:
+    """Join keys mean the same thing in every database; other shared names (Status, Date) do not."""
+    return column.endswith("ID")
+
+def _encode_table(db_name: str, rows, total: int, known: dict) -> str:
+    """Encodes one database's rows; `known` holds join keys already stated by earlier databases."""
+    header = f"## {db_name} ({len(rows)} of {total} rows)" if total > len(rows) else f"## {db_name} ({len(rows)} rows)"
+    if not rows:
+        return header
+    columns = list(rows[0].keys())
+    constant = [c for c in columns if all(r.get(c) == rows[0].get(c) for r in rows)]
+    hoisted = [c for c in constant if known.get(c, object()) != rows[0].get(c)]
+    varying = [c for c in columns if c not in constant]
+
+    lines = [header]
+    if hoisted:
+        lines.append("same: " + ", ".join(f"{c}={_cell(rows[0].get(c))}" for c in hoisted))
+    if varying:
+        lines.append("|".join(varying))
+        for row in rows:
+            lines.append("|".join(_cell(row.get(c)) for c in varying))
+    return "\n".join(lines)
+
+def serialize_context(cumulative_context: dict, omitted_rows: dict = None, token_budget: int = DEFAULT_TOKEN_BUDGET):
+    """Returns (text, rows left out) for the synthesis prompt, fitted to token_budget."""
+    omitted_rows = omitted_rows or {}
+    tables = {}
+    for db_name, result in cumulative_context.items():
+        if isinstance(result, list):
+            tables[db_name] = list(result)
+    shown = {db: len(rows) for db, rows in tables.items()}
+
+    def render():
+        known = {}
+        blocks = []
+        for db_name, result in cumulative_context.items():
+            if db_name not in tables:
+                error = result.get("error") if isinstance(result, dict) else result
+                blocks.append(f"## {db_name}\nerror: {_cell(error)}")
+                continue
+            rows = tables[db_name][:shown[db_name]]
+            total = len(tables[db_name]) + omitted_rows.get(db_name, 0)
+            blocks.append(_encode_table(db_name, rows, total, known))
+            # Only join keys that held for every row are safe to treat as known facts
+            for c in (rows[0].keys() if rows else []):
+                if _is_key(c) and all(r.get(c) == rows[0].get(c) for r in rows):
+                    known.setdefault(c, rows[0].get(c))
+        return "\n\n".join(blocks) if blocks else "(no results)"
+
+    text = render()
+    # Trim the largest table first, keeping at least one row per database
+    while estimate_tokens(text) > token_budget:
+        candidates = [db for db in shown if shown[db] > 1]
+        if not candidates:
+            break
+        largest = max(candidates, key=lambda db: shown[db])
+        shown[largest] = max(1, shown[largest] - max(1, shown[largest] // 4))
+        text = render()
+
+    left_out = sum(len(rows) - shown[db] for db, rows in tables.items()) + sum(omitted_rows.values())
+    return text, left_out
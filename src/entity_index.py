@@ -0,0 +1,326 @@
+"""Resolves customers, products, tracking numbers and tickets named in the user's text to IDs.
+
+Two structures, kept in step with the platform databases:
+
+- in-memory maps from normalized user names, emails, product names and
+  tracking numbers to their IDs, for exact case-insensitive lookups;
+- an FTS5 trigram index in a sidecar database (data/entity_index.db, or
+  OMNI_ENTITY_INDEX) over the same labels, for fuzzy matches (typos,
+  partial names).
+
+A ticket is pre-resolved only from the customer's own tickets: the one on the
+hinted order, or the one whose messages mention a name quoted or capitalised in
+the question.
+
+The result seeds `id_hints` before any SQL is generated. refresh() indexes
+only rows appended since the last run; a table whose older rows changed is
+re-indexed in full. resolve() calls it whenever a database file has changed.
+"""
+import os
+import re
+import json
+import sqlite3
+import difflib
+import threading
+from .utils import get_db_path, get_pool
+from .sql_cache import extract_entities, FILLER_WORDS
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    "OMNI_ENTITY_INDEX",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "entity_index.db"),
+)
+# Candidate fuzzy matches must be at least this similar to the text
+FUZZY_THRESHOLD = 0.85
+READ_CHUNK = 10000
+
+class EntitySource:
+    """One indexed column: `label` of `table` in `db_file`, resolving to `id_column` (plus an optional `extra_column`)."""
+    def __init__(self, kind, db_file, table, id_column, label, hint, extra_column=None, extra_hint=None, exact=True):
+        self.kind = kind
+        self.db_file = db_file
+        self.table = table
+        self.id_column = id_column
+        self.label = label
+        self.hint = hint
+        self.extra_column = extra_column
+        self.extra_hint = extra_hint
+        # Free text (ticket messages) is only searchable through FTS
+        self.exact = exact
+
+    def select_sql(self) -> str:
+        extra = self.extra_column or "NULL"
+        return (f"SELECT rowid, {self.id_column}, {self.label}, {extra} FROM {self.table} "
+                f"WHERE rowid > ? AND {self.label} IS NOT NULL ORDER BY rowid")
+
+    def checksum_sql(self) -> str:
+        # Cheap fingerprint of the rows indexed so far; any edit to them changes it
+        extra = f"total(length({self.extra_column}))" if self.extra_column else "0"
+        return (f"SELECT count(*), total(length({self.label})), total({self.id_column}), {extra} "
+                f"FROM {self.table} WHERE rowid <= ?")
+
+SOURCES = [
+    EntitySource("user_name", "DB_ShopCore.db", "Users", "UserID", "Name", "UserID"),
+    EntitySource("user_email", "DB_ShopCore.db", "Users", "UserID", "Email", "UserID"),
+    EntitySource("product", "DB_ShopCore.db", "Products", "ProductID", "Name", "ProductID"),
+    EntitySource("tracking", "DB_ShipStream.db", "Shipments", "ShipmentID", "TrackingNumber", "ShipmentID",
+                 extra_column="OrderID", extra_hint="OrderID"),
+]
+
+_TRACKING = re.compile(r"\bTRK-[A-Z0-9-]+\b", re.IGNORECASE)
+_EMAIL = re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b")
+_WORD = re.compile(r"[\w'@.+-]+")
+TICKET_WORDS = {"ticket", "tickets", "complaint", "support", "case", "message", "messages", "survey"}
+
+def normalize_label(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+def _file_token(db_file: str) -> str:
+    st = os.stat(get_db_path(db_file))
+    return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+def _fts_query(text: str) -> str:
+    """OR of the text's trigrams: tolerant of typos, ranked by bm25."""
+    text = normalize_label(text)
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    grams = [g for g in grams if g.strip() and '"' not in g]
+    return " OR ".join(f'"{g}"' for g in sorted(grams))
+
+class EntityIndex:
+    """Thread-safe entity resolver over SOURCES."""
+    def __init__(self, path: str = None, sources=None):
+        self.path = DEFAULT_INDEX_PATH if path is None else path
+        self.sources = SOURCES if sources is None else sources
+        self._lock = threading.Lock()
+        self._conn = None
+        self._exact = {}        # kind -> {normalized label: {id: extra}}
+        self._loaded = {}       # kind -> sidecar max_rowid the in-memory map covers
+        self._file_tokens = {}  # db_file -> file token at the last refresh
+        # Separate from _lock so /metrics never waits for a rebuild
+        self._stats_lock = threading.Lock()
+        self.stats = {"resolutions": 0, "seeded": 0, "fuzzy_matches": 0, "appended_rows": 0, "rebuilds": 0,
+                      "exact_labels": 0}
+
+    def _connect(self):
+        if self._conn is None:
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Other server workers may hold the write lock during their own refresh
+            self._conn = sqlite3.connect(self.path or ":memory:", timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS entities USING fts5("
+                "label, kind UNINDEXED, entity_id UNINDEXED, extra UNINDEXED, tokenize = 'trigram')"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources (kind TEXT PRIMARY KEY, max_rowid INTEGER, checksum TEXT)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def refresh(self) -> dict:
+        """Brings the index up to date with the databases. Returns rows indexed per kind."""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> dict:
+        conn = self._connect()
+        # Taken up front so workers sharing the sidecar refresh one at a time and see each other's rows
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            indexed = self._append(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        for db_file in {s.db_file for s in self.sources}:
+            self._file_tokens[db_file] = _file_token(db_file)
+        labels = sum(len(m) for m in self._exact.values())
+        with self._stats_lock:
+            self.stats["exact_labels"] = labels
+        return indexed
+
+    def _append(self, conn) -> dict:
+        indexed = {}
+        for source in self.sources:
+            src = get_pool().get(source.db_file)
+            row = conn.execute("SELECT max_rowid, checksum FROM sources WHERE kind = ?", (source.kind,)).fetchone()
+            max_rowid, checksum = row if row else (0, None)
+            current = json.dumps(src.execute(source.checksum_sql(), (max_rowid,)).fetchone())
+            if row is None or current != checksum:
+                # Rows we already indexed were edited or deleted: start this kind over
+                conn.execute("DELETE FROM entities WHERE kind = ?", (source.kind,))
+                max_rowid = 0
+                if row is not None:
+                    self._count("rebuilds")
+            if source.exact and self._loaded.get(source.kind) != max_rowid:
+                # First refresh, a rebuild, or rows another worker appended since we last looked
+                self._exact.pop(source.kind, None)
+                self._load_exact(source, max_rowid)
+
+            count = 0
+            cursor = src.execute(source.select_sql(), (max_rowid,))
+            while True:
+                rows = cursor.fetchmany(READ_CHUNK)
+                if not rows:
+                    break
+                conn.executemany(
+                    "INSERT INTO entities (label, kind, entity_id, extra) VALUES (?, ?, ?, ?)",
+                    [(label, source.kind, entity_id, extra) for _, entity_id, label, extra in rows],
+                )
+                if source.exact:
+                    exact = self._exact.setdefault(source.kind, {})
+                    for _, entity_id, label, extra in rows:
+                        exact.setdefault(normalize_label(label), {})[entity_id] = extra
+                max_rowid = rows[-1][0]
+                count += len(rows)
+            cursor.close()
+            checksum = json.dumps(src.execute(source.checksum_sql(), (max_rowid,)).fetchone())
+            conn.execute("INSERT OR REPLACE INTO sources (kind, max_rowid, checksum) VALUES (?, ?, ?)",
+                         (source.kind, max_rowid, checksum))
+            self._loaded[source.kind] = max_rowid
+            indexed[source.kind] = count
+            self._count("appended_rows", count)
+        # Kinds no longer in SOURCES (e.g. ticket messages, once indexed for ticket lookups)
+        kinds = {source.kind for source in self.sources}
+        for (gone,) in conn.execute("SELECT kind FROM sources").fetchall():
+            if gone not in kinds:
+                conn.execute("DELETE FROM entities WHERE kind = ?", (gone,))
+                conn.execute("DELETE FROM sources WHERE kind = ?", (gone,))
+        return indexed
+
+    def _load_exact(self, source: EntitySource, max_rowid: int):
+        """Fills the in-memory map of a kind from the sidecar (rows up to max_rowid are already there)."""
+        exact = self._exact.setdefault(source.kind, {})
+        if not max_rowid:
+            return
+        for label, entity_id, extra in self._conn.execute(
+            "SELECT label, entity_id, extra FROM entities WHERE kind = ?", (source.kind,)
+        ):
+            exact.setdefault(normalize_label(label), {})[entity_id] = extra
+
+    def _changed(self) -> bool:
+        return any(_file_token(db_file) != token for db_file, token in self._file_tokens.items()) or not self._file_tokens
+
+    def _lookup(self, kind: str, label: str) -> dict:
+        return self._exact.get(kind, {}).get(normalize_label(label), {})
+
+    def _fuzzy(self, kinds, text: str):
+        """Best FTS trigram candidate of `kinds` for text, if similar enough. Returns (kind, label, {id: extra}) or None."""
+        query = _fts_query(text)
+        if not query:
+            return None
+        rows = self._conn.execute(
+            "SELECT label, kind, entity_id, extra FROM entities WHERE entities MATCH ? ORDER BY rank LIMIT 50", (query,)
+        ).fetchall()
+        target = normalize_label(text)
+        best, best_score = None, FUZZY_THRESHOLD
+        for label, kind, entity_id, extra in rows:
+            if kind not in kinds:
+                continue
+            score = difflib.SequenceMatcher(None, target, normalize_label(label)).ratio()
+            if score >= best_score:
+                best, best_score = (kind, label), score
+        if best is None:
+            return None
+        return best[0], best[1], self._lookup(best[0], best[1])
+
+    def resolve(self, text: str):
+        """Returns (id_hints, notes) for the entities named in text. Ambiguous names seed nothing."""
+        with self._lock:
+            if self._changed():
+                self._refresh()
+            self._count("resolutions")
+            hints, notes = {}, []
+
+            def seed(source_kind, label, matches):
+                source = next(s for s in self.sources if s.kind == source_kind)
+                if len(matches) != 1:
+                    notes.append(f"'{label}' matches {len(matches)} {source.table.lower()}; not pre-resolved.")
+                    return
+                (entity_id, extra), = matches.items()
+                hints.setdefault(source.hint, entity_id)
+                if source.extra_hint and extra is not None:
+                    hints.setdefault(source.extra_hint, extra)
+
+            for m in _TRACKING.finditer(text):
+                matches = self._lookup("tracking", m.group(0))
+                if matches:
+                    seed("tracking", m.group(0), matches)
+            for m in _EMAIL.finditer(text):
+                matches = self._lookup("user_email", m.group(0))
+                if matches:
+                    seed("user_email", m.group(0), matches)
+
+            words = [w.strip(".,!?;:") for w in _WORD.findall(text)]
+            found = {"user_name": None, "product": None}
+            for size in (4, 3, 2):
+                for i in range(len(words) - size + 1):
+                    phrase = " ".join(words[i:i + size])
+                    for kind in found:
+                        if found[kind] is None and self._lookup(kind, phrase):
+                            found[kind] = phrase
+            # Quoted text is usually a product name, whatever its length
+            for quoted in re.findall(r"""['"]([^'"]{2,})['"]""", text):
+                if found["product"] is None and self._lookup("product", quoted):
+                    found["product"] = quoted
+
+            # Capitalised names that matched nothing exactly may be misspelled
+            if found["user_name"] is None and "UserID" not in hints:
+                for candidate in extract_entities(text):
+                    if " " in candidate and not candidate.isdigit():
+                        match = self._fuzzy({"user_name"}, candidate)
+                        if match:
+                            self._count("fuzzy_matches")
+                            notes.append(f"Read '{candidate}' as customer '{match[1]}'.")
+                            found["user_name"] = match[1]
+                            break
+            for kind, phrase in found.items():
+                if phrase is not None:
+                    seed(kind, phrase, self._lookup(kind, phrase))
+
+            if "UserID" in hints and "TicketID" not in hints and TICKET_WORDS & {w.lower() for w in words}:
+                ticket = self._match_ticket(text, hints)
+                if ticket is not None:
+                    hints["TicketID"] = ticket
+
+            if hints:
+                self._count("seeded")
+            return hints, notes
+
+    def _match_ticket(self, text: str, hints: dict):
+        """The user's one ticket about the order or the named things in text, or None.
+
+        Only a ticket on the hinted order, or one whose messages mention a quoted or
+        capitalised name from text ('Gaming Monitor'), is taken; generic words such as
+        "where" or "package" never pick a ticket, and neither does a tie.
+        """
+        tickets = dict(get_pool().get("DB_CareDesk.db").execute(
+            "SELECT TicketID, ReferenceID FROM Tickets WHERE UserID = ?", (hints["UserID"],)).fetchall())
+        if not tickets:
+            return None
+        on_order = [t for t, reference in tickets.items() if hints.get("OrderID") is not None and reference == hints["OrderID"]]
+        if len(on_order) == 1:
+            return on_order[0]
+        words = {w for entity in extract_entities(text) if not self._lookup("user_name", entity)
+                 for w in re.findall(r"[a-z]{4,}", entity.lower()) if w not in FILLER_WORDS and w not in TICKET_WORDS}
+        if not words:
+            return None
+        found = {}
+        placeholders = ", ".join("?" * len(tickets))
+        for ticket_id, content in get_pool().get("DB_CareDesk.db").execute(
+            f"SELECT TicketID, Content FROM TicketMessages WHERE TicketID IN ({placeholders})", list(tickets)
+        ):
+            found.setdefault(ticket_id, set()).update(w for w in words if w in (content or "").lower())
+        scores = sorted(((len(w), t) for t, w in found.items() if w), reverse=True)
+        if not scores or (len(scores) > 1 and scores[0][0] == scores[1][0]):
+            return None
+        return scores[0][1]
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats)
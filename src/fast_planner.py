@@ -0,0 +1,117 @@
+"""Deterministic planner for clear-cut queries.
+
+Keyword and entity rules, plus a lexicon built from the table and column
+names in the agent's schemas, pick the platforms locally. The LLM planner is
+only consulted when the rules are not confident.
+"""
+import re
+import time
+import threading
+
+PLATFORM_ORDER = ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+# Words that on their own decide a platform
+KEYWORDS = {
+    "ShopCore": {"order", "ordered", "product", "bought", "buy", "purchase", "purchased", "account",
+                 "premium", "email", "price", "catalog", "item"},
+    "ShipStream": {"package", "parcel", "delivery", "delivered", "deliver", "arrive", "arrived", "shipping",
+                   "shipped", "shipment", "ship", "track", "tracking", "transit", "warehouse", "courier",
+                   "logistics", "eta", "where", "when"},
+    "PayGuard": {"wallet", "balance", "refund", "refunded", "payment", "paid", "pay", "charge", "charged",
+                 "transaction", "money", "card", "debit", "credit", "fund", "funds"},
+    "CareDesk": {"ticket", "support", "complaint", "complain", "survey", "rating", "rated", "feedback",
+                 "resolved", "resolve", "inquiry", "escalate", "agent", "message"},
+}
+# Questions that ask for the whole picture ("all my items" or "a full refund" do not)
+EVERYTHING = re.compile(r"\b(?:everything|overview|360|(?:full|complete) (?:update|picture|history|overview|details))\b")
+PERSONAL_WORDS = {"i", "my", "me", "mine", "i'm", "i've"}
+# Column/table words that every platform shares carry no signal
+GENERIC_WORDS = {"id", "name", "status", "date", "type", "timestamp", "user", "order"}
+
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_NAME = re.compile(r"\b(?!I\b)[A-Z][a-z]+(?:\s+[A-Z][a-z]+)+")
+
+def _stem(word: str) -> str:
+    word = word.lower()
+    if len(word) > 3 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def build_lexicon(schemas: dict) -> dict:
+    """Maps stemmed table/column words to the platforms whose schema contains them."""
+    lexicon = {}
+    for db_name, schema in schemas.items():
+        for identifier in re.findall(r"[A-Za-z_]+", schema):
+            for part in _CAMEL.findall(identifier):
+                stem = _stem(part)
+                if len(stem) > 2 and stem not in GENERIC_WORDS:
+                    lexicon.setdefault(stem, set()).add(db_name)
+    return lexicon
+
+class FastPlanner:
+    """Rule-based planner with hit-rate and latency counters."""
+    def __init__(self, schemas: dict, min_confidence=DEFAULT_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self.lexicon = build_lexicon(schemas)
+        self.keywords = {db: {_stem(w) for w in words} for db, words in KEYWORDS.items()}
+        self._lock = threading.Lock()
+        self.stats = {"fast_path": 0, "llm_fallback": 0, "fast_path_us": 0.0}
+
+    def analyze(self, user_query: str):
+        """Returns (plan, confidence) without touching the LLM."""
+        words = re.findall(r"[a-z0-9']+", user_query.lower())
+        stems = {_stem(w) for w in words}
+        scores = {db: 0.0 for db in PLATFORM_ORDER}
+        strong = set()
+
+        for db in PLATFORM_ORDER:
+            if stems & self.keywords.get(db, set()):
+                scores[db] += 1.0
+                strong.add(db)
+        for stem in stems:
+            owners = self.lexicon.get(stem)
+            if owners and len(owners) == 1:
+                db = next(iter(owners))
+                if db in scores:
+                    scores[db] += 0.5
+
+        everything = bool(EVERYTHING.search(user_query.lower()))
+        if everything:
+            strong.update(PLATFORM_ORDER)
+        selected = [db for db in PLATFORM_ORDER if everything or scores[db] >= 1.0]
+
+        # Personal questions, names, quoted products and order numbers are resolved by ShopCore first
+        needs_identity = bool(set(words) & PERSONAL_WORDS) or bool(_NAME.search(user_query)) \
+            or "'" in user_query or '"' in user_query or bool(re.search(r"#\d+|\border\s+\d+", user_query, re.I))
+        if selected and needs_identity and "ShopCore" not in selected:
+            selected.insert(0, "ShopCore")
+
+        if not selected:
+            return [], 0.0
+        # Every platform chosen on a decisive keyword -> confident; lexicon-only matches are weaker
+        confidence = sum(1.0 if db in strong or db == "ShopCore" else 0.5 for db in selected) / len(selected)
+        return selected, confidence
+
+    def plan(self, user_query: str):
+        """Returns the plan when the rules are confident, otherwise None (use the LLM planner)."""
+        start = time.perf_counter()
+        plan, confidence = self.analyze(user_query)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        hit = confidence >= self.min_confidence
+        with self._lock:
+            self.stats["fast_path" if hit else "llm_fallback"] += 1
+            self.stats["fast_path_us"] += elapsed_us
+        return plan if hit else None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.stats["fast_path"] + self.stats["llm_fallback"]
+            return {
+                "fast_path": self.stats["fast_path"],
+                "llm_fallback": self.stats["llm_fallback"],
+                "hit_rate": round(self.stats["fast_path"] / total, 3) if total else 0.0,
+                "avg_latency_us": round(self.stats["fast_path_us"] / total, 1) if total else 0.0,
+            }
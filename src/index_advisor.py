@@ -0,0 +1,318 @@
+"""Index subsystem for the four retail databases.
+
+- BASELINE_INDEXES: foreign-key indexes created by setup_dbs.py.
+- QueryRecorder: appends every SQL statement the agent runs to a bounded JSONL log.
+- advise(): replays the log through EXPLAIN QUERY PLAN, proposes covering
+  indexes for full table scans and measures before/after scans and timings.
+
+Usage:
+    python -m src.index_advisor                 # report only
+    python -m src.index_advisor --apply         # create the proposed indexes
+    python -m src.index_advisor --baseline      # (re)create the baseline indexes
+"""
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+from collections import Counter, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.utils import get_db_connection
+
+DATABASES = ["DB_ShopCore.db", "DB_ShipStream.db", "DB_PayGuard.db", "DB_CareDesk.db"]
+
+# Every generated query filters on these join keys
+BASELINE_INDEXES = {
+    "DB_ShopCore.db": [
+        ("Orders", ["UserID"]),
+        ("Orders", ["ProductID"]),
+    ],
+    "DB_ShipStream.db": [
+        ("Shipments", ["OrderID"]),
+        ("TrackingEvents", ["ShipmentID"]),
+        ("TrackingEvents", ["WarehouseID"]),
+    ],
+    "DB_PayGuard.db": [
+        ("Wallets", ["UserID"]),
+        ("Transactions", ["WalletID"]),
+        ("Transactions", ["OrderID"]),
+        ("PaymentMethods", ["WalletID"]),
+    ],
+    "DB_CareDesk.db": [
+        ("Tickets", ["UserID"]),
+        ("Tickets", ["ReferenceID"]),
+        ("TicketMessages", ["TicketID"]),
+        ("SatisfactionSurveys", ["TicketID"]),
+    ],
+}
+
+DEFAULT_LOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "query_log.jsonl")
+# Covering indexes wider than this cost more on writes than they save on reads
+MAX_INDEX_COLUMNS = 4
+TIMING_RUNS = 5
+# The query log is rotated to <path>.1 past this size, so at most twice it is kept on disk
+MAX_LOG_BYTES = int(os.environ.get("OMNI_QUERY_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+# Seconds between writes of queued statements, and how many may queue before the oldest are dropped
+FLUSH_SECONDS = 1.0
+MAX_PENDING = 10000
+
+def index_name(table: str, columns) -> str:
+    return f"idx_{table}_{'_'.join(columns)}".lower()
+
+def create_index_sql(table: str, columns) -> str:
+    cols = ", ".join(columns)
+    return f"CREATE INDEX IF NOT EXISTS {index_name(table, columns)} ON {table} ({cols})"
+
+def create_baseline_indexes(conn, db_name: str):
+    """Creates the foreign-key indexes for db_name on an open, writable connection."""
+    for table, columns in BASELINE_INDEXES.get(db_name, []):
+        conn.execute(create_index_sql(table, columns))
+    conn.execute("ANALYZE")
+    conn.commit()
+
+class QueryRecorder:
+    """Thread-safe JSONL log of the SQL the agent runs, one line per statement.
+
+    record() only queues the line, so it never does file I/O on the event loop;
+    a background thread appends the queue every FLUSH_SECONDS and at exit.
+    Set OMNI_QUERY_LOG to another path, or to an empty string to disable recording.
+    """
+    def __init__(self, path=None, max_bytes=MAX_LOG_BYTES):
+        if path is None:
+            path = os.environ.get("OMNI_QUERY_LOG", DEFAULT_LOG_PATH)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = deque(maxlen=MAX_PENDING)
+        self._writer = None
+
+    def record(self, db_name: str, sql: str):
+        if not self.path:
+            return
+        line = json.dumps({"db": db_name, "sql": sql, "ts": time.time()})
+        with self._lock:
+            self._pending.append(line)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="query-log", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while self.path:
+            time.sleep(FLUSH_SECONDS)
+            self.flush()
+
+    def flush(self):
+        """Appends the queued lines, rotating the log first if it has reached max_bytes."""
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+        if not lines or not self.path:
+            return
+        with self._write_lock:
+            try:
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                print(f"Query log disabled: {e}")
+                self.path = ""
+
+recorder = QueryRecorder()
+
+def load_workload(path: str):
+    """Returns a Counter of (db_name, sql) pairs from a recorder log and its rotated predecessor."""
+    workload = Counter()
+    for log in (path + ".1", path):
+        if not os.path.exists(log):
+            continue
+        with open(log, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                sql = " ".join(entry.get("sql", "").split())
+                if entry.get("db") in DATABASES and sql.lower().startswith("select"):
+                    workload[(entry["db"], sql)] += 1
+    return workload
+
+def _plan(conn, sql: str):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+def _full_scans(plan):
+    """Tables (or their aliases) read with a full scan (SCAN without an index) in an EXPLAIN QUERY PLAN."""
+    scans = []
+    for detail in plan:
+        m = re.match(r"SCAN (\w+)(?: AS \w+)?$", detail)
+        if m:
+            scans.append(m.group(1))
+    return scans
+
+def _time_query(conn, sql: str) -> float:
+    """Best-of-N wall time in milliseconds."""
+    best = None
+    for _ in range(TIMING_RUNS):
+        start = time.perf_counter()
+        conn.execute(sql).fetchall()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _table_columns(conn):
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    return {t: [r[1] for r in conn.execute(f"PRAGMA table_info({t})")] for t in tables}
+
+def _aliases(sql: str, tables):
+    """Maps every alias (and bare name) used in FROM/JOIN clauses to its table."""
+    aliases = {t.lower(): t for t in tables}
+    for m in re.finditer(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        table = next((t for t in tables if t.lower() == m.group(1).lower()), None)
+        alias = m.group(2)
+        if table and alias and alias.upper() not in ("WHERE", "JOIN", "ON", "LEFT", "INNER", "ORDER", "GROUP", "LIMIT"):
+            aliases[alias.lower()] = table
+    return aliases
+
+def _column_refs(sql: str, table: str, columns, aliases, pattern: str):
+    """Columns of `table` matched by `pattern` (which must capture an optional qualifier and a name)."""
+    found = []
+    for m in re.finditer(pattern, sql, re.IGNORECASE):
+        qualifier, name = m.group(1), m.group(2)
+        if qualifier and aliases.get(qualifier.lower()) != table:
+            continue
+        col = next((c for c in columns if c.lower() == name.lower()), None)
+        if col and col not in found:
+            found.append(col)
+    return found
+
+def propose_index(sql: str, scanned: str, table_columns):
+    """Suggests (table, columns) for a scanned table: equality keys, then range/sort keys, then selected columns."""
+    aliases = _aliases(sql, list(table_columns))
+    table = aliases.get(scanned.lower())
+    if table is None:
+        return None
+    columns = table_columns[table]
+    where = re.split(r"\bWHERE\b", sql, flags=re.IGNORECASE)
+    predicates = where[1] if len(where) > 1 else ""
+    on_clauses = " ".join(re.findall(r"\bON\b(.*?)(?=\bJOIN\b|\bWHERE\b|\bGROUP\b|\bORDER\b|\bLIMIT\b|$)", sql, re.IGNORECASE))
+
+    ref = r"(?:(\w+)\.)?(\w+)"
+    equality = _column_refs(predicates + " " + on_clauses, table, columns, aliases, ref + r"\s*(?:=|\bIN\b|\bIS\b)")
+    equality += [c for c in _column_refs(predicates + " " + on_clauses, table, columns, aliases, r"=\s*" + ref) if c not in equality]
+    ranges = _column_refs(predicates, table, columns, aliases, ref + r"\s*(?:<|>|\bBETWEEN\b|\bLIKE\b)")
+    order = re.split(r"\bORDER\s+BY\b", sql, flags=re.IGNORECASE)
+    sort = _column_refs(order[1], table, columns, aliases, ref) if len(order) > 1 else []
+
+    key = equality + [c for c in ranges + sort if c not in equality]
+    if not key:
+        return None
+    select_list = re.split(r"\bFROM\b", sql, maxsplit=1, flags=re.IGNORECASE)[0]
+    if "*" not in select_list:
+        selected = _column_refs(select_list, table, columns, aliases, ref)
+        covering = key + [c for c in selected if c not in key]
+        if len(covering) <= MAX_INDEX_COLUMNS:
+            key = covering
+    return table, key[:MAX_INDEX_COLUMNS]
+
+def advise(log_path: str = DEFAULT_LOG_PATH, apply: bool = False):
+    """Runs the recorded workload through the planner. Returns a report dict per database."""
+    workload = load_workload(log_path)
+    report = {}
+    for db_name in DATABASES:
+        queries = [(sql, count) for (db, sql), count in workload.items() if db == db_name]
+        if not queries:
+            continue
+        conn = get_db_connection(db_name)
+        table_columns = _table_columns(conn)
+        existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+
+        before = {}
+        proposals = {}
+        for sql, count in queries:
+            try:
+                scans = _full_scans(_plan(conn, sql))
+                before[sql] = {"scans": len(scans), "ms": _time_query(conn, sql), "count": count}
+            except Exception as e:
+                print(f"[{db_name}] Skipping unplannable query: {e}")
+                continue
+            for table in scans:
+                proposal = propose_index(sql, table, table_columns)
+                if proposal and index_name(*proposal) not in existing:
+                    proposals.setdefault(index_name(*proposal), proposal)
+
+        # Measure the proposals inside a transaction and keep them only if applying
+        conn.execute("BEGIN")
+        for table, columns in proposals.values():
+            conn.execute(create_index_sql(table, columns))
+        conn.execute("ANALYZE")
+        results = []
+        for sql, stats in before.items():
+            scans_after = len(_full_scans(_plan(conn, sql)))
+            results.append({
+                "sql": sql,
+                "count": stats["count"],
+                "scans_before": stats["scans"],
+                "scans_after": scans_after,
+                "ms_before": round(stats["ms"], 3),
+                "ms_after": round(_time_query(conn, sql), 3),
+            })
+        if apply:
+            conn.commit()
+        else:
+            conn.rollback()
+        conn.close()
+
+        report[db_name] = {
+            "proposed": [create_index_sql(t, c) for t, c in proposals.values()],
+            "applied": apply and bool(proposals),
+            "queries": results,
+            "scans_before": sum(r["scans_before"] * r["count"] for r in results),
+            "scans_after": sum(r["scans_after"] * r["count"] for r in results),
+            "ms_before": round(sum(r["ms_before"] * r["count"] for r in results), 3),
+            "ms_after": round(sum(r["ms_after"] * r["count"] for r in results), 3),
+        }
+    return report
+
+def print_report(report):
+    if not report:
+        print("No recorded queries found.")
+        return
+    for db_name, entry in report.items():
+        print(f"\n=== {db_name} ({len(entry['queries'])} distinct queries) ===")
+        print(f"Full scans: {entry['scans_before']} -> {entry['scans_after']}   "
+              f"Weighted time: {entry['ms_before']:.2f} ms -> {entry['ms_after']:.2f} ms")
+        for stmt in entry["proposed"]:
+            print(f"  {'APPLIED' if entry['applied'] else 'PROPOSED'}: {stmt}")
+        for r in sorted(entry["queries"], key=lambda r: r["ms_before"] * r["count"], reverse=True)[:10]:
+            print(f"  x{r['count']:<4} scans {r['scans_before']}->{r['scans_after']}  "
+                  f"{r['ms_before']:.3f}->{r['ms_after']:.3f} ms  {r['sql'][:90]}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Workload-driven index advisor for the Omni-Retail databases.")
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH, help="query log written by the agent")
+    parser.add_argument("--apply", action="store_true", help="create the proposed indexes")
+    parser.add_argument("--baseline", action="store_true", help="create the baseline foreign-key indexes first")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.baseline:
+        for db_name in DATABASES:
+            conn = get_db_connection(db_name)
+            create_baseline_indexes(conn, db_name)
+            conn.close()
+        print("Baseline indexes created.")
+
+    report = advise(args.log, apply=args.apply)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
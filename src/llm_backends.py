@@ -0,0 +1,233 @@
+"""LLM backends that sit behind OmniAgent._call_llm / _stream_llm.
+
+Every backend exposes `await create(**kwargs)` with the same arguments and
+response shape as `AsyncGroq().chat.completions.create`, so the routing
+and fallback logic of the LLMGateway works unchanged on top of any of them.
+
+- GroqBackend:      live calls (default).
+- RecordingBackend: wraps another backend and saves every response to a fixture file.
+- ReplayBackend:    answers from a fixture file, deterministically and offline.
+- StubBackend:      canned planner/SQL/synthesis answers for queries nobody recorded.
+
+Select one with OMNI_LLM_MODE=live|record|replay|stub and OMNI_LLM_FIXTURES=<path>.
+Backends may also define `await warm_up()`, which OmniAgent.warm_up() calls at startup.
+"""
+import os
+import re
+import json
+import asyncio
+import hashlib
+import importlib
+import threading
+from types import SimpleNamespace
+
+DEFAULT_FIXTURE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures", "llm_replay.json"
+)
+
+def fixture_key(kwargs: dict) -> str:
+    """Identifies a call by what was asked, not by which model or mode answered it."""
+    payload = {"messages": kwargs.get("messages"), "json": "response_format" in kwargs}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _response(content: str, usage: dict, model: str):
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+        usage=SimpleNamespace(**usage),
+    )
+
+def _usage_dict(usage) -> dict:
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    return {k: getattr(usage, k, 0) or 0 for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+async def _replay_stream(content: str, usage: dict, model: str):
+    # Word-sized deltas, like the live API
+    pieces = re.findall(r"\S+\s*|\s+", content)
+    for i, piece in enumerate(pieces):
+        last = i == len(pieces) - 1
+        yield SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=piece), finish_reason="stop" if last else None)],
+            x_groq=SimpleNamespace(usage=SimpleNamespace(**usage)) if last else None,
+        )
+
+class GroqBackend:
+    """Live Groq calls."""
+    def __init__(self):
+        self._client = None
+        self._client_loop = None
+
+    @property
+    def client(self):
+        """Async Groq client for the running event loop (httpx pools cannot be shared across loops)."""
+        from groq import AsyncGroq
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # Retries and rate limits are handled by the LLMGateway in front of the backend
+            self._client = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"), max_retries=0)
+            self._client_loop = loop
+        return self._client
+
+    async def warm_up(self):
+        """Imports the SDK (the slowest import of the process) and builds the client for the running loop."""
+        await asyncio.to_thread(importlib.import_module, "groq")
+        self.client
+
+    async def create(self, **kwargs):
+        return await self.client.chat.completions.create(**kwargs)
+
+class FixtureStore:
+    """Thread-safe JSON file of recorded responses keyed by fixture_key()."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def put(self, key: str, kwargs: dict, content: str, usage: dict, model: str = None):
+        """Records an answer; `model` is the model that actually answered (defaults to the one asked for)."""
+        messages = kwargs.get("messages") or [{}]
+        with self._lock:
+            self.entries[key] = {
+                "content": content,
+                "usage": usage,
+                "model": model or kwargs.get("model"),
+                "preview": (messages[-1].get("content") or "")[:120],
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+class RecordingBackend:
+    """Passes calls to `inner` and records every answer to a fixture file."""
+    def __init__(self, inner, path: str = DEFAULT_FIXTURE_PATH):
+        self.inner = inner
+        self.store = FixtureStore(path)
+
+    async def warm_up(self):
+        if hasattr(self.inner, "warm_up"):
+            await self.inner.warm_up()
+
+    async def create(self, **kwargs):
+        key = fixture_key(kwargs)
+        response = await self.inner.create(**kwargs)
+        if not kwargs.get("stream"):
+            self.store.put(key, kwargs, response.choices[0].message.content, _usage_dict(getattr(response, "usage", None)),
+                           getattr(response, "model", None))
+            return response
+
+        async def recorded():
+            parts = []
+            usage = None
+            model = None
+            async for chunk in response:
+                model = model or getattr(chunk, "model", None)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    usage = x_groq.usage
+                yield chunk
+            self.store.put(key, kwargs, "".join(parts), _usage_dict(usage), model)
+        return recorded()
+
+class ReplayBackend:
+    """Answers from a fixture file; unrecorded calls go to `fallback` or raise KeyError."""
+    def __init__(self, path: str = DEFAULT_FIXTURE_PATH, fallback=None, latency: float = 0.0):
+        self.store = FixtureStore(path)
+        self.fallback = fallback
+        self.latency = latency
+        self.hits = 0
+        self.misses = 0
+
+    async def create(self, **kwargs):
+        entry = self.store.get(fixture_key(kwargs))
+        if entry is None:
+            self.misses += 1
+            if self.fallback is None:
+                raise KeyError("No recorded LLM response for this call; re-record the fixtures")
+            return await self.fallback.create(**kwargs)
+        self.hits += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        model = entry.get("model") or kwargs.get("model")
+        if kwargs.get("stream"):
+            return _replay_stream(entry["content"], entry["usage"], model)
+        return _response(entry["content"], entry["usage"], model)
+
+# Canned SQL per platform for StubBackend; {UserID}/{OrderID} come from the prompt's Master IDs
+STUB_SQL = {
+    "ShopCore": "SELECT u.UserID, u.Name, o.OrderID, p.Name AS Product, o.Status FROM Users u "
+                "JOIN Orders o ON o.UserID = u.UserID JOIN Products p ON p.ProductID = o.ProductID "
+                "WHERE u.Name = '{name}' ORDER BY o.OrderDate DESC LIMIT 1",
+    "ShipStream": "SELECT s.TrackingNumber, t.StatusUpdate, w.Location FROM Shipments s "
+                  "JOIN TrackingEvents t ON t.ShipmentID = s.ShipmentID JOIN Warehouses w ON w.WarehouseID = t.WarehouseID "
+                  "WHERE s.OrderID = {OrderID} ORDER BY t.Timestamp DESC",
+    "PayGuard": "SELECT w.WalletID, w.Balance, t.Amount, t.Type FROM Wallets w "
+                "LEFT JOIN Transactions t ON t.WalletID = w.WalletID WHERE w.UserID = {UserID}",
+    "CareDesk": "SELECT t.TicketID, t.Status, m.Content, s.Rating FROM Tickets t "
+                "LEFT JOIN TicketMessages m ON m.TicketID = t.TicketID "
+                "LEFT JOIN SatisfactionSurveys s ON s.TicketID = t.TicketID WHERE t.UserID = {UserID}",
+    "Federated": "SELECT u.UserID, u.Name, o.OrderID, o.Status AS OrderStatus, s.TrackingNumber, w.Balance, "
+                 "t.TicketID, t.Status AS TicketStatus FROM Users u JOIN Orders o ON o.UserID = u.UserID "
+                 "LEFT JOIN ShipStream.Shipments s ON s.OrderID = o.OrderID LEFT JOIN PayGuard.Wallets w ON w.UserID = u.UserID "
+                 "LEFT JOIN CareDesk.Tickets t ON t.UserID = u.UserID WHERE u.Name = '{name}' ORDER BY o.OrderDate DESC LIMIT 5",
+}
+
+class StubBackend:
+    """Deterministic offline answers: every platform in the plan, canned SQL, fixed summary."""
+    # Reported as the answering model, so recorded stub answers are never taken for real ones
+    MODEL = "stub"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def answer(self, kwargs: dict) -> str:
+        prompt = "\n".join(m.get("content") or "" for m in kwargs.get("messages") or [])
+        if "response_format" in kwargs:
+            return json.dumps({"plan": ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]})
+        m = re.search(r"SQLite Expert for the '(\w+)'", prompt)
+        if m and m.group(1) in STUB_SQL:
+            hints = {"UserID": 1, "OrderID": 101}
+            found = re.search(r"Master IDs: (\{.*?\})", prompt)
+            if found:
+                try:
+                    hints.update(json.loads(found.group(1)))
+                except ValueError:
+                    pass
+            name = re.search(r"I am ([A-Z][a-z]+ [A-Z][a-z]+)|(?:on|for) ([A-Z][a-z]+ [A-Z][a-z]+)", prompt)
+            name = next((g for g in name.groups() if g), "Alice Johnson") if name else "Alice Johnson"
+            return STUB_SQL[m.group(1)].format(name=name.replace("'", "''"), **hints)
+        return "Hello! Here is the <b>latest status</b> of your account.<ul><li>All systems checked.</li></ul>"
+
+    async def create(self, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self.answer(kwargs)
+        usage = {"prompt_tokens": sum(len(m.get("content") or "") for m in kwargs.get("messages", [])) // 4,
+                 "completion_tokens": len(content) // 4, "total_tokens": 0}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if kwargs.get("stream"):
+            return _replay_stream(content, usage, self.MODEL)
+        return _response(content, usage, self.MODEL)
+
+def make_backend():
+    """Builds the backend selected by OMNI_LLM_MODE (live, record, replay or stub)."""
+    mode = os.environ.get("OMNI_LLM_MODE", "live").lower()
+    path = os.environ.get("OMNI_LLM_FIXTURES", DEFAULT_FIXTURE_PATH)
+    if mode == "record":
+        return RecordingBackend(GroqBackend(), path)
+    if mode == "replay":
+        return ReplayBackend(path)
+    if mode == "stub":
+        return StubBackend()
+    return GroqBackend()
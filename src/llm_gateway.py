@@ -0,0 +1,422 @@
+"""Quota-aware routing of LLM calls between the primary and fallback models.
+
+Every call from the agent goes through one LLMGateway, which combines:
+
+- a token bucket per model for requests and tokens per minute, shared by all
+  concurrent requests, so calls queue briefly instead of running into 429s;
+- a circuit breaker per model: repeated rate limits or server errors open it
+  for a cool-down, after which one probe call decides whether the model is
+  back. Calls go to the primary model whenever its breaker lets them, so the
+  agent returns to PRIMARY_MODEL on its own after a rate-limit episode;
+- retries with backoff for rate limits and transient errors;
+- optional hedging: when a primary call runs past its recent p95 latency (or a
+  fixed delay), the same request is sent to the fallback model and whichever
+  answers first wins.
+
+Quotas, concurrency and hedging are configured with OMNI_LLM_* variables.
+With several server workers the token buckets live in the shared state file
+(see shared_store.py), so the workers stay within one quota between them.
+"""
+import os
+import time
+import asyncio
+import random
+from .prompt_builder import estimate_tokens
+from .shared_store import get_shared_store
+
+# Requests and tokens per minute per model; override with OMNI_LLM_QUOTAS="model=rpm/tpm,..."
+DEFAULT_QUOTAS = {
+    "llama-3.3-70b-versatile": (1000, 300000),
+    "llama-3.1-8b-instant": (1000, 250000),
+}
+FALLBACK_QUOTA = (30, 6000)
+DEFAULT_CONCURRENCY = int(os.environ.get("OMNI_LLM_CONCURRENCY", "16"))
+# Longest a call waits for the primary model's quota before it is sent to the fallback instead
+DEFAULT_MAX_WAIT = float(os.environ.get("OMNI_LLM_MAX_WAIT", "2.0"))
+# "off", "p95" (hedge after the primary's observed p95 latency) or a delay in milliseconds
+DEFAULT_HEDGE = os.environ.get("OMNI_LLM_HEDGE", "off").lower()
+# Completion tokens reserved per call until the real usage is known
+COMPLETION_RESERVE = 512
+MAX_RETRIES = 2
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 30.0
+BREAKER_MAX_COOLDOWN = 300.0
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+def parse_quotas(spec: str) -> dict:
+    """"model=rpm/tpm,model=rpm/tpm" -> {model: (rpm, tpm)}."""
+    quotas = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, limits = item.partition("=")
+        rpm, _, tpm = limits.partition("/")
+        quotas[model.strip()] = (int(rpm), int(tpm))
+    return quotas
+
+def status_of(error: Exception):
+    """HTTP status of a provider error, if it carries one."""
+    status = getattr(error, "status_code", None)
+    if status is None and "429" in str(error):
+        status = 429
+    return status
+
+def retry_after(error: Exception):
+    """Seconds the provider asked us to wait, if it said."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def is_transient(error: Exception) -> bool:
+    status = status_of(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError") or isinstance(error, asyncio.TimeoutError)
+
+class TokenBucket:
+    """Continuously refilled bucket of `capacity` units per minute."""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` units are available."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        # A request larger than the bucket only needs a full bucket
+        missing = min(amount, self.capacity) - self.level
+        if missing > 0:
+            wait = max(wait, missing / self.rate)
+        return wait
+
+    def take(self, amount: float):
+        self._refill(time.monotonic())
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self._refill(time.monotonic())
+        self.level = min(self.capacity, self.level + amount)
+
+    def block(self, seconds: float):
+        """Provider-side limit hit: nothing is taken until `seconds` from now."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class SharedTokenBucket:
+    """TokenBucket kept in the shared state file, drawn from by every worker process."""
+    def __init__(self, store, name: str, per_minute: float):
+        self.store = store
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+
+    def delay(self, amount: float) -> float:
+        level, blocked_until = self.store.peek_bucket(self.name, self.capacity, self.rate)
+        wait = max(0.0, blocked_until - time.time())
+        missing = min(amount, self.capacity) - level
+        if missing > 0:
+            wait = max(wait, missing / self.rate)
+        return wait
+
+    def take(self, amount: float):
+        # Another worker may have taken the same units since delay(): the level goes negative and refills
+        self.store.bucket(self.name, self.capacity, self.rate, take=amount)
+
+    def give_back(self, amount: float):
+        self.store.bucket(self.name, self.capacity, self.rate, take=-amount)
+
+    def block(self, seconds: float):
+        self.store.bucket(self.name, self.capacity, self.rate, block=seconds)
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open probe after the cool-down."""
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def remaining(self) -> float:
+        """Seconds until the next probe may go out (0 when closed or half-open)."""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allows(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def begin(self):
+        if self.state == "half_open":
+            self.probing = True
+
+    def succeeded(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.cooldown = self.base_cooldown
+
+    def failed(self, wait: float = None):
+        self.failures += 1
+        if self.probing:
+            # The probe failed: stay open, for longer
+            self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            self.opened_at = time.monotonic()
+        elif self.failures >= self.threshold or wait:
+            # The provider's retry-after, when given, is the best cool-down there is
+            self.cooldown = wait or self.base_cooldown
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def released(self):
+        """The call ended without telling us anything about the model (e.g. it was cancelled)."""
+        self.probing = False
+
+class _Model:
+    def __init__(self, name: str, rpm: int, tpm: int, shared=None):
+        self.name = name
+        self.shared = shared is not None
+        if shared is not None:
+            self.requests = SharedTokenBucket(shared, f"{name}:rpm", rpm)
+            self.tokens = SharedTokenBucket(shared, f"{name}:tpm", tpm)
+        else:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+        self.breaker = CircuitBreaker()
+        self.latencies = []
+        self.stats = {"calls": 0, "failures": 0, "rate_limited": 0}
+
+    def delay(self, tokens: int) -> float:
+        return max(self.requests.delay(1), self.tokens.delay(tokens))
+
+    def reserve(self, tokens: int):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    async def quota(self, fn, *args):
+        """Runs a bucket call; shared buckets wait on a write lock in the state file, so they go to a thread."""
+        if self.shared:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def p95(self):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+class LLMGateway:
+    """Routes chat completion calls to `primary` or `fallback` within their quotas."""
+    def __init__(self, backend, primary: str, fallback: str, quotas: dict = None,
+                 concurrency: int = DEFAULT_CONCURRENCY, max_wait: float = DEFAULT_MAX_WAIT, hedge: str = DEFAULT_HEDGE):
+        quotas = dict(DEFAULT_QUOTAS, **(quotas if quotas is not None else parse_quotas(os.environ.get("OMNI_LLM_QUOTAS", ""))))
+        self.backend = backend
+        self.primary = primary
+        self.fallback = fallback
+        shared = get_shared_store()
+        self.models = {name: _Model(name, *quotas.get(name, FALLBACK_QUOTA), shared=shared)
+                       for name in (primary, fallback)}
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self.hedge = hedge
+        self._slots = None
+        self._slots_loop = None
+        self._lock = None
+        self.stats = {"calls": 0, "retries": 0, "rerouted": 0, "hedged": 0, "hedge_wins": 0, "waited_seconds": 0.0}
+
+    def _loop_state(self):
+        """Semaphore and lock of the running event loop (asyncio primitives are bound to one loop)."""
+        loop = asyncio.get_running_loop()
+        if self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._lock = asyncio.Lock()
+            self._slots_loop = loop
+        return self._slots, self._lock
+
+    async def _acquire(self, tokens: int, exclude=None):
+        """Waits for quota and returns the model to use; `exclude` is tried last (it just rate-limited us)."""
+        _, lock = self._loop_state()
+        async with lock:
+            order = [self.fallback, self.primary] if exclude == self.primary else [self.primary, self.fallback]
+            while True:
+                candidates = [self.models[name] for name in order if self.models[name].breaker.allows()]
+                if not candidates:
+                    # Every breaker is open (or probing): wait for the first cool-down to end
+                    await self._sleep(max(0.05, min(m.breaker.remaining() for m in self.models.values())))
+                    continue
+                first = candidates[0]
+                wait = await first.quota(first.delay, tokens)
+                # Prefer waiting a little for the primary over a noticeably weaker answer
+                if (wait > self.max_wait and len(candidates) > 1
+                        and await candidates[1].quota(candidates[1].delay, tokens) == 0):
+                    first = candidates[1]
+                    wait = 0.0
+                    self.stats["rerouted"] += 1
+                if wait > 0:
+                    await self._sleep(wait)
+                    if await first.quota(first.delay, tokens) > 0:
+                        continue
+                await first.quota(first.reserve, tokens)
+                first.breaker.begin()
+                return first
+
+    async def _sleep(self, seconds: float):
+        self.stats["waited_seconds"] += seconds
+        await asyncio.sleep(seconds)
+
+    async def _settle(self, model: _Model, reserved: int, usage):
+        """Replaces the reserved token estimate with what the call really used."""
+        used = getattr(usage, "total_tokens", None) if usage is not None else None
+        if used:
+            delta = reserved - used
+            if delta > 0:
+                await model.quota(model.tokens.give_back, delta)
+            else:
+                await model.quota(model.tokens.take, -delta)
+
+    async def _failed(self, model: _Model, error: Exception):
+        model.stats["failures"] += 1
+        status = status_of(error)
+        wait = retry_after(error)
+        if status == 429:
+            model.stats["rate_limited"] += 1
+            await model.quota(model.requests.block, wait or 1.0)
+            print(f"!!! Rate limit hit on {model.name}" + (f"; retry after {wait:.1f}s." if wait else "."))
+        if is_transient(error):
+            model.breaker.failed(wait if status == 429 else None)
+        else:
+            model.breaker.released()
+
+    async def _attempt(self, model: _Model, kwargs: dict, reserved: int):
+        started = time.monotonic()
+        try:
+            response = await self.backend.create(**dict(kwargs, model=model.name))
+        except asyncio.CancelledError:
+            model.breaker.released()
+            raise
+        except Exception as e:
+            await self._failed(model, e)
+            raise
+        model.breaker.succeeded()
+        model.stats["calls"] += 1
+        if not kwargs.get("stream"):
+            model.latencies.append(time.monotonic() - started)
+            del model.latencies[:-LATENCY_WINDOW]
+            await self._settle(model, reserved, getattr(response, "usage", None))
+        return response
+
+    def _hedge_delay(self):
+        if self.hedge in ("", "off", "0", "false"):
+            return None
+        if self.hedge == "p95":
+            return self.models[self.primary].p95()
+        try:
+            return float(self.hedge) / 1000
+        except ValueError:
+            return None
+
+    async def _hedged(self, model: _Model, kwargs: dict, reserved: int):
+        """Runs the call on `model`; past the hedge delay, races a copy on the fallback model."""
+        delay = self._hedge_delay() if model.name == self.primary else None
+        if delay is None:
+            return await self._attempt(model, kwargs, reserved), model.name
+        first = asyncio.ensure_future(self._attempt(model, kwargs, reserved))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        backup = self.models[self.fallback]
+        if done or not backup.breaker.allows() or await backup.quota(backup.delay, reserved) > 0:
+            return await first, model.name
+
+        self.stats["hedged"] += 1
+        await backup.quota(backup.reserve, reserved)
+        backup.breaker.begin()
+        second = asyncio.ensure_future(self._attempt(backup, kwargs, reserved))
+        racers = {first: model.name, second: backup.name}
+        try:
+            pending = set(racers)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result(), racers[task]
+            # Both failed: report the primary's error
+            return first.result(), model.name
+        finally:
+            for task in racers:
+                if not task.done():
+                    task.cancel()
+
+    async def create(self, kwargs: dict):
+        """Non-streaming call. Returns (response, model that answered)."""
+        slots, _ = self._loop_state()
+        reserved = estimate_tokens("".join(m.get("content") or "" for m in kwargs["messages"])) + COMPLETION_RESERVE
+        self.stats["calls"] += 1
+        async with slots:
+            exclude = None
+            for attempt in range(MAX_RETRIES + 1):
+                model = await self._acquire(reserved, exclude)
+                try:
+                    return await self._hedged(model, kwargs, reserved)
+                except Exception as e:
+                    if not is_transient(e) or attempt == MAX_RETRIES:
+                        raise
+                    self.stats["retries"] += 1
+                    # Retry on the other model if this one just rate-limited us
+                    exclude = model.name if status_of(e) == 429 else None
+                    await asyncio.sleep(min(4.0, 0.25 * 2 ** attempt) * (0.5 + random.random()))
+
+    async def stream(self, kwargs: dict):
+        """Streaming call: yields (model, chunk). Retries only until the first chunk arrives."""
+        slots, _ = self._loop_state()
+        reserved = estimate_tokens("".join(m.get("content") or "" for m in kwargs["messages"])) + COMPLETION_RESERVE
+        self.stats["calls"] += 1
+        async with slots:
+            exclude = None
+            for attempt in range(MAX_RETRIES + 1):
+                model = await self._acquire(reserved, exclude)
+                try:
+                    stream = await self._attempt(model, dict(kwargs, stream=True), reserved)
+                    break
+                except Exception as e:
+                    if not is_transient(e) or attempt == MAX_RETRIES:
+                        raise
+                    self.stats["retries"] += 1
+                    exclude = model.name if status_of(e) == 429 else None
+                    await asyncio.sleep(min(4.0, 0.25 * 2 ** attempt) * (0.5 + random.random()))
+            usage = None
+            async for chunk in stream:
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    usage = x_groq.usage
+                yield model.name, chunk
+            await self._settle(model, reserved, usage)
+
+    def snapshot(self) -> dict:
+        snap = dict(self.stats, waited_seconds=round(self.stats["waited_seconds"], 3))
+        for role, name in (("primary", self.primary), ("fallback", self.fallback)):
+            model = self.models[name]
+            for key, value in model.stats.items():
+                snap[f"{role}_{key}"] = value
+            snap[f"{role}_breaker_open"] = int(model.breaker.state != "closed")
+            p95 = model.p95()
+            snap[f"{role}_p95_ms"] = round(p95 * 1000, 1) if p95 is not None else 0
+        return snap
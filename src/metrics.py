@@ -0,0 +1,151 @@
+"""Per-request spans and process-wide Prometheus metrics.
+
+A Trace collects one span per pipeline stage (planner call, each SQL
+generation, each SQL execution, serialization, synthesis) with its duration,
+model, token usage, rows returned and whether FALLBACK_MODEL answered.
+Finished traces are folded into the process-wide registry, which renders the
+Prometheus text format for the /metrics route.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Trace:
+    """Spans of one request. Not thread-safe: fill it from the request's event loop."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Times the block; the yielded dict can be filled with model/tokens/rows/fallback."""
+        record = {"name": name, **attrs}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["start_ms"] = round((start - self.started) * 1000, 3)
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self.spans.append(record)
+
+    def stage_totals(self) -> dict:
+        """Seconds per span name; concurrent spans are summed."""
+        totals = {}
+        for s in self.spans:
+            totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"] / 1000
+        return totals
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+class MetricsRegistry:
+    """Minimal thread-safe counters and histograms with Prometheus text output."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # name -> {label tuple: value}
+        self._histograms = {}  # name -> {label tuple: [bucket counts..., sum, count]}
+        self._help = {}
+        self._collectors = []
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, help: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            state = series.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    state[i] += 1
+            state[-2] += seconds
+            state[-1] += 1
+
+    def add_collector(self, collect):
+        """Registers a callable returning [(name, help, {label tuple: value})] gauges read at scrape time."""
+        self._collectors.append(collect)
+
+    def add_snapshot(self, component: str, snapshot):
+        """Exposes the numeric top-level fields of a component's snapshot() as omni_component_stat gauges."""
+        def collect():
+            series = {}
+            for stat, value in snapshot().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    series[(("component", component), ("stat", stat))] = value
+            return [("omni_component_stat", "Cache, planner and pool counters", series)]
+        self.add_collector(collect)
+
+    def observe_trace(self, trace: Trace, status: str = "ok"):
+        """Folds a finished request's spans into the registry."""
+        for s in trace.spans:
+            labels = {"stage": s["name"]}
+            if s.get("db"):
+                labels["db"] = s["db"]
+            self.observe("omni_stage_duration_seconds", s["duration_ms"] / 1000,
+                         "Latency of each pipeline stage", **labels)
+            if s.get("model"):
+                llm_labels = {"stage": s["name"], "model": s["model"], "fallback": str(bool(s.get("fallback"))).lower()}
+                self.inc("omni_llm_calls_total", 1, "LLM calls by stage, model and fallback", **llm_labels)
+                for kind in ("prompt", "completion"):
+                    tokens = s.get(f"{kind}_tokens") or 0
+                    if tokens:
+                        self.inc("omni_llm_tokens_total", tokens, "LLM tokens by stage, model and kind",
+                                 stage=s["name"], model=s["model"], kind=kind)
+            if s.get("prompt_tokens_saved"):
+                self.inc("omni_prompt_tokens_saved_total", s["prompt_tokens_saved"],
+                         "Prompt tokens saved by schema pruning and prefix compaction", stage=s["name"])
+            if s["name"] == "sql_execution":
+                self.inc("omni_sql_rows_total", s.get("rows") or 0, "Rows returned by generated SQL", db=s.get("db", ""))
+            if s.get("cached"):
+                self.inc("omni_stage_cache_hits_total", 1, "Stages answered from a cache", stage=s["name"])
+        self.observe("omni_request_duration_seconds", time.perf_counter() - trace.started, "End-to-end request latency")
+        self.inc("omni_requests_total", 1, "Chat requests by outcome", status=status)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(dict(key))} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in sorted(series.items()):
+                    labels = dict(key)
+                    for i, bound in enumerate(LATENCY_BUCKETS):
+                        lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {state[i]}")
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {state[-1]}")
+                    lines.append(f"{name}_sum{_labels(labels)} {state[-2]:g}")
+                    lines.append(f"{name}_count{_labels(labels)} {state[-1]}")
+            collectors = list(self._collectors)
+        # Several collectors may feed the same gauge; each name gets one HELP/TYPE block
+        gauges = {}
+        for collect in collectors:
+            for name, help, series in collect():
+                gauges.setdefault(name, (help, {}))[1].update(series)
+        for name, (help, series) in sorted(gauges.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(dict(key))} {value:g}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
@@ -1,21 +1,77 @@
 import os
 import json
+import time
 import sqlite3
+import asyncio
+import threading
+import contextvars
+from contextlib import nullcontext
 from typing import List, Dict, Any
-from groq import Groq
-from dotenv import load_dotenv
-from .utils import execute_sql_query, get_schema
-
-load_dotenv()
+from .utils import fetch_rows, get_schema, get_federated_schema, inspect_sql, warm_databases, FEDERATED_DB
+from .index_advisor import recorder
+from .sql_cache import SQLTemplateCache, extract_entities
+from .fast_planner import FastPlanner
+from .llm_backends import make_backend
+from .context_serializer import serialize_context, DEFAULT_MAX_ROWS, DEFAULT_TOKEN_BUDGET
+from .metrics import Trace, registry
+from .sql_batcher import SQLBatch
+from .coalescer import RequestCoalescer, coalesce_key
+from .entity_index import EntityIndex
+from .prompt_builder import PromptBuilder
+from .llm_gateway import LLMGateway
+from .session_store import SessionStore
+from .customer360 import Customer360
 
 # Configuration
 PRIMARY_MODEL = "llama-3.3-70b-versatile"
 FALLBACK_MODEL = "llama-3.1-8b-instant" # High rate-limit, faster fallback
 
+# Master IDs passed between platforms as filtering hints
+ID_KEYS = ["UserID", "OrderID", "ShipmentID", "ProductID", "TicketID", "WalletID", "TransactionID"]
+# Entry point that resolves the master IDs every other platform depends on
+ROOT_DB = "ShopCore"
+
+# Semaphore bounding the LLM calls of the batch the current task belongs to, if any
+_llm_slots = contextvars.ContextVar("llm_slots", default=None)
+
+_env_loaded = False
+
+def _load_env():
+    """Reads .env into os.environ once, when the first agent is built rather than at import."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def _no_emit(event):
+    pass
+
+def _record_usage(span, model: str, usage):
+    """Copies model, token usage and fallback status of an LLM call into a span."""
+    if span is None:
+        return
+    span["model"] = model
+    span["fallback"] = model != PRIMARY_MODEL
+    if usage is not None:
+        span["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+        span["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+
+async def _shared_call(cache, fn, *args):
+    """Calls fn(*args); a cache kept in the shared state file (several workers) may wait on another
+    worker's write lock, so it runs in a thread there."""
+    if cache.shared:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
 class OmniAgent:
-    def __init__(self):
-        self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        self.current_model = PRIMARY_MODEL
+    """Long-lived agent: build once and share it; every query keeps its own thought log."""
+    def __init__(self, llm_backend=None, federated=None):
+        _load_env()
+        # Live Groq by default; record/replay backends plug in here (see llm_backends.py)
+        self.llm = llm_backend or make_backend()
+        # Every LLM call is routed between the two models within their quotas
+        self.gateway = LLMGateway(self.llm, PRIMARY_MODEL, FALLBACK_MODEL)
         self.databases = {
             "ShopCore": "DB_ShopCore.db",
             "ShipStream": "DB_ShipStream.db",
@@ -23,92 +79,334 @@ class OmniAgent:
             "CareDesk": "DB_CareDesk.db"
         }
         self.schemas = {db: get_schema(path) for db, path in self.databases.items()}
-        self.thought_log = []
+        self.sql_cache = SQLTemplateCache()
+        self.fast_planner = FastPlanner(self.schemas)
+        # Shares self.schemas, which _run_step re-reads, so prompts follow schema migrations
+        self.prompts = PromptBuilder(self.schemas)
+        # Follow-ups in a conversation start from its IDs and still-fresh results
+        self.sessions = SessionStore(self.databases)
+        # Identical concurrent requests share one pipeline run
+        self.coalescer = RequestCoalescer()
+        # Names, emails, products and tracking numbers in the question resolve to IDs without SQL.
+        # Both sidecars are built by warm_up(), or on first use when nothing warms the agent up.
+        self.entity_index = EntityIndex()
+        # Pre-joined per-customer rows: covered status questions skip SQL generation entirely
+        self.customer360 = Customer360()
+        # Set while warm_up() builds the sidecars in the background; questions meanwhile go without them
+        self._building_sidecars = threading.Event()
+        self._sidecar_task = None
+        # Multi-platform questions become one joined query over ATTACHed databases (per-platform path as fallback)
+        self.federated = os.environ.get("OMNI_FEDERATED", "0") == "1" if federated is None else federated
+        # Concurrent LLM calls allowed per batch request (see abatch_query)
+        self.batch_concurrency = int(os.environ.get("OMNI_BATCH_CONCURRENCY", "8"))
+        # Synthesis context limits
+        self.max_rows_per_db = DEFAULT_MAX_ROWS
+        self.context_token_budget = DEFAULT_TOKEN_BUDGET
 
-    def _call_llm(self, messages, temperature=0, json_mode=False):
-        """Standard LLM call with built-in rate-limit fallback."""
+    async def warm_up(self):
+        """Pays first-request costs at startup: LLM SDK and client, database connections and pages, prompt prefixes."""
+        start = time.perf_counter()
+        if hasattr(self.llm, "warm_up"):
+            await self.llm.warm_up()
+        db_names = list(self.databases.values()) + ([FEDERATED_DB] if self.federated else [])
+        # Connections are per thread, so this opens the worker thread's; the page cache and row estimates are shared
+        await asyncio.to_thread(warm_databases, db_names)
+        self.prompts.warm_up()
+        # A cold instance has no sidecar files yet: build them without holding up the first requests
+        self._building_sidecars.set()
+        self._sidecar_task = asyncio.create_task(asyncio.to_thread(self._build_sidecars))
+        print(f"Warm-up finished in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def _build_sidecars(self):
+        try:
+            for name in ("entity_index", "customer360"):
+                self._refresh_sidecar(name)
+        finally:
+            self._building_sidecars.clear()
+
+    def _refresh_sidecar(self, name: str):
+        """Brings the entity index or customer 360 store up to date; turns it off if SQLite can't build it."""
+        sidecar = getattr(self, name)
+        if sidecar is None:
+            return
+        try:
+            sidecar.refresh()
+        except sqlite3.Error as e:
+            self._disable_sidecar(name, e)
+
+    def _disable_sidecar(self, name: str, error: Exception):
+        print(f"{name} unavailable ({error}); questions run the full pipeline without it.")
+        setattr(self, name, None)
+
+    async def _call_llm(self, messages, temperature=0, json_mode=False, span=None):
+        """Standard LLM call through the gateway (quotas, breaker, retries, hedging). Usage is recorded into `span` if given."""
         kwargs = {
             "messages": messages,
-            "model": self.current_model,
             "temperature": temperature,
         }
         if json_mode:
             kwargs["response_format"] = {"type": "json_object"}
 
-        try:
-            response = self.client.chat.completions.create(**kwargs)
-            return response.choices[0].message.content
-        except Exception as e:
-            if "429" in str(e) and self.current_model == PRIMARY_MODEL:
-                print(f"!!! Rate limit hit on {PRIMARY_MODEL}. Falling back to {FALLBACK_MODEL}...")
-                self.current_model = FALLBACK_MODEL # Switch for this session
-                kwargs["model"] = FALLBACK_MODEL
-                response = self.client.chat.completions.create(**kwargs)
-                return response.choices[0].message.content
-            else:
-                raise e
+        async with _llm_slots.get() or nullcontext():
+            response, model = await self.gateway.create(kwargs)
+        _record_usage(span, model, getattr(response, "usage", None))
+        return response.choices[0].message.content
+
+    async def _stream_llm(self, messages, temperature=0, span=None):
+        """Streaming variant of _call_llm: yields content deltas as the model produces them."""
+        kwargs = {
+            "messages": messages,
+            "temperature": temperature,
+        }
+        model, usage = None, None
+        async for model, chunk in self.gateway.stream(kwargs):
+            # Groq reports usage on the final chunk
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                usage = x_groq.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+        _record_usage(span, model, usage)
+
+    async def _get_sql_from_llm(self, query: str, db_name: str, id_hints: Dict[str, Any] = None, span=None, rejected=None) -> str:
+        """Translates natural language to SQL for a specific database; `rejected` = (sql, reason) asks for a fix."""
+        messages, saved = self.prompts.sql_messages(db_name, query, id_hints, rejected)
+        if span is not None:
+            span["prompt_tokens_saved"] = saved
+        sql = await self._call_llm(messages=messages, span=span)
+        sql = sql.strip()
+        sql = sql.replace("```sql", "").replace("```", "").strip()
+        # Basic SQL safety - ensure it's a SELECT
+        if not sql.lower().startswith("select"):
+            return "SELECT 'Error: Invalid SQL generated' as Error;"
+        return sql
+
+    async def _resolve_entities(self, user_query: str, thought_log: List[str], trace: Trace, emit=_no_emit) -> Dict[str, Any]:
+        """IDs named in the question itself, looked up before any SQL is generated."""
+        index = self.entity_index
+        if index is None or self._building_sidecars.is_set():
+            return {}
+        with trace.span("entity_resolution") as span:
+            try:
+                # Builds the index on first use when warm_up() didn't
+                hints, notes = await asyncio.to_thread(index.resolve, user_query)
+            except sqlite3.Error as e:
+                self._disable_sidecar("entity_index", e)
+                return {}
+            span["hints"] = len(hints)
+        if hints:
+            notes.append(f"Resolved from the question: {json.dumps(hints)}")
+        for text in notes:
+            thought_log.append(text)
+            emit({"type": "thought", "text": text})
+        return hints
 
-    def _get_sql_from_llm(self, query: str, db_name: str, context_summary: str = "") -> str:
-        """Translates natural language to SQL for a specific database."""
-        schema = self.schemas[db_name]
-        
-        system_prompt = f"""You are a SQLite Expert for the '{db_name}' database.
+    async def _answer_from_store(self, user_query: str, plan: List[str], id_hints: Dict[str, Any],
+                                 thought_log: List[str], trace: Trace, emit=_no_emit):
+        """Results for the whole plan from the customer 360 store, as (cumulative_context, id_hints, omitted_rows).
+
+        None when the store is off or the question isn't covered.
+        """
+        store = self.customer360
+        if store is None or not plan:
+            return None
+        with trace.span("customer360") as span:
+            try:
+                context = await asyncio.to_thread(store.lookup, user_query, plan, id_hints)
+            except sqlite3.Error as e:
+                self._disable_sidecar("customer360", e)
+                return None
+            span["answered"] = context is not None
+        if context is None:
+            return None
+        as_of = next((r["AsOf"] for rows in context.values() for r in rows if "AsOf" in r), None)
+        thought_log.append(f"Answered {', '.join(plan)} from the customer 360 store with one lookup"
+                           + (f" (data as of {as_of}; a refresh is running)." if as_of else "."))
+        emit({"type": "thought", "text": thought_log[-1]})
+        found_hints = dict(id_hints)
+        for rows in context.values():
+            for record in rows:
+                for key in ID_KEYS:
+                    if record.get(key):
+                        found_hints.setdefault(key, record[key])
+        return context, found_hints, {}
+
+    async def _get_federated_sql(self, query: str, platforms: List[str], schema: str, context_summary: str = "", span=None):
+        """Translates natural language to one SELECT joining the platforms. Returns None if no SELECT came back."""
+        system_prompt = f"""You are a SQLite Expert for the 'Federated' database: one connection where ShopCore is the main database and {", ".join(p for p in platforms if p != ROOT_DB)} are attached.
 STRICT SCHEMA:
 {schema}
 
 TASK:
 Generate a SINGLE SELECT statement for: "{query}"
 
-DOMAINS:
-- ShopCore: Find UserID, OrderID, and Name. If user says "I" or "my", find the most RECENT matching order.
-- ShipStream: Find StatusUpdate and Warehouse Location using OrderID.
-- PayGuard: Find Balance and Transaction details using UserID or OrderID.
-- CareDesk: Find Ticket Status, latest Message, and Survey Rating/Comments.
-
-STRICT SCHEMA RULES for "{db_name}":
-{schema}
-1. ONLY USE TABLES and COLUMNS listed in the schema ABOVE.
-2. NO HALLUCINATIONS: Do not guess table or column names (e.g., ShipStream does NOT have tickets or surveys).
-3. NO CROSS-DB JOINS: Do not mention other databases.
-4. USE SIMPLE JOINS: Join related tables within this DB only.
-5. FILTERING: Use these Master IDs: {context_summary}. (e.g., WHERE OrderID = [Value])
+RULES:
+1. ONLY USE TABLES and COLUMNS listed in the schema ABOVE. Qualify attached tables with their database name (e.g. ShipStream.Shipments).
+2. Start from ShopCore (Users/Orders) and LEFT JOIN the other platforms on UserID / OrderID, so missing data in one platform does not hide the others.
+3. If the user says "I" or "my", restrict to their most RECENT matching order.
+4. Give every selected column a distinct name; select only the columns needed to answer.
+5. FILTERING: Use these Master IDs: {context_summary}. (e.g., WHERE u.UserID = [Value])
 6. OUTPUT: Return ONLY the SQL string.
 """
-        sql = self._call_llm(
+        sql = await self._call_llm(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"User's request: {query}"}
-            ]
+            ],
+            span=span
         )
-        sql = sql.strip()
-        sql = sql.replace("```sql", "").replace("```", "").strip()
-        # Basic SQL safety - ensure it's a SELECT
-        if not sql.lower().startswith("select"):
-            return "SELECT 'Error: Invalid SQL generated' as Error;"
-        return sql
+        sql = sql.strip().replace("```sql", "").replace("```", "").strip()
+        return sql if sql.lower().startswith("select") else None
 
-    def run_query(self, user_query: str) -> str:
-        """Orchestrates multi-DB query execution without CrewAI."""
-        print(f"Analyzing query: {user_query}")
-        
-        planner_prompt = f"""You are the Omni-Retail Omni-Agent. You handle queries across 4 production platforms:
-1. ShopCore: Accounts, Products, Catalog, and initial Order placement. (MANDATORY entry point for "I", "My", or finding Users/Products)
-2. ShipStream: Logistics, Shipments, and Tracking. (Depends on OrderID)
-3. PayGuard: Balances and Transactions. (Depends on UserID/OrderID)
-4. CareDesk: Tickets, Messages, and Surveys. (Depends on UserID/OrderID)
-
-USER QUERY: "{user_query}"
-
-TASK: Identify which platforms need to be queried.
-Return your plan as a JSON object with a "plan" key containing a list of database names. 
-CRITICAL: If the query is personal ("I", "My") or mentions a product name, you MUST start with "ShopCore" to identify the User/Order.
-Example: {{"plan": ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]}}
-"""
-        plan_content = self._call_llm(
-            messages=[{"role": "user", "content": planner_prompt}],
-            json_mode=True
+    async def _run_federated(self, user_query: str, plan: List[str], thought_log: List[str], trace: Trace, emit=_no_emit, id_hints=None):
+        """Answers the plan with one joined query. Returns (cumulative_context, rows left out) or None to fall back."""
+        def note(text):
+            thought_log.append(text)
+            emit({"type": "thought", "text": text})
+
+        platforms = [db for db in self.databases if db in plan]
+        schema = await asyncio.to_thread(get_federated_schema, [db for db in platforms if db != ROOT_DB])
+        cache_key = "Federated:" + "+".join(platforms)
+        id_hints = id_hints or {}
+        sql = await _shared_call(self.sql_cache, self.sql_cache.lookup, cache_key, user_query, id_hints, schema)
+        from_cache = sql is not None
+        if not from_cache:
+            context_summary = "No IDs found yet." if not id_hints else json.dumps(id_hints)
+            with trace.span("sql_generation", db="Federated") as span:
+                sql = await self._get_federated_sql(user_query, platforms, schema, context_summary, span=span)
+        if sql is None:
+            note("Federated query generation failed; querying each platform separately.")
+            return None
+        blocking = [text for text, block in await asyncio.to_thread(inspect_sql, FEDERATED_DB, sql) if block]
+        if blocking:
+            note(f"Federated query rejected ({'; '.join(blocking)}); querying each platform separately.")
+            return None
+
+        print(f"[Federated] SQL: {sql}")
+        emit({"type": "sql", "db": "Federated", "sql": sql, "cached": from_cache})
+        note(f"Querying {', '.join(platforms)} together with SQL: {sql}")
+        with trace.span("sql_execution", db="Federated", cached=from_cache) as span:
+            try:
+                rows, omitted = await asyncio.to_thread(fetch_rows, FEDERATED_DB, sql, self.max_rows_per_db)
+            except sqlite3.Error as e:
+                note(f"Federated query failed ({e}); querying each platform separately.")
+                return None
+            span["rows"] = len(rows)
+        if not from_cache:
+            await _shared_call(self.sql_cache, self.sql_cache.store, cache_key, user_query, id_hints, schema, sql)
+
+        emit({"type": "rows", "db": "Federated", "count": len(rows), "omitted": omitted})
+        note(f"Found {len(rows)} records across {', '.join(platforms)}." if rows else "No records found.")
+        return {"Federated": rows}, ({"Federated": omitted} if omitted else {})
+
+    def _schedule_plan(self, plan: List[str]) -> List[List[str]]:
+        """Groups the plan into stages: ShopCore alone first, then every other platform together."""
+        steps = []
+        for db_name in plan:
+            if db_name in self.databases and db_name not in steps:
+                steps.append(db_name)
+        stages = []
+        if ROOT_DB in steps:
+            stages.append([ROOT_DB])
+            steps.remove(ROOT_DB)
+        if steps:
+            stages.append(steps)
+        return stages
+
+    async def _fetch(self, db_file: str, sql: str):
+        # SQLite is blocking; keep it off the event loop
+        return await asyncio.to_thread(fetch_rows, db_file, sql, self.max_rows_per_db)
+
+    async def _run_step(self, user_query: str, db_name: str, id_hints: Dict[str, Any], trace: Trace, emit=_no_emit, fetch=None):
+        """Generates and executes the SQL for one platform. Returns (thought lines, rows or None, rows left out).
+
+        `fetch(db_file, sql)` runs the statement; batches pass a shared SQLBatch.fetch here.
+        """
+        step_log = []
+        def note(text):
+            step_log.append(text)
+            emit({"type": "thought", "text": text})
+
+        # Re-read the schema so cached templates never outlive a migration
+        schema = await asyncio.to_thread(get_schema, self.databases[db_name])
+        self.schemas[db_name] = schema
+
+        sql = await _shared_call(self.sql_cache, self.sql_cache.lookup, db_name, user_query, id_hints, schema)
+        from_cache = sql is not None
+        if from_cache:
+            note(f"Reusing cached SQL template for {db_name}.")
+        else:
+            print(f"[{db_name}] Generating SQL...")
+            # Extract IDs from all results found so far for explicit hints
+            with trace.span("sql_generation", db=db_name) as span:
+                sql = await self._get_sql_from_llm(user_query, db_name, id_hints, span=span)
+
+        # Cost guard: a statement with a bad plan goes back to the LLM once, with the reason
+        db_file = self.databases[db_name]
+        problems = await asyncio.to_thread(inspect_sql, db_file, sql)
+        if problems:
+            reason = "; ".join(text for text, _ in problems)
+            note(f"[{db_name}] SQL rejected ({reason}); asking for a corrected query.")
+            with trace.span("sql_generation", db=db_name, retry=True) as span:
+                sql = await self._get_sql_from_llm(user_query, db_name, id_hints, span=span, rejected=(sql, reason))
+            from_cache = False
+            problems = await asyncio.to_thread(inspect_sql, db_file, sql)
+        blocking = [text for text, block in problems if block]
+        print(f"[{db_name}] SQL: {sql}")
+        emit({"type": "sql", "db": db_name, "sql": sql, "cached": from_cache})
+        if blocking:
+            note(f"[{db_name}] Corrected SQL rejected too ({'; '.join(blocking)}); not running it.")
+            return step_log, {"error": f"Query rejected by the cost guard: {'; '.join(blocking)}"}, 0
+        # Feed the index advisor with the real workload: only statements that actually run
+        recorder.record(db_file, sql)
+        note(f"Querying {db_name} with SQL: {sql}")
+        if problems:
+            note(f"[{db_name}] Running it within the row and time limits: {'; '.join(text for text, _ in problems)}.")
+
+        omitted = 0
+        with trace.span("sql_execution", db=db_name, cached=from_cache) as span:
+            try:
+                result_data, omitted = await (fetch or self._fetch)(db_file, sql)
+            except sqlite3.Error as e:
+                # Let the synthesis step see what went wrong, as before
+                result_data = {"error": str(e)}
+            except Exception as e:
+                span["error"] = str(e)
+                note(f"Error querying {db_name}: {str(e)}")
+                return step_log, None, 0
+            span["rows"] = len(result_data) if isinstance(result_data, list) else 0
+            if omitted:
+                span["rows_omitted"] = omitted
+
+        if isinstance(result_data, list) and not from_cache:
+            await _shared_call(self.sql_cache, self.sql_cache.store, db_name, user_query, id_hints, schema, sql)
+
+        emit({"type": "rows", "db": db_name, "count": len(result_data) if isinstance(result_data, list) else 0, "omitted": omitted})
+        if isinstance(result_data, list) and omitted:
+            note(f"Found {len(result_data)} records in {db_name} ({omitted} more not loaded).")
+        elif isinstance(result_data, list) and len(result_data) > 0:
+            note(f"Found {len(result_data)} records in {db_name}.")
+        else:
+            note(f"No records found in {db_name}.")
+        return step_log, result_data, omitted
+
+    async def _plan(self, user_query: str, span=None) -> List[str]:
+        """Decides which platforms the query needs: local rules first, the planner LLM when unsure."""
+        plan = self.fast_planner.plan(user_query)
+        if span is not None:
+            span["fast_path"] = bool(plan)
+        if plan:
+            print("Planner fast path taken.")
+            return plan
+
+        plan_content = await self._call_llm(
+            messages=self.prompts.planner_messages(user_query),
+            json_mode=True,
+            span=span
         )
         plan_content = plan_content.strip()
+        plan = []
         try:
             # Clean possible markdown
             if "```json" in plan_content:
@@ -130,83 +428,306 @@ Example: {{"plan": ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]}}
         except Exception as e:
             print(f"Planning error: {e}")
             plan = ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]
+        return plan
 
-        self.thought_log.append(f"Planner decided on: {', '.join(plan)}")
-        print(f"Plan: {plan}")
-        
-        # 2. Sequential Execution with Context Passing
+    async def _batched_step(self, batch: SQLBatch, *args):
+        """_run_step whose SQL goes through `batch`; always checks out of the batch, even on failure."""
+        fetched = False
+        async def fetch(db_file, sql):
+            nonlocal fetched
+            fetched = True
+            return await batch.fetch(db_file, sql)
+        try:
+            return await self._run_step(*args, fetch=fetch)
+        finally:
+            if not fetched:
+                batch.skip()
+
+    async def _execute_plan(self, user_query: str, plan: List[str], thought_log: List[str], trace: Trace, emit=_no_emit,
+                            batches=None, id_hints=None):
+        """Runs the plan stage by stage. Returns (cumulative_context, id_hints, rows left out per database).
+
+        `batches` holds one SQLBatch per stage when the query is part of a batch;
+        `id_hints` are IDs already known before the first stage.
+        """
+        # ShopCore resolves the master IDs; the other platforms only depend on
+        # those hints, so they run side by side once ShopCore has finished.
         cumulative_context = {}
-        id_hints = {}
-        
-        for db_name in plan:
-            if db_name not in self.databases: continue
-            
-            # Extract IDs from all results found so far for explicit hints
-            context_summary = "No IDs found yet." if not id_hints else json.dumps(id_hints)
+        id_hints = dict(id_hints or {})
+        omitted_rows = {}
 
-            print(f"[{db_name}] Generating SQL...")
-            sql = self._get_sql_from_llm(user_query, db_name, context_summary=context_summary)
-            print(f"[{db_name}] SQL: {sql}")
-            self.thought_log.append(f"Querying {db_name} with SQL: {sql}")
-            
+        stages = self._schedule_plan(plan)
+        for index, stage in enumerate(stages):
+            stage_hints = dict(id_hints)
+            if batches is None:
+                steps = [self._run_step(user_query, db_name, stage_hints, trace, emit) for db_name in stage]
+            else:
+                steps = [self._batched_step(batches[index], user_query, db_name, stage_hints, trace, emit) for db_name in stage]
             try:
-                result_json = execute_sql_query(self.databases[db_name], sql)
-                result_data = json.loads(result_json)
-                
-                # Add to context
+                outcomes = await asyncio.gather(*steps)
+            except BaseException:
+                # Don't leave the rest of the batch waiting for stages this query will never reach
+                if batches is not None:
+                    for later, later_stage in zip(batches[index + 1:], stages[index + 1:]):
+                        later.skip(len(later_stage))
+                raise
+
+            # Merge in plan order so hints and logs are deterministic
+            for db_name, (step_log, result_data, omitted) in zip(stage, outcomes):
+                thought_log.extend(step_log)
+                if result_data is None:
+                    continue
                 cumulative_context[db_name] = result_data
-                
-                if isinstance(result_data, list) and len(result_data) > 0:
-                    self.thought_log.append(f"Found {len(result_data)} records in {db_name}.")
+                if omitted:
+                    omitted_rows[db_name] = omitted
+                if isinstance(result_data, list):
                     # Update hints from results
                     for record in result_data:
-                        for key in ["UserID", "OrderID", "ShipmentID", "ProductID", "TicketID", "WalletID", "TransactionID"]:
+                        for key in ID_KEYS:
                             if key in record and record[key]:
                                 id_hints[key] = record[key]
+        return cumulative_context, id_hints, omitted_rows
+
+    async def arun_query(self, user_query: str, emit=None, trace: Trace = None, session_id: str = None):
+        """Orchestrates multi-DB query execution without CrewAI. Returns (answer, thought_log).
+
+        When `emit` is given, progress events are passed to it as they happen and
+        the synthesis answer is streamed to it token by token. Stage spans are
+        recorded into `trace` (pass one in to read them back) and into /metrics.
+        With a `session_id`, IDs and fresh results of earlier turns are reused.
+        """
+        trace = trace if trace is not None else Trace()
+        try:
+            result = await self._run_pipeline(user_query, emit, trace, session_id)
+        except Exception:
+            registry.observe_trace(trace, status="error")
+            raise
+        registry.observe_trace(trace)
+        return result
+
+    async def _run_pipeline(self, user_query: str, emit, trace: Trace, session_id: str = None):
+        print(f"Analyzing query: {user_query}")
+        thought_log = []
+        streaming = emit is not None
+        emit = emit or _no_emit
+        emit({"type": "start", "query": user_query})
+        def note(text):
+            thought_log.append(text)
+            emit({"type": "thought", "text": text})
+
+        # 1. Planning
+        with trace.span("plan") as span:
+            plan = await self._plan(user_query, span=span)
+        thought_log.append(f"Planner decided on: {', '.join(plan)}")
+        emit({"type": "plan", "plan": plan})
+        emit({"type": "thought", "text": thought_log[-1]})
+        print(f"Plan: {plan}")
+
+        # 2. Dependency-aware Execution with Context Passing (or one federated join)
+        seeded_hints = await self._resolve_entities(user_query, thought_log, trace, emit)
+        entities = extract_entities(user_query)
+        session_hints, reused = await _shared_call(self.sessions, self.sessions.recall, session_id, entities, seeded_hints)
+        if session_hints:
+            note(f"Carried over from this conversation: {json.dumps(session_hints)}")
+        id_hints = {**session_hints, **seeded_hints}
+        reused = {db: result for db, result in reused.items() if db in plan}
+        for db_name, (_, _, age) in reused.items():
+            note(f"[{db_name}] Skipped: reusing this conversation's results from {age:.0f}s ago.")
+        self.sessions.note_reused(len(reused))
+        remaining = [db for db in plan if db not in reused]
+        # Taken before anything runs, so a write during this turn makes its results stale
+        versions = {db: self.sessions.version(db) for db in remaining if db in self.databases} if session_id else {}
+
+        stored = await self._answer_from_store(user_query, remaining, id_hints, thought_log, trace, emit)
+        federated = None
+        if stored is None and self.federated and len({db for db in remaining if db in self.databases}) > 1:
+            federated = await self._run_federated(user_query, remaining, thought_log, trace, emit, id_hints)
+        if stored is not None:
+            cumulative_context, found_hints, omitted_rows = stored
+        elif federated is not None:
+            cumulative_context, omitted_rows = federated
+            found_hints = id_hints
+        else:
+            cumulative_context, found_hints, omitted_rows = await self._execute_plan(
+                user_query, remaining, thought_log, trace, emit, id_hints=id_hints)
+        await _shared_call(self.sessions, self.sessions.remember,
+                           session_id, entities, found_hints, cumulative_context, omitted_rows, versions)
+        for db_name, (rows, omitted, _) in reused.items():
+            cumulative_context[db_name] = rows
+            if omitted:
+                omitted_rows[db_name] = omitted
+
+        # 3. Final Synthesis
+        final_answer = await self._synthesize(user_query, cumulative_context, omitted_rows, thought_log, trace,
+                                              emit if streaming else None)
+        return final_answer, thought_log
+
+    async def _synthesize(self, user_query: str, cumulative_context, omitted_rows, thought_log: List[str], trace: Trace, emit=None):
+        """Serializes the results and writes the answer, streaming tokens to `emit` when given."""
+        with trace.span("serialization"):
+            context_text, left_out = serialize_context(cumulative_context, omitted_rows, self.context_token_budget)
+        if left_out:
+            thought_log.append(f"Summarized results for synthesis; {left_out} rows left out to fit the context budget.")
+            if emit:
+                emit({"type": "thought", "text": thought_log[-1]})
+        messages = self.prompts.synthesis_messages(user_query, context_text)
+        with trace.span("synthesis") as span:
+            if emit is None:
+                return await self._call_llm(messages=messages, span=span)
+            parts = []
+            async for token in self._stream_llm(messages, span=span):
+                parts.append(token)
+                emit({"type": "token", "text": token})
+            return "".join(parts)
+
+    async def abatch_query(self, queries: List[str], concurrency: int = None):
+        """Answers many queries in one pass, yielding each result as soon as it is ready.
+
+        Identical queries are answered once. Queries with the same plan move
+        through their stages together, so each stage's SQL runs as one batch:
+        duplicates run once and single-key lookups are merged into IN (...)
+        queries. At most `concurrency` LLM calls are in flight at a time.
+        Yields {"type": "result" | "error", "index", "query", ...} per query,
+        then {"type": "done", "stats"}.
+        """
+        slots = asyncio.Semaphore(concurrency or self.batch_concurrency)
+        # Tasks below run in a context where _call_llm waits for one of this batch's slots
+        context = contextvars.copy_context()
+        context.run(_llm_slots.set, slots)
+
+        positions = {}
+        for index, query in enumerate(queries):
+            positions.setdefault(query.strip(), []).append(index)
+        texts = list(positions)
+        traces = [Trace() for _ in texts]
+        stats = {"queries": len(queries), "unique_queries": len(texts), "plan_groups": 0}
+        tasks = []
+
+        async def plan_one(text, trace):
+            with trace.span("plan") as span:
+                return await self._plan(text, span=span)
+
+        async def answer_one(i, plan, batches):
+            text, trace = texts[i], traces[i]
+            thought_log = [f"Planner decided on: {', '.join(plan)}"]
+            # Until the steps are skipped or _execute_plan takes over, this query still owes every stage batch
+            handed_off = False
+
+            def skip_stages():
+                for batch, stage in zip(batches, self._schedule_plan(plan)):
+                    batch.skip(len(stage))
+
+            try:
+                seeded_hints = await self._resolve_entities(text, thought_log, trace)
+                stored = await self._answer_from_store(text, plan, seeded_hints, thought_log, trace)
+                if stored is not None:
+                    # The rest of the group's batches don't wait for this query's steps
+                    handed_off = True
+                    skip_stages()
+                    cumulative_context, _, omitted_rows = stored
                 else:
-                    self.thought_log.append(f"No records found in {db_name}.")
+                    handed_off = True
+                    cumulative_context, _, omitted_rows = await self._execute_plan(
+                        text, plan, thought_log, trace, batches=batches, id_hints=seeded_hints)
+                answer = await self._synthesize(text, cumulative_context, omitted_rows, thought_log, trace)
             except Exception as e:
-                self.thought_log.append(f"Error querying {db_name}: {str(e)}")
+                registry.observe_trace(trace, status="error")
+                return i, {"type": "error", "message": str(e)}
+            finally:
+                if not handed_off:
+                    # Failed or cancelled before reaching the batches
+                    skip_stages()
+            registry.observe_trace(trace)
+            return i, {"type": "result", "response": answer, "thought_process": thought_log, "plan": plan,
+                       "timings": trace.to_dict()}
 
-        # 3. Final Synthesis
-        # 3. Final Synthesis
-        # Try to find the user's name from context for a personalized greeting
-        user_name = "there"
-        for db_res in cumulative_context.values():
-            if isinstance(db_res, list) and len(db_res) > 0:
-                for record in db_res:
-                    # Look for any key that looks like a name
-                    for k, v in record.items():
-                        if k.lower() in ["name", "username", "customer_name"] and v and isinstance(v, str):
-                            user_name = v
-                            break
-                    if user_name != "there": break
-            if user_name != "there": break
-        
-        synthesis_prompt = f"""You are the Omni-Retail Premium Customer Assistant.
-GREETING: Address the customer by their Name found in results.
-
-SEARCH RESULTS FROM DATA NODES:
-{json.dumps(cumulative_context, indent=2)}
-
-USER QUERY: "{user_query}"
-
-GOAL: Provide a "Perfect Accuracy" answer in a professional dashboard style.
-
-GUIDELINES:
-1. NO FAILURES: Instead of saying "I couldn't find...", describe the status. (e.g., If no shipment info, say "Your order is currently in the processing phase and hasn't been handed to logistics yet.").
-2. DATA INTEGRATION: Combine Order details, Tracking status, Wallet balance, and Support ticket history into a single cohesive story.
-3. HIGHLIGHTS: Bold (<b>) all IDs, Tracking Numbers, Statuses, and Balances. NEVER use double asterisks **.
-4. STRUCTURE: Use a summary paragraph followed by <ul> bits of data.
-5. NO TECH-SPEAK: Never mention SQL, JSON, or databases.
-6. NO MARKDOWN: Ensure no ** is used in the final response. Use <b> only.
-"""
-        final_answer = self._call_llm(
-            messages=[{"role": "user", "content": synthesis_prompt}]
-        )
-        
-        return final_answer, self.thought_log
+        try:
+            plan_tasks = [asyncio.create_task(plan_one(t, tr), context=context) for t, tr in zip(texts, traces)]
+            tasks.extend(plan_tasks)
+            plans = await asyncio.gather(*plan_tasks, return_exceptions=True)
+
+            groups = {}
+            for i, plan in enumerate(plans):
+                if isinstance(plan, Exception):
+                    plan = ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]
+                groups.setdefault(tuple(plan), []).append(i)
+            stats["plan_groups"] = len(groups)
+
+            answer_tasks = []
+            for plan, members in groups.items():
+                stages = self._schedule_plan(list(plan))
+                batches = [SQLBatch(len(members) * len(stage), self.max_rows_per_db, stats) for stage in stages]
+                for i in members:
+                    answer_tasks.append(asyncio.create_task(answer_one(i, list(plan), batches), context=context))
+            tasks.extend(answer_tasks)
+
+            for done in asyncio.as_completed(answer_tasks):
+                i, outcome = await done
+                for index in positions[texts[i]]:
+                    yield {**outcome, "index": index, "query": queries[index]}
+            yield {"type": "done", "stats": stats}
+        finally:
+            # Client went away: stop the remaining work
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def ashared_query(self, user_query: str, session_id: str = None, emit=None):
+        """arun_query behind single-flight coalescing. Returns (answer, thought_log, timings).
+
+        Concurrent calls with the same normalized query and session_id share one
+        run; `timings` are those of the shared run.
+        """
+        async def start(flight_emit):
+            trace = Trace()
+            answer, thoughts = await self.arun_query(user_query, emit=flight_emit, trace=trace, session_id=session_id)
+            return answer, thoughts, trace.to_dict()
+
+        answer, thoughts, timings = await self.coalescer.run(coalesce_key(user_query, session_id), start, emit)
+        # Each caller gets its own copy of the shared log
+        return answer, list(thoughts), timings
+
+    async def astream_query(self, user_query: str, session_id: str = None):
+        """Runs the pipeline and yields its progress events, ending with a "done" (or "error") event."""
+        queue = asyncio.Queue()
+
+        async def produce():
+            try:
+                answer, thoughts, timings = await self.ashared_query(user_query, session_id, emit=queue.put_nowait)
+                queue.put_nowait({"type": "done", "response": answer, "thought_process": thoughts,
+                                  "timings": timings})
+            except Exception as e:
+                queue.put_nowait({"type": "error", "message": str(e)})
+            finally:
+                queue.put_nowait(None)
+
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            # Client went away: stop spending LLM calls on an answer nobody reads
+            if not task.done():
+                task.cancel()
+
+    def run_query(self, user_query: str):
+        """Synchronous entry point for scripts and sub-agents."""
+        return asyncio.run(self.arun_query(user_query))
+
+_shared_agent = None
+
+def get_agent() -> OmniAgent:
+    """Returns the process-wide OmniAgent, building it on first use."""
+    global _shared_agent
+    if _shared_agent is None:
+        _shared_agent = OmniAgent()
+    return _shared_agent
+
+async def arun_omni_query(query: str):
+    return await get_agent().arun_query(query)
 
 def run_omni_query(query: str):
-    agent = OmniAgent()
-    return agent.run_query(query)
+    return get_agent().run_query(query)
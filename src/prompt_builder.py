@@ -0,0 +1,286 @@
+"""Compact, prefix-stable prompts for the planner, SQL generation and synthesis.
+
+Every prompt is split into a static prefix (role, rules and, for SQL, the
+notes of that one database) that is built once and reused byte for byte, and
+a short dynamic tail. Providers that cache prompt prefixes can then reuse the
+prefix across calls, and nothing static is re-rendered per request.
+
+For SQL generation the schema appears once, pruned to the tables the question
+and the known ID hints need: tables whose name, columns or topic words match
+the question, plus the tables that join them to a table holding a hinted ID
+(joining-only tables keep just their key columns). When nothing matches, the
+full schema is sent.
+"""
+import re
+import json
+import threading
+from .sql_cache import extract_entities
+
+# Topic words per table, on top of the words in its table and column names
+TABLE_TERMS = {
+    "Users": {"i", "me", "my", "name", "account", "customer", "premium", "email", "user"},
+    "Products": {"product", "item", "bought", "price", "category", "buy"},
+    "Orders": {"order", "ordered", "bought", "purchase", "purchased", "recent", "last", "latest", "status"},
+    "Shipments": {"ship", "shipped", "shipping", "shipment", "deliver", "delivered", "delivery", "arrive",
+                  "arrival", "package", "parcel", "track", "tracking", "where", "eta"},
+    "TrackingEvents": {"status", "track", "tracking", "where", "delivered", "update", "stuck", "moving"},
+    "Warehouses": {"warehouse", "location", "where", "manager", "hub"},
+    "Wallets": {"wallet", "balance", "money", "fund", "funds", "credit", "currency"},
+    "Transactions": {"transaction", "refund", "refunded", "payment", "paid", "pay", "charge", "charged",
+                     "amount", "debit"},
+    "PaymentMethods": {"card", "method", "provider", "expire", "expiry", "expired", "visa", "paypal"},
+    "Tickets": {"ticket", "support", "complaint", "issue", "problem", "case", "help", "status"},
+    "TicketMessages": {"message", "said", "reply", "replied", "wrote", "content", "complaint", "latest"},
+    "SatisfactionSurveys": {"survey", "rating", "rate", "rated", "feedback", "satisfaction", "review", "comment"},
+}
+
+DOMAIN_NOTES = {
+    "ShopCore": "Find UserID, OrderID, and Name. If user says \"I\" or \"my\", find the most RECENT matching order.",
+    "ShipStream": "Find StatusUpdate and Warehouse Location using OrderID.",
+    "PayGuard": "Find Balance and Transaction details using UserID or OrderID.",
+    "CareDesk": "Find Ticket Status, latest Message, and Survey Rating/Comments.",
+}
+
+SQL_PREFIX = """You are a SQLite Expert for the '{db_name}' database.
+DOMAIN: {domain}
+
+RULES:
+1. ONLY USE TABLES and COLUMNS listed in the schema BELOW.
+2. NO HALLUCINATIONS: Do not guess table or column names (e.g., ShipStream does NOT have tickets or surveys).
+3. NO CROSS-DB JOINS: Do not mention other databases.
+4. USE SIMPLE JOINS: Join related tables within this DB only.
+5. FILTERING: Use the Master IDs given below. (e.g., WHERE OrderID = [Value])
+6. OUTPUT: Return ONLY a SINGLE SELECT statement, as a plain SQL string.
+"""
+
+PLANNER_PREFIX = """You are the Omni-Retail Omni-Agent. You handle queries across 4 production platforms:
+1. ShopCore: Accounts, Products, Catalog, and initial Order placement. (MANDATORY entry point for "I", "My", or finding Users/Products)
+2. ShipStream: Logistics, Shipments, and Tracking. (Depends on OrderID)
+3. PayGuard: Balances and Transactions. (Depends on UserID/OrderID)
+4. CareDesk: Tickets, Messages, and Surveys. (Depends on UserID/OrderID)
+
+TASK: Identify which platforms need to be queried for the user's query.
+Return your plan as a JSON object with a "plan" key containing a list of database names.
+CRITICAL: If the query is personal ("I", "My") or mentions a product name, you MUST start with "ShopCore" to identify the User/Order.
+Example: {"plan": ["ShopCore", "ShipStream", "PayGuard", "CareDesk"]}
+"""
+
+SYNTHESIS_PREFIX = """You are the Omni-Retail Premium Customer Assistant.
+GREETING: Address the customer by their Name found in results.
+
+GOAL: Provide a "Perfect Accuracy" answer to the user's query in a professional dashboard style, from the search results of the data nodes (one pipe-separated table per platform; "same:" lists values shared by every row).
+
+GUIDELINES:
+1. NO FAILURES: Instead of saying "I couldn't find...", describe the status. (e.g., If no shipment info, say "Your order is currently in the processing phase and hasn't been handed to logistics yet.").
+2. DATA INTEGRATION: Combine Order details, Tracking status, Wallet balance, and Support ticket history into a single cohesive story.
+3. HIGHLIGHTS: Bold (<b>) all IDs, Tracking Numbers, Statuses, and Balances. NEVER use double asterisks **.
+4. STRUCTURE: Use a summary paragraph followed by <ul> bits of data.
+5. NO TECH-SPEAK: Never mention SQL, JSON, or databases.
+6. NO MARKDOWN: Ensure no ** is used in the final response. Use <b> only.
+"""
+
+# Layout the SQL prompt had before compaction (full schema twice, every domain note); used to count savings
+_UNCOMPACTED_SQL_PROMPT = """You are a SQLite Expert for the '{db_name}' database.
+STRICT SCHEMA:
+{schema}
+
+TASK:
+Generate a SINGLE SELECT statement for: "{query}"
+
+DOMAINS:
+{domains}
+
+STRICT SCHEMA RULES for "{db_name}":
+{schema}
+1. ONLY USE TABLES and COLUMNS listed in the schema ABOVE.
+2. NO HALLUCINATIONS: Do not guess table or column names (e.g., ShipStream does NOT have tickets or surveys).
+3. NO CROSS-DB JOINS: Do not mention other databases.
+4. USE SIMPLE JOINS: Join related tables within this DB only.
+5. FILTERING: Use these Master IDs: {context_summary}. (e.g., WHERE OrderID = [Value])
+6. OUTPUT: Return ONLY the SQL string.
+User's request: {query}"""
+
+_TABLE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?[\"`\[]?(\w+)[\"`\]]?\s*\((.*)\)\s*;?\s*$",
+                    re.IGNORECASE | re.DOTALL)
+_WORDS = re.compile(r"[a-z]+")
+_CAMEL = re.compile(r"[A-Z]+[a-z]*|[a-z]+")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English and SQL)."""
+    return (len(text) + 3) // 4
+
+def _stem(word: str) -> str:
+    word = word.lower()
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def _split_columns(body: str):
+    """Column definitions of a CREATE TABLE body, split on top-level commas."""
+    parts, depth, current = [], 0, []
+    for ch in body:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+class _Table:
+    def __init__(self, name: str, ddl: str, columns):
+        self.name = name
+        self.ddl = ddl
+        self.columns = columns  # [(column name, full definition)]
+        self.column_names = {c for c, _ in columns}
+        self.keys = {c for c in self.column_names if c.endswith("ID")}
+        # Key columns are left out: OrderID in Shipments says nothing about what Shipments holds
+        words = {_stem(w) for w in _CAMEL.findall(name)}
+        for c in self.column_names - self.keys:
+            words |= {_stem(w) for w in _CAMEL.findall(c)}
+        self.terms = words | {_stem(w) for w in TABLE_TERMS.get(name, ())}
+
+    def render(self, keys_only: bool = False) -> str:
+        if not keys_only:
+            return self.ddl
+        cols = [d for c, d in self.columns if c in self.keys]
+        return f"CREATE TABLE {self.name} ({', '.join(cols)})"
+
+def parse_schema(schema: str):
+    """Tables of a get_schema() string, in order. Lines that are not CREATE TABLE are ignored."""
+    tables = []
+    for line in schema.splitlines():
+        m = _TABLE.match(line.strip())
+        if m:
+            columns = []
+            for definition in _split_columns(m.group(2)):
+                first = definition.split()[0].strip("\"`[]") if definition.split() else ""
+                if first.upper() in ("PRIMARY", "FOREIGN", "UNIQUE", "CHECK", "CONSTRAINT"):
+                    continue
+                columns.append((first, definition))
+            tables.append(_Table(m.group(1), line.strip(), columns))
+    return tables
+
+class PromptBuilder:
+    """Builds LLM messages for the agent from cached static prefixes."""
+    def __init__(self, schemas: dict):
+        self.schemas = schemas
+        self._lock = threading.Lock()
+        self._prefixes = {}  # (kind, db_name, schema) -> prefix text
+        self._tables = {}    # schema -> parsed tables
+        self.stats = {"sql_prompts": 0, "prefix_builds": 0, "tokens_saved": 0, "tables_pruned": 0, "unpruned": 0}
+
+    def _prefix(self, db_name: str) -> str:
+        key = ("sql", db_name, self.schemas.get(db_name, ""))
+        with self._lock:
+            prefix = self._prefixes.get(key)
+            if prefix is None:
+                prefix = self._prefixes[key] = SQL_PREFIX.format(
+                    db_name=db_name, domain=DOMAIN_NOTES.get(db_name, "Answer from this database only."))
+                self.stats["prefix_builds"] += 1
+        return prefix
+
+    def _parsed(self, schema: str):
+        with self._lock:
+            tables = self._tables.get(schema)
+            if tables is None:
+                tables = self._tables[schema] = parse_schema(schema)
+        return tables
+
+    def warm_up(self):
+        """Builds every database's prefix and parsed schema ahead of the first question."""
+        for db_name, schema in list(self.schemas.items()):
+            self._prefix(db_name)
+            self._parsed(schema)
+
+    def prune_schema(self, db_name: str, query: str, id_hints: dict = None):
+        """Returns (schema text, tables left out) for the question and the hinted IDs."""
+        schema = self.schemas[db_name]
+        tables = self._parsed(schema)
+        words = {_stem(w) for w in _WORDS.findall(query.lower())}
+        # Names and quoted titles in the question are looked up through a Name column
+        if extract_entities(query):
+            words.add("name")
+        matched = [t for t in tables if t.terms & words]
+        if not tables or not matched:
+            return schema, 0
+
+        by_name = {t.name: t for t in tables}
+        hinted = [t.name for t in tables if t.column_names & set(id_hints or {})]
+        keep = {t.name: False for t in matched}  # name -> keys only
+        # Join each matched table to a table holding a hinted ID (or to the first match)
+        targets = set(hinted) or {matched[0].name}
+        for table in matched:
+            for name in self._join_path(tables, table.name, targets):
+                keep.setdefault(name, True)
+        lines = [line for line in schema.splitlines() if line.strip() and not _TABLE.match(line.strip())][:1]
+        for t in tables:
+            if t.name in keep:
+                lines.append(by_name[t.name].render(keys_only=keep[t.name]))
+        return "\n".join(lines) + "\n", len(tables) - len(keep)
+
+    @staticmethod
+    def _join_path(tables, start: str, targets):
+        """Tables on the shortest chain of shared *ID columns from start to any target (start excluded)."""
+        if start in targets:
+            return []
+        by_name = {t.name: t for t in tables}
+        previous = {start: None}
+        frontier = [start]
+        while frontier:
+            following = []
+            for name in frontier:
+                for other in tables:
+                    if other.name not in previous and by_name[name].keys & other.keys:
+                        previous[other.name] = name
+                        if other.name in targets:
+                            path, step = [], other.name
+                            while step != start:
+                                path.append(step)
+                                step = previous[step]
+                            return path
+                        following.append(other.name)
+            frontier = following
+        return []
+
+    def sql_messages(self, db_name: str, query: str, id_hints: dict = None, rejected=None):
+        """Returns (messages, tokens saved against the uncompacted prompt).
+
+        `rejected` is (sql, reason) for a previous attempt the cost guard turned
+        down; the retry sees the full schema and the reason.
+        """
+        if rejected is None:
+            schema, pruned = self.prune_schema(db_name, query, id_hints)
+        else:
+            schema, pruned = self.schemas[db_name], 0
+        context_summary = json.dumps(id_hints) if id_hints else "No IDs found yet."
+        system = f"{self._prefix(db_name)}\nSCHEMA:\n{schema}\nMaster IDs: {context_summary}\n"
+        user = f"User's request: {query}"
+        if rejected is not None:
+            user += f"\n\nYour previous query was rejected.\nQUERY: {rejected[0]}\nREASON: {rejected[1]}\nWrite a corrected query."
+        uncompacted = _UNCOMPACTED_SQL_PROMPT.format(
+            db_name=db_name, schema=self.schemas[db_name], query=query, context_summary=context_summary,
+            domains="\n".join(f"- {db}: {note}" for db, note in DOMAIN_NOTES.items()),
+        )
+        saved = max(0, estimate_tokens(uncompacted) - estimate_tokens(system) - estimate_tokens(user))
+        with self._lock:
+            self.stats["sql_prompts"] += 1
+            self.stats["tokens_saved"] += saved
+            self.stats["tables_pruned"] += pruned
+            if not pruned:
+                self.stats["unpruned"] += 1
+        return [{"role": "system", "content": system}, {"role": "user", "content": user}], saved
+
+    def planner_messages(self, query: str):
+        return [{"role": "system", "content": PLANNER_PREFIX}, {"role": "user", "content": f'USER QUERY: "{query}"'}]
+
+    def synthesis_messages(self, query: str, context_text: str):
+        user = f'SEARCH RESULTS FROM DATA NODES:\n{context_text}\n\nUSER QUERY: "{query}"'
+        return [{"role": "system", "content": SYNTHESIS_PREFIX}, {"role": "user", "content": user}]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, cached_prefixes=len(self._prefixes))
@@ -0,0 +1,148 @@
+"""Bounded cache of decoded query results, invalidated when a database changes.
+
+Each entry remembers the database version it was read at: the file's identity
+(inode, size, mtime) plus `PRAGMA data_version` from a dedicated watcher
+connection, which changes whenever any other connection commits. A lookup
+whose version no longer matches is dropped, so cached rows are never stale.
+
+With several server workers (shared_store.py), results are also kept in the
+shared state file under the file-level part of the version, which is the same
+in every process: the main file's and its WAL's identity, size and mtime.
+"""
+import os
+import re
+import sys
+import sqlite3
+import threading
+from collections import OrderedDict
+from .shared_store import get_shared_store
+
+DEFAULT_MAX_BYTES_PER_DB = 8 * 1024 * 1024
+DEFAULT_MAX_ENTRIES_PER_DB = 1024
+
+# Results of these depend on when they run, not on the data
+_VOLATILE = re.compile(r"\b(random|randomblob|now|current_date|current_time|current_timestamp|changes|last_insert_rowid)\b", re.IGNORECASE)
+
+def normalize_sql(sql: str) -> str:
+    """Collapses whitespace and trailing semicolons outside string literals."""
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(";").strip())
+    return "".join(p if i % 2 else re.sub(r"\s+", " ", p) for i, p in enumerate(parts))
+
+def estimate_size(rows) -> int:
+    """Approximate memory held by a list of row dicts."""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row.values():
+            size += sys.getsizeof(value)
+    return size
+
+class ResultCache:
+    """Per-database LRU of {(normalized SQL, row cap): rows} with a memory cap per database."""
+    def __init__(self, max_bytes_per_db=DEFAULT_MAX_BYTES_PER_DB, max_entries_per_db=DEFAULT_MAX_ENTRIES_PER_DB,
+                 shared=None):
+        self.max_bytes_per_db = max_bytes_per_db
+        self.max_entries_per_db = max_entries_per_db
+        self.shared = get_shared_store() if shared is None else shared
+        self._lock = threading.Lock()
+        self._entries = {}      # db_name -> OrderedDict((sql, max_rows) -> (version, rows, size, omitted))
+        self._bytes = {}        # db_name -> bytes held
+        self._watchers = {}     # db_name -> (path, connection)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0, "uncacheable": 0,
+                      "shared_hits": 0}
+
+    def _version(self, db_name: str, db_path: str):
+        """Current version token of a database file. Caller holds the lock."""
+        st = os.stat(db_path)
+        watcher = self._watchers.get(db_name)
+        if watcher is None or watcher[0] != db_path:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+            watcher = self._watchers[db_name] = (db_path, conn)
+        data_version = watcher[1].execute("PRAGMA data_version").fetchone()[0]
+        try:
+            wal = os.stat(db_path + "-wal")
+            wal = (wal.st_ino, wal.st_size, wal.st_mtime_ns)
+        except FileNotFoundError:
+            wal = None
+        return (st.st_ino, st.st_size, st.st_mtime_ns, wal, data_version)
+
+    @staticmethod
+    def _shared_key(db_name: str, key) -> str:
+        return repr((db_name,) + key)
+
+    def cacheable(self, sql: str) -> bool:
+        return sql.lstrip().lower().startswith(("select", "with")) and not _VOLATILE.search(sql)
+
+    def get(self, db_name: str, db_path: str, sql: str, max_rows=None):
+        """Returns (rows, omitted, version). rows is None on a miss; pass version back to put()."""
+        key = (normalize_sql(sql), max_rows)
+        with self._lock:
+            version = self._version(db_name, db_path)
+            entries = self._entries.get(db_name)
+            entry = entries.get(key) if entries else None
+            if entry is not None:
+                if entry[0] == version:
+                    entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return list(entry[1]), entry[3], version
+                self._drop(db_name, key)
+                self.stats["invalidations"] += 1
+        if self.shared:
+            # data_version is per connection, so only the file-level part of the version is compared
+            found = self.shared.get("result", self._shared_key(db_name, key))
+            if found is not None and found[0] == version[:-1]:
+                rows, omitted = found[1], found[2]
+                self._store(db_name, key, rows, estimate_size(rows), omitted, version)
+                with self._lock:
+                    self.stats["shared_hits"] += 1
+                    self.stats["hits"] += 1
+                return list(rows), omitted, version
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, 0, version
+
+    def put(self, db_name: str, sql: str, rows, version, max_rows=None, omitted=0):
+        """Caches rows read at `version` (as returned by get())."""
+        if not self.cacheable(sql):
+            with self._lock:
+                self.stats["uncacheable"] += 1
+            return
+        size = estimate_size(rows)
+        if size > self.max_bytes_per_db:
+            return
+        key = (normalize_sql(sql), max_rows)
+        if self.shared:
+            self.shared.set("result", self._shared_key(db_name, key), (version[:-1], list(rows), omitted),
+                            max_entries=self.max_entries_per_db * max(1, len(self._entries)))
+        self._store(db_name, key, rows, size, omitted, version)
+        with self._lock:
+            self.stats["stores"] += 1
+
+    def _store(self, db_name: str, key, rows, size: int, omitted: int, version):
+        with self._lock:
+            entries = self._entries.setdefault(db_name, OrderedDict())
+            if key in entries:
+                self._drop(db_name, key)
+            entries[key] = (version, list(rows), size, omitted)
+            self._bytes[db_name] = self._bytes.get(db_name, 0) + size
+            while entries and (self._bytes[db_name] > self.max_bytes_per_db or len(entries) > self.max_entries_per_db):
+                self._drop(db_name, next(iter(entries)))
+                self.stats["evictions"] += 1
+
+    def _drop(self, db_name: str, key):
+        size = self._entries[db_name].pop(key)[2]
+        self._bytes[db_name] -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                hit_rate=round(self.stats["hits"] / total, 3) if total else 0.0,
+                databases={db: {"entries": len(e), "bytes": self._bytes.get(db, 0)} for db, e in self._entries.items()},
+            )
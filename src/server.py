@@ -1,12 +1,45 @@
 import os
-from fastapi import FastAPI
+import json
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from src.orchestrator_groq import run_omni_query
+from src.orchestrator_groq import get_agent
+from src.metrics import registry
+from src.utils import get_result_cache, pool_stats
+from src.shared_store import get_shared_store
 
-app = FastAPI(title="Omni-Retail Enterprise API")
+# Pre-open connections and load the LLM SDK before serving (OMNI_WARMUP=0 defers that to the first request)
+WARM_UP = os.environ.get("OMNI_WARMUP", "1") != "0"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the shared agent (schemas, LLM settings) once, before the first request
+    app.state.agent = get_agent()
+    agent = app.state.agent
+    registry.add_snapshot("sql_template_cache", agent.sql_cache.snapshot)
+    registry.add_snapshot("result_cache", get_result_cache().snapshot)
+    registry.add_snapshot("fast_planner", agent.fast_planner.snapshot)
+    registry.add_snapshot("connection_pool", pool_stats)
+    registry.add_snapshot("coalescer", agent.coalescer.snapshot)
+    registry.add_snapshot("prompt_builder", agent.prompts.snapshot)
+    registry.add_snapshot("llm_gateway", agent.gateway.snapshot)
+    registry.add_snapshot("sessions", agent.sessions.snapshot)
+    if get_shared_store():
+        registry.add_snapshot("shared_store", get_shared_store().snapshot)
+    if agent.entity_index is not None:
+        registry.add_snapshot("entity_index", agent.entity_index.snapshot)
+    if agent.customer360 is not None:
+        registry.add_snapshot("customer360", agent.customer360.snapshot)
+    if WARM_UP:
+        await agent.warm_up()
+    yield
+
+app = FastAPI(title="Omni-Retail Enterprise API", lifespan=lifespan)
 
 # Enable CORS for the frontend
 app.add_middleware(
@@ -18,17 +51,72 @@ app.add_middleware(
 
 class QueryRequest(BaseModel):
     message: str
-    session_id: str = "default-session"
+    # Without one, the question is answered on its own: nothing is remembered or recalled
+    session_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    messages: List[str]
+    concurrency: Optional[int] = None
+
+MAX_BATCH_SIZE = 1000
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+def _sse_response(events):
+    async def event_source():
+        async for event in events:
+            yield _sse(event)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/chat")
 async def chat_endpoint(request: QueryRequest):
     print(f"Received query: {request.message}")
-    answer, thoughts = run_omni_query(request.message)
+    answer, thoughts, timings = await app.state.agent.ashared_query(request.message, request.session_id)
     return {
         "response": answer,
-        "thought_process": thoughts
+        "thought_process": thoughts,
+        "timings": timings
     }
 
+@app.post("/api/chat/stream")
+async def chat_stream_endpoint(request: QueryRequest):
+    """Server-sent events: plan, per-database SQL and row counts, answer tokens, then "done"."""
+    print(f"Received streaming query: {request.message}")
+    return _sse_response(app.state.agent.astream_query(request.message, request.session_id))
+
+@app.post("/api/chat/batch")
+async def chat_batch_endpoint(request: BatchRequest):
+    """Server-sent events: one "result" (or "error") per message as it completes, then "done" with batch stats."""
+    if not request.messages or len(request.messages) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_BATCH_SIZE} messages")
+    if request.concurrency is not None and request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    print(f"Received batch of {len(request.messages)} queries")
+    return _sse_response(app.state.agent.abatch_query(request.messages, request.concurrency))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape target: per-stage latency histograms, LLM call/token counters, cache stats."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description="OmniAgent API server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("OMNI_WORKERS", "1")),
+                        help="worker processes; more than one shares caches, sessions and LLM quota through data/shared_state.db")
+    args = parser.parse_args()
+    if args.workers > 1:
+        # Inherited by the workers, which import the app themselves
+        os.environ["OMNI_SHARED_STATE"] = "1"
+        uvicorn.run("src.server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
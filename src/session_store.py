@@ -0,0 +1,153 @@
+"""Per-session memory of resolved IDs and recent platform results.
+
+Follow-up questions in a conversation ("and what about my refund?") start
+from the IDs the session already resolved, and plan steps whose results are
+still fresh are answered from the session instead of running again. A
+platform's results are fresh while they are younger than `fresh_seconds` and
+the database file has not changed since they were read.
+
+Sessions are kept in an LRU bounded by `max_sessions` and expire `ttl`
+seconds after their last use. With several server workers (shared_store.py)
+sessions live in the shared state file instead, so a conversation continues
+whichever worker answers its next question.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from .utils import get_db_path
+from .shared_store import get_shared_store
+
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_TTL_SECONDS = float(os.environ.get("OMNI_SESSION_TTL", "1800"))
+DEFAULT_FRESH_SECONDS = float(os.environ.get("OMNI_SESSION_FRESH", "120"))
+
+def db_version(db_file: str):
+    """Changes whenever the database (or its WAL) is written."""
+    path = get_db_path(db_file)
+    version = []
+    for p in (path, path + "-wal"):
+        try:
+            st = os.stat(p)
+            version.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+class Session:
+    def __init__(self):
+        self.id_hints = {}
+        self.entities = set()   # lowercased names/quoted strings the conversation has mentioned
+        self.results = {}       # db_name -> (rows, omitted, read at, db version)
+        self.used = time.monotonic()
+
+class SessionStore:
+    """Bounded, TTL-evicted {session_id: Session} over `databases` ({platform: db file})."""
+    def __init__(self, databases: dict, max_sessions=DEFAULT_MAX_SESSIONS, ttl=DEFAULT_TTL_SECONDS,
+                 fresh_seconds=DEFAULT_FRESH_SECONDS, shared=None):
+        self.databases = databases
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.fresh_seconds = fresh_seconds
+        self.shared = get_shared_store() if shared is None else shared
+        # Ages are compared across processes in shared mode, so they use the wall clock there
+        self._clock = time.time if self.shared else time.monotonic
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "resets": 0, "new_subject": 0, "expired": 0, "evictions": 0, "reused_steps": 0}
+
+    def _expire(self, now: float):
+        """Drops expired sessions; the least recently used are at the front. Caller holds the lock."""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.used < self.ttl:
+                break
+            del self._sessions[session_id]
+            self.stats["expired"] += 1
+
+    def _load(self, session_id: str, now: float):
+        """The live session for session_id, or None. Caller holds the lock."""
+        if self.shared:
+            return self.shared.get("session", session_id)
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _drop(self, session_id: str):
+        if self.shared:
+            self.shared.delete("session", session_id)
+        else:
+            del self._sessions[session_id]
+
+    def recall(self, session_id: str, entities, id_hints: dict):
+        """IDs and fresh results carried over into this turn. Returns (id_hints, {db_name: (rows, omitted, age)}).
+
+        `entities` and `id_hints` are what the new question itself names. If it
+        names a different customer, order or product, or anything the
+        conversation hasn't mentioned yet, the session starts over.
+        """
+        if not session_id:
+            return {}, {}
+        now = self._clock()
+        with self._lock:
+            session = self._load(session_id, now)
+            if session is None:
+                self.stats["misses"] += 1
+                return {}, {}
+            session.used = now
+            if any(session.id_hints.get(key, value) != value for key, value in id_hints.items()):
+                self._drop(session_id)
+                self.stats["resets"] += 1
+                return {}, {}
+            # A name or number the conversation hasn't seen may be someone else: re-identify from scratch
+            if not {e.lower() for e in entities} <= session.entities:
+                self._drop(session_id)
+                self.stats["new_subject"] += 1
+                return {}, {}
+            self.stats["hits"] += 1
+            hints = dict(session.id_hints)
+            results = dict(session.results)
+        fresh = {}
+        for db_name, (rows, omitted, read_at, version) in results.items():
+            age = now - read_at
+            if age < self.fresh_seconds and self.version(db_name) == version:
+                fresh[db_name] = (rows, omitted, age)
+        return hints, fresh
+
+    def version(self, db_name: str):
+        return db_version(self.databases[db_name])
+
+    def remember(self, session_id: str, entities, id_hints: dict, cumulative_context: dict, omitted_rows: dict, versions: dict):
+        """Stores a turn's IDs and results; `versions` holds version() of each platform that ran, taken before it ran."""
+        if not session_id:
+            return
+        now = self._clock()
+        with self._lock:
+            session = self._load(session_id, now)
+            if session is None:
+                session = Session()
+                if not self.shared:
+                    self._sessions[session_id] = session
+                    while len(self._sessions) > self.max_sessions:
+                        self._sessions.popitem(last=False)
+                        self.stats["evictions"] += 1
+            session.used = now
+            session.id_hints.update(id_hints)
+            session.entities |= {e.lower() for e in entities}
+            for db_name, version in versions.items():
+                rows = cumulative_context.get(db_name)
+                if isinstance(rows, list):
+                    session.results[db_name] = (rows, omitted_rows.get(db_name, 0), now, version)
+            if self.shared:
+                # Expiry and the session cap are enforced by the shared store
+                self.shared.set("session", session_id, session, ttl=self.ttl, max_entries=self.max_sessions)
+
+    def note_reused(self, count: int):
+        with self._lock:
+            self.stats["reused_steps"] += count
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, sessions=len(self._sessions), shared=bool(self.shared))
@@ -0,0 +1,165 @@
+"""State shared by the worker processes of a multi-worker server.
+
+With `python -m src.server --workers N` (or OMNI_WORKERS=N) every worker is a
+separate process with its own memory. Caches and LLM quotas that live only in
+memory would then be duplicated N times: each worker regenerates the same SQL,
+re-reads the same rows and spends the full Groq quota on its own. When
+OMNI_SHARED_STATE=1 (set by the launcher) they also use one SQLite file in WAL
+mode (data/shared_state.db, or OMNI_SHARED_STATE_PATH) holding:
+
+- kv: namespaced, expiring entries. The SQL template cache, result cache and
+  session store read through to it on a local miss and write to it on store;
+- buckets: the LLM token buckets, so all workers draw from one quota.
+
+Values are pickled; the file is local to the instance and written only by
+its own workers.
+"""
+import os
+import time
+import pickle
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.environ.get(
+    "OMNI_SHARED_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "shared_state.db"),
+)
+# Seconds a worker waits for another one's write transaction
+BUSY_TIMEOUT = 10.0
+# Every this many writes, expired entries are dropped and namespaces trimmed
+PRUNE_EVERY = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (ns TEXT, key TEXT, value BLOB, stored REAL, expires REAL,
+    PRIMARY KEY (ns, key)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_kv_stored ON kv (ns, stored);
+CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL, updated REAL, blocked_until REAL);
+"""
+
+class SharedStore:
+    """Thread- and process-safe access to the shared state file; one connection per thread."""
+    def __init__(self, path: str = None):
+        self.path = DEFAULT_PATH if path is None else path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._limits = {}  # ns -> max entries
+        self.stats = {"gets": 0, "hits": 0, "sets": 0, "pruned": 0}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode = WAL")
+        with conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; write transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def get(self, ns: str, key: str):
+        """The value stored under (ns, key), or None if there is none or it expired."""
+        self._count("gets")
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE ns = ? AND key = ? AND (expires IS NULL OR expires > ?)",
+            (ns, key, time.time())).fetchone()
+        if row is None:
+            return None
+        self._count("hits")
+        return pickle.loads(row[0])
+
+    def set(self, ns: str, key: str, value, ttl: float = None, max_entries: int = None):
+        """Stores a value; with `max_entries`, the namespace keeps only that many (oldest dropped first)."""
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (ns, key, value, stored, expires) VALUES (?, ?, ?, ?, ?)",
+            (ns, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now + ttl if ttl else None))
+        with self._lock:
+            self.stats["sets"] += 1
+            if max_entries:
+                self._limits[ns] = max_entries
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def delete(self, ns: str, key: str = None):
+        """Drops one entry, or the whole namespace when key is None."""
+        if key is None:
+            self._conn().execute("DELETE FROM kv WHERE ns = ?", (ns,))
+        else:
+            self._conn().execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def prune(self):
+        """Drops expired entries and trims namespaces to their max_entries."""
+        conn = self._conn()
+        with self._lock:
+            limits = dict(self._limits)
+        dropped = conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)).rowcount
+        for ns, limit in limits.items():
+            dropped += conn.execute(
+                "DELETE FROM kv WHERE ns = ? AND key IN (SELECT key FROM kv WHERE ns = ? ORDER BY stored DESC "
+                "LIMIT -1 OFFSET ?)", (ns, ns, limit)).rowcount
+        self._count("pruned", dropped)
+
+    def _bucket(self, conn, name: str, capacity: float, rate: float, now: float):
+        """(level, blocked_until) of a bucket refilled up to now. Caller is inside a write transaction."""
+        row = conn.execute("SELECT level, updated, blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return capacity, 0.0
+        level, updated, blocked_until = row
+        return min(capacity, level + max(0.0, now - updated) * rate), blocked_until
+
+    def bucket(self, name: str, capacity: float, rate: float, take: float = 0.0, block: float = 0.0):
+        """Atomically refills a bucket, then takes `take` units and/or blocks it for `block` seconds.
+
+        Returns (level, blocked_until) after the change. `take` may be negative (units given back).
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            level, blocked_until = self._bucket(conn, name, capacity, rate, now)
+            level = min(capacity, level - take)
+            if block:
+                blocked_until = max(blocked_until, now + block)
+            conn.execute("INSERT OR REPLACE INTO buckets (name, level, updated, blocked_until) VALUES (?, ?, ?, ?)",
+                         (name, level, now, blocked_until))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return level, blocked_until
+
+    def peek_bucket(self, name: str, capacity: float, rate: float):
+        """(level, blocked_until) without changing the bucket."""
+        row = self._conn().execute(
+            "SELECT level, updated, blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return capacity, 0.0
+        level, updated, blocked_until = row
+        return min(capacity, level + max(0.0, time.time() - updated) * rate), blocked_until
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def get_shared_store():
+    """The process's SharedStore when OMNI_SHARED_STATE=1, otherwise None (everything stays in memory)."""
+    global _shared
+    if os.environ.get("OMNI_SHARED_STATE", "0") != "1":
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedStore()
+        return _shared
@@ -0,0 +1,205 @@
+"""Set-based execution of the SQL a batch of queries generates for one plan stage.
+
+Every step of the stage hands its statement to a shared SQLBatch and waits.
+Once all steps have arrived (or dropped out), the statements run together:
+
+- identical statements (after whitespace normalization) run once;
+- statements that differ only in one `column = literal` filter are merged into
+  one `column IN (...)` query, and its rows are split back per statement.
+
+Merging is only attempted on plain SELECT ... WHERE a AND b ... statements,
+without LIMIT, aggregates, grouping, OR or subqueries, where splitting the
+rows by the filter column gives exactly what each statement would have
+returned. Anything that doesn't verify falls back to running statements
+one by one.
+"""
+import re
+import asyncio
+from .utils import fetch_rows
+from .result_cache import normalize_sql
+from .sql_guard import ROW_LIMIT
+
+BATCH_KEY = "__batch_key"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+# Constructs that make per-filter splitting of a merged result unsafe
+_UNSAFE = re.compile(
+    r"\b(limit|offset|group\s+by|having|union|intersect|except|over|or|not|collate)\b|"
+    r"\b(count|sum|avg|min|max|total|group_concat)\s*\(|;", re.IGNORECASE
+)
+_FILTER = re.compile(r"((?:\b[A-Za-z_]\w*\.)?\b[A-Za-z_]\w*)\s*=\s*(-?\d+(?:\.\d+)?\b|'(?:[^']|'')*')")
+
+def _mask_strings(sql: str) -> str:
+    """Blanks out string literal contents, keeping offsets, so keywords inside them are ignored."""
+    return _STRING.sub(lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", sql)
+
+def _literal_value(text: str):
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    return float(text) if "." in text else int(text)
+
+def split_filters(sql: str):
+    """Returns (shape, [(column, literal)]) for a mergeable statement, else None.
+
+    `shape` is the statement with every `= literal` in its WHERE clause
+    replaced by a numbered placeholder, so statements with equal shapes differ
+    only in those literals.
+    """
+    sql = normalize_sql(sql)
+    masked = _mask_strings(sql)
+    if not re.match(r"select\s", masked, re.IGNORECASE) or len(re.findall(r"\bselect\b", masked, re.IGNORECASE)) != 1:
+        return None
+    if _UNSAFE.search(masked):
+        return None
+    where = re.search(r"\bwhere\b", masked, re.IGNORECASE)
+    if where is None:
+        return None
+    filters, pieces, last = [], [], 0
+    for m in _FILTER.finditer(masked, where.end()):
+        # Only whole AND terms: `b + a = 1` or `a = 1 + b` can't become `a IN (...)`
+        before = masked[:m.start()].rstrip().lower()
+        after = masked[m.end():].lstrip().lower()
+        if not (before.endswith(("where", "and", "(")) and (not after or after.startswith(("and", "order", ")")))):
+            continue
+        pieces.append(sql[last:m.end(1)])
+        # NUL-delimited so literal text elsewhere in the statement can't look like a placeholder
+        pieces.append(f" \x00{len(filters)}\x00")
+        filters.append((m.group(1), sql[m.start(2):m.end(2)]))
+        last = m.end(2)
+    if not filters:
+        return None
+    pieces.append(sql[last:])
+    return "".join(pieces), filters
+
+def merge_statements(statements):
+    """Merges statements of equal shape that differ in exactly one filter.
+
+    Returns (merged SQL, [filter value per statement]) or None.
+    """
+    parsed = [split_filters(sql) for sql in statements]
+    if any(p is None for p in parsed) or len({p[0] for p in parsed}) != 1:
+        return None
+    shape, first = parsed[0]
+    varying = [i for i in range(len(first)) if len({p[1][i][1] for p in parsed}) > 1]
+    if len(varying) != 1:
+        return None
+    slot = varying[0]
+    literals = [p[1][slot][1] for p in parsed]
+    values = {str(i): f"= {literal}" for i, (_, literal) in enumerate(first)}
+    values[str(slot)] = f"IN ({', '.join(literals)})"
+    merged = re.sub(r"\x00(\d+)\x00", lambda m: values[m.group(1)], shape)
+    # Carry the filter column along so rows can be split back per statement
+    from_at = re.search(r"\sfrom\s", _mask_strings(merged), re.IGNORECASE).start()
+    merged = f"{merged[:from_at]}, {first[slot][0]} AS {BATCH_KEY}{merged[from_at:]}"
+    return merged, [_literal_value(literal) for literal in literals]
+
+def run_statements(db_file: str, statements, max_rows: int, stats: dict) -> dict:
+    """Runs distinct statements against one database. Returns {statement: (rows, omitted) or exception}."""
+    merged = merge_statements(statements) if len(statements) > 1 else None
+    if merged is not None:
+        sql, keys = merged
+        try:
+            rows, omitted = fetch_rows(db_file, sql, max_rows * len(keys), row_limit=ROW_LIMIT * len(keys))
+        except Exception:
+            rows, omitted = None, 0
+        # Only trust the split when nothing was cut off and every row maps to a statement
+        if rows is not None and not omitted and all(row[BATCH_KEY] in keys for row in rows):
+            split = {}
+            for row in rows:
+                # Rows may be shared with the result cache, so copy rather than pop
+                split.setdefault(row[BATCH_KEY], []).append({k: v for k, v in row.items() if k != BATCH_KEY})
+            stats["merged"] += len(statements)
+            stats["executed"] += 1
+            results = {}
+            for statement, key in zip(statements, keys):
+                part = split.get(key, [])
+                results[statement] = (part[:max_rows], max(0, len(part) - max_rows))
+            return results
+
+    results = {}
+    for statement in statements:
+        try:
+            results[statement] = fetch_rows(db_file, statement, max_rows)
+        except Exception as e:
+            results[statement] = e
+        stats["executed"] += 1
+    return results
+
+def run_batch(db_file: str, statements, max_rows: int) -> tuple:
+    """Runs one database's statements with deduplication and merging.
+
+    Returns ({normalized SQL: (rows, omitted) or exception}, stats).
+    """
+    distinct = {}
+    for sql in statements:
+        distinct.setdefault(normalize_sql(sql), sql)
+    stats = {"requests": len(statements), "deduplicated": len(statements) - len(distinct), "merged": 0, "executed": 0}
+
+    groups = {}
+    for normalized, sql in distinct.items():
+        parsed = split_filters(sql)
+        groups.setdefault(parsed[0] if parsed else normalized, []).append(sql)
+    results = {}
+    for group in groups.values():
+        for sql, outcome in run_statements(db_file, group, max_rows, stats).items():
+            results[normalize_sql(sql)] = outcome
+    return results, stats
+
+class SQLBatch:
+    """Barrier for one plan stage of a batch: collects `expected` steps, then runs their SQL together."""
+    def __init__(self, expected: int, max_rows: int, stats: dict):
+        self.expected = expected
+        self.max_rows = max_rows
+        self.stats = stats
+        self.accounted = 0
+        self.waiting = []
+        self._flushes = set()
+
+    async def fetch(self, db_file: str, sql: str):
+        """Same contract as fetch_rows: returns (rows, omitted) or raises."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((db_file, sql, future))
+        self.accounted += 1
+        self._maybe_flush()
+        outcome = await future
+        if isinstance(outcome, Exception):
+            raise outcome
+        rows, omitted = outcome
+        # Statements shared by several steps share rows; give each step its own dicts
+        return [dict(r) for r in rows], omitted
+
+    def skip(self, count: int = 1):
+        """Marks steps that will never call fetch (they failed or ended early)."""
+        self.accounted += count
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if not self.waiting or self.accounted < self.expected:
+            return
+        waiting, self.waiting = self.waiting, []
+        task = asyncio.ensure_future(self._flush(waiting))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, waiting):
+        by_db = {}
+        for db_file, sql, _ in waiting:
+            by_db.setdefault(db_file, []).append(sql)
+        # One thread per database file; the statements of a database run together
+        outcomes = await asyncio.gather(
+            *(asyncio.to_thread(run_batch, db_file, statements, self.max_rows) for db_file, statements in by_db.items()),
+            return_exceptions=True,
+        )
+        results, failed = {}, {}
+        for db_file, outcome in zip(by_db, outcomes):
+            if isinstance(outcome, Exception):
+                failed[db_file] = outcome
+                continue
+            db_results, stats = outcome
+            for key, value in stats.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+            for normalized, result in db_results.items():
+                results[(db_file, normalized)] = result
+        for db_file, sql, future in waiting:
+            if not future.done():
+                future.set_result(failed.get(db_file) or results[(db_file, normalize_sql(sql))])
@@ -0,0 +1,287 @@
+"""Parameterized NL-to-SQL template cache.
+
+The SQL the LLM writes for a database is turned into a template: literal IDs
+that came from `id_hints` become `{OrderID}`-style placeholders, and literals
+copied from the user's text (names, products, order numbers) become `{e0}`,
+`{e1}`... entity slots. Later queries with the same intent signature and the
+same set of hint keys bind their own values and skip the LLM call.
+With several server workers, templates are also written to the shared state
+file (shared_store.py), so a template one worker learns serves them all.
+"""
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .shared_store import get_shared_store
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 3600
+
+# Words that do not change what data a question needs
+FILLER_WORDS = {
+    "a", "an", "the", "i", "am", "is", "are", "was", "me", "my", "mine", "you", "your", "please",
+    "can", "could", "would", "will", "tell", "show", "check", "give", "let", "know", "hi", "hello",
+    "hey", "thanks", "thank", "and", "also", "of", "for", "on", "to", "it", "this", "that", "right",
+    "now", "there", "some", "any", "just", "so", "does", "do", "did", "he", "she", "his", "her",
+    "they", "their", "s",
+}
+# Capitalised words that open a sentence without naming anything
+SENTENCE_WORDS = {
+    "I", "Can", "Could", "Would", "Will", "Please", "Check", "Tell", "Show", "Give", "What", "Where",
+    "When", "Why", "How", "Which", "Who", "Is", "Are", "Does", "Do", "Did", "Has", "Have", "Also",
+    "And", "My", "The", "A", "An", "Hi", "Hello", "Hey", "Thanks", "Based", "Give", "It", "He", "She",
+}
+
+_QUOTED = re.compile(r"""['"]([^'"]{2,})['"]""")
+_NUMBER = re.compile(r"#?\b(\d+)\b")
+_CAPITALISED = re.compile(r"\b[A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*")
+_SQL_STRING = re.compile(r"'((?:[^']|'')*)'")
+# Numeric literals in comparison position: `= 101`, `IN (101, 102)`
+_SQL_COMPARED_NUMBER = re.compile(r"(=\s*|\bIN\s*\(\s*|,\s*(?=[\d\s,]*\)))(\d+)\b", re.IGNORECASE)
+# The column a compared number belongs to, from the SQL just before it: `o.ProductID = `, `UserID IN (3, `
+_SQL_COMPARED_COLUMN = re.compile(r"(\w+)[\"`\]]?\s*(?:[<>!]?=\s*|\bIN\s*\([\d\s,]*)$", re.IGNORECASE)
+
+def _entity_spans(query: str):
+    """(start, text) of every entity in the query, in order of appearance."""
+    spans = []
+    for m in _QUOTED.finditer(query):
+        spans.append((m.start(1), m.group(1).strip()))
+    quoted = [(m.start(), m.end()) for m in _QUOTED.finditer(query)]
+    inside_quotes = lambda pos: any(s <= pos < e for s, e in quoted)
+    for m in _CAPITALISED.finditer(query):
+        if inside_quotes(m.start()):
+            continue
+        words = [w for w in m.group(0).split() if w not in SENTENCE_WORDS]
+        if words:
+            spans.append((m.start(), " ".join(words)))
+    for m in _NUMBER.finditer(query):
+        if not inside_quotes(m.start()):
+            spans.append((m.start(), m.group(1)))
+    return sorted(spans)
+
+def extract_entities(query: str):
+    """Quoted strings, capitalised names and numbers from the user's text, in order of appearance."""
+    return [text for _, text in _entity_spans(query)]
+
+def intent_signature(query: str) -> str:
+    """Order-insensitive content words of the query with every entity removed.
+
+    Template slots e0, e1... are numbered by where each entity appears, so with
+    several entities the word just before each one, in order, is part of the
+    signature: "I am X and I ordered 'Y'" and "I ordered 'Y' and I am X" differ.
+    """
+    spans = _entity_spans(query)
+    entities = [text for _, text in spans]
+    text = query
+    for entity in entities:
+        text = re.sub(re.escape(entity), " ", text, flags=re.IGNORECASE)
+    words = re.findall(r"[a-z]+", text.lower())
+    content = sorted({w for w in words if w not in FILLER_WORDS})
+    signature = f"{len(entities)}|{' '.join(content)}"
+    if len(entities) > 1:
+        cues = [(re.findall(r"[a-z]+", query[:start].lower()) or ["^"])[-1] for start, _ in spans]
+        signature += "|" + " ".join(cues)
+    return signature
+
+def schema_fingerprint(schema: str) -> str:
+    return hashlib.sha1(schema.encode("utf-8")).hexdigest()
+
+def _sql_quote(value) -> str:
+    return str(value).replace("'", "''")
+
+def _case_of(text: str) -> str:
+    if text.islower():
+        return "lower"
+    if text.isupper():
+        return "upper"
+    return "asis"
+
+def _apply_case(value: str, case: str) -> str:
+    if case == "lower":
+        return value.lower()
+    if case == "upper":
+        return value.upper()
+    return value
+
+def _escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+def _leaks_entities(template: str, entities) -> bool:
+    """True if any word or number of the user's entities survived templating verbatim."""
+    for entity in entities:
+        for word in entity.split():
+            if len(word) > 1 and re.search(r"\b" + re.escape(word) + r"\b", template, re.IGNORECASE):
+                return True
+    return False
+
+def make_template(sql: str, query: str, id_hints: dict):
+    """Replaces hint IDs and user-supplied literals in sql with placeholders. Returns (template, slots).
+
+    A number is bound to the hint named by the column it is compared with. When
+    that can't tell which hint or entity a number stands for, template is None:
+    the SQL is not cached rather than bound to the wrong value.
+    """
+    entities = extract_entities(query)
+    slots = []
+    ambiguous = False
+
+    def string_literal(m):
+        text = m.group(1).replace("''", "'")
+        for i, entity in enumerate(entities):
+            pos = text.lower().find(entity.lower())
+            if pos >= 0 and not entity.isdigit():
+                slot = f"e{i}"
+                slots.append((slot, _case_of(text[pos:pos + len(entity)])))
+                before, after = text[:pos], text[pos + len(entity):]
+                return "'" + _escape_braces(_sql_quote(before)) + "{" + slot + "}" + _escape_braces(_sql_quote(after)) + "'"
+        for key, value in id_hints.items():
+            if isinstance(value, str) and text == value:
+                return "'{" + key + "}'"
+        return "'" + _escape_braces(m.group(1)) + "'"
+
+    def number_literal(m):
+        nonlocal ambiguous
+        prefix, number = m.group(1), m.group(2)
+        keys = [key for key, value in id_hints.items() if str(value) == number and not isinstance(value, str)]
+        candidates = keys + ["e" + str(i) for i, entity in enumerate(entities) if entity == number]
+        if not candidates:
+            return prefix + number
+        column = _SQL_COMPARED_COLUMN.search(m.string[:m.start(2)])
+        column = column.group(1).lower() if column else None
+        for key in keys:
+            if key.lower() == column:
+                return prefix + "{" + key + "}"
+        # `ProductID = 1` when only UserID is 1 may or may not be the user's ID: don't guess
+        if len(candidates) == 1 and (column is None or not keys):
+            return prefix + "{" + candidates[0] + "}"
+        ambiguous = True
+        return prefix + number
+
+    # Escape braces outside string literals, then rewrite numbers there
+    pieces = []
+    last = 0
+    for m in _SQL_STRING.finditer(sql):
+        outside = _escape_braces(sql[last:m.start()])
+        pieces.append(_SQL_COMPARED_NUMBER.sub(number_literal, outside))
+        pieces.append(string_literal(m))
+        last = m.end()
+    outside = _escape_braces(sql[last:])
+    pieces.append(_SQL_COMPARED_NUMBER.sub(number_literal, outside))
+    if ambiguous:
+        return None, {}
+    return "".join(pieces), dict(slots)
+
+def bind_template(template: str, slots: dict, query: str, id_hints: dict):
+    """Fills a template with this query's entities and hints. Returns None if something is missing."""
+    entities = extract_entities(query)
+    values = {}
+    for i, entity in enumerate(entities):
+        slot = f"e{i}"
+        values[slot] = _sql_quote(_apply_case(entity, slots.get(slot, "asis")))
+    for key, value in id_hints.items():
+        values[key] = _sql_quote(value)
+    try:
+        return template.format(**values)
+    except (KeyError, IndexError):
+        return None
+
+class SQLTemplateCache:
+    """LRU + TTL cache of SQL templates keyed by (database, intent signature, hint keys)."""
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, shared=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared = get_shared_store() if shared is None else shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0, "shared_hits": 0}
+
+    def _from_shared(self, key):
+        """Copies another worker's template for key into this process. Returns the local entry or None."""
+        if not self.shared:
+            return None
+        found = self.shared.get("sql_template", repr(key))
+        if found is None:
+            return None
+        template, slots, fingerprint, stored_wall = found
+        entry = (template, slots, fingerprint, time.monotonic() - max(0.0, time.time() - stored_wall))
+        with self._lock:
+            self._entries[key] = entry
+            self.stats["shared_hits"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return entry
+
+    @staticmethod
+    def key(db_name: str, query: str, id_hints: dict):
+        return (db_name, intent_signature(query), tuple(sorted(id_hints)))
+
+    def lookup(self, db_name: str, query: str, id_hints: dict, schema: str):
+        """Returns ready-to-run SQL for this query, or None on a miss."""
+        key = self.key(db_name, query, id_hints)
+        fingerprint = schema_fingerprint(schema)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._from_shared(key)
+        with self._lock:
+            if entry is not None:
+                template, slots, entry_fingerprint, stored_at = entry
+                # Another thread may have evicted the key while the lock was released for the shared read
+                if entry_fingerprint != fingerprint:
+                    self._entries.pop(key, None)
+                    self.stats["invalidations"] += 1
+                    entry = None
+                elif time.monotonic() - stored_at > self.ttl_seconds:
+                    self._entries.pop(key, None)
+                    self.stats["evictions"] += 1
+                    entry = None
+                elif key in self._entries:
+                    self._entries.move_to_end(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+        sql = bind_template(template, slots, query, id_hints)
+        with self._lock:
+            self.stats["hits" if sql else "misses"] += 1
+        return sql
+
+    def store(self, db_name: str, query: str, id_hints: dict, schema: str, sql: str):
+        """Templates and caches SQL that executed successfully for this query."""
+        template, slots = make_template(sql, query, id_hints)
+        # A template that still embeds this user's names or numbers would leak them into other queries
+        if template is None or _leaks_entities(template, extract_entities(query)):
+            return
+        if bind_template(template, slots, query, id_hints) != sql:
+            return
+        key = self.key(db_name, query, id_hints)
+        if self.shared:
+            self.shared.set("sql_template", repr(key), (template, slots, schema_fingerprint(schema), time.time()),
+                            ttl=self.ttl_seconds, max_entries=self.max_entries)
+        with self._lock:
+            self._entries[key] = (template, slots, schema_fingerprint(schema), time.monotonic())
+            self._entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, db_name: str = None):
+        """Drops every template (or every template for one database)."""
+        with self._lock:
+            keys = [k for k in self._entries if db_name is None or k[0] == db_name]
+            for k in keys:
+                del self._entries[k]
+            self.stats["invalidations"] += len(keys)
+        if self.shared:
+            # Keys are repr() of (db_name, ...) tuples; a whole-cache invalidation drops every worker's copy
+            if db_name is None:
+                self.shared.delete("sql_template")
+            else:
+                for k in keys:
+                    self.shared.delete("sql_template", repr(k))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
@@ -0,0 +1,140 @@
+"""Cost guard for LLM-generated SQL.
+
+Before a generated statement runs, its EXPLAIN QUERY PLAN is inspected:
+
+- a full scan of a large table (more than SCAN_ROW_LIMIT rows) is flagged;
+- several full scans in one join whose row counts multiply past
+  CROSS_JOIN_LIMIT (a cartesian or unconstrained join) are flagged as blocking;
+- a statement that doesn't compile is flagged as blocking.
+
+The agent sends flagged statements back to the LLM once with the reason.
+Every statement that runs is also bounded: a LIMIT is appended when the
+statement has none, and a progress handler interrupts it past a time limit.
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCAN_ROW_LIMIT = int(os.environ.get("OMNI_SQL_SCAN_LIMIT", "50000"))
+CROSS_JOIN_LIMIT = int(os.environ.get("OMNI_SQL_CROSS_LIMIT", "100000"))
+ROW_LIMIT = int(os.environ.get("OMNI_SQL_ROW_LIMIT", "10000"))
+TIMEOUT_SECONDS = float(os.environ.get("OMNI_SQL_TIMEOUT", "2.0"))
+# SQLite VM instructions between two deadline checks
+PROGRESS_STEPS = 10000
+ROW_ESTIMATE_TTL = 60.0
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARENS = re.compile(r"\([^()]*\)")
+_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW|\()(\S+)")
+_FROM = re.compile(r"\bFROM\b(.*?)(?=\bWHERE\b|\bGROUP\b|\bORDER\b|\bLIMIT\b|\bHAVING\b|\bUNION\b|\bWINDOW\b|\)|$)",
+                   re.IGNORECASE | re.DOTALL)
+_SOURCE = re.compile(r"\s*([\w.]+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIAS = {"WHERE", "JOIN", "ON", "LEFT", "INNER", "CROSS", "OUTER", "NATURAL", "ORDER", "GROUP", "LIMIT", "USING",
+              "UNION", "HAVING", "WINDOW"}
+
+_estimates = {}  # (database file, table) -> (rows, read at)
+_estimates_lock = threading.Lock()
+
+class QueryTimeout(sqlite3.OperationalError):
+    """A statement ran past its time limit and was interrupted."""
+
+def _top_level(sql: str) -> str:
+    """The statement with string literals blanked and parenthesised parts removed."""
+    text = _STRING.sub("''", sql)
+    while True:
+        stripped = _PARENS.sub(" ", text)
+        if stripped == text:
+            return text
+        text = stripped
+
+def cap_rows(sql: str, limit: int) -> str:
+    """Appends `LIMIT limit` to a statement that has no LIMIT of its own."""
+    if not limit or re.search(r"\blimit\b", _top_level(sql), re.IGNORECASE):
+        return sql
+    # On its own line, so a trailing `--` comment can't swallow it
+    return f"{sql.strip().rstrip(';').rstrip()}\nLIMIT {int(limit)}"
+
+@contextmanager
+def time_limit(conn: sqlite3.Connection, seconds: float):
+    """Interrupts statements run on conn inside the block once `seconds` have passed."""
+    if not seconds:
+        yield
+        return
+    deadline = time.perf_counter() + seconds
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, PROGRESS_STEPS)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e) and time.perf_counter() > deadline:
+            raise QueryTimeout(f"query stopped after the {seconds:g}s time limit") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+def _aliases(sql: str) -> dict:
+    """{alias or table name (lowercase): table} for the FROM/JOIN sources of a statement."""
+    aliases = {}
+    for clause in _FROM.finditer(_STRING.sub("''", sql)):
+        for source in re.split(r",|\bJOIN\b", clause.group(1), flags=re.IGNORECASE):
+            m = _SOURCE.match(source)
+            if not m or m.group(1).upper() in _NOT_ALIAS:
+                continue
+            table, alias = m.group(1), m.group(2)
+            aliases[table.split(".")[-1].lower()] = table
+            if alias and alias.upper() not in _NOT_ALIAS:
+                aliases[alias.lower()] = table
+    return aliases
+
+def estimate_rows(conn: sqlite3.Connection, table: str) -> int:
+    """Approximate row count from the rowid range, read from both ends of the table's b-tree."""
+    schema, _, name = table.rpartition(".")
+    files = {row[1]: row[2] for row in conn.execute("PRAGMA database_list")}
+    key = (files.get(schema or "main", ""), name.lower())
+    now = time.monotonic()
+    with _estimates_lock:
+        cached = _estimates.get(key)
+    if cached is not None and now - cached[1] < ROW_ESTIMATE_TTL:
+        return cached[0]
+    try:
+        low, high = conn.execute(
+            f"SELECT (SELECT min(rowid) FROM {table}), (SELECT max(rowid) FROM {table})").fetchone()
+        rows = high - low + 1 if high is not None else 0
+    except sqlite3.Error:
+        # WITHOUT ROWID tables and views: unknown, so not judged
+        rows = 0
+    with _estimates_lock:
+        _estimates[key] = (rows, now)
+    return rows
+
+def inspect(conn: sqlite3.Connection, sql: str, scan_limit: int = SCAN_ROW_LIMIT, cross_limit: int = CROSS_JOIN_LIMIT):
+    """Problems with a statement's plan, as [(reason, blocking)]. Empty when it looks fine."""
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    except sqlite3.Error as e:
+        return [(f"does not compile: {e}", True)]
+
+    aliases = _aliases(sql)
+    problems = []
+    scans_by_parent = {}
+    for _, parent, _, detail in plan:
+        m = _SCAN.match(detail)
+        if not m:
+            continue
+        table = aliases.get(m.group(1).lower(), m.group(1))
+        rows = estimate_rows(conn, table)
+        scans_by_parent.setdefault(parent, []).append((table, rows))
+        if rows > scan_limit:
+            problems.append((f"full scan of {table} (~{rows} rows) without an index; filter it on an indexed ID column", False))
+    for scans in scans_by_parent.values():
+        if len(scans) < 2:
+            continue
+        combinations = 1
+        for _, rows in scans:
+            combinations *= max(rows, 1)
+        if combinations > cross_limit:
+            names = " x ".join(table for table, _ in scans)
+            problems.append((f"unconstrained join {names} (~{combinations} row combinations); join on matching ID columns", True))
+    return problems
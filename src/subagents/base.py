@@ -1,14 +1,21 @@
 import os
-from groq import Groq
-from dotenv import load_dotenv
-
-load_dotenv()
 
 class BaseSubAgent:
     """The base architecture for all Omni-Agents."""
     def __init__(self, role_name: str):
         self.role_name = role_name
-        self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        self._client = None
+
+    @property
+    def client(self):
+        """Groq client, created (and the SDK imported) on first use."""
+        if self._client is None:
+            from groq import Groq
+            from dotenv import load_dotenv
+            # .env is read here, not at import, so importing a sub-agent stays cheap
+            load_dotenv()
+            self._client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        return self._client
 
     def log_thought(self, thought: str):
         print(f"[{self.role_name}] {thought}")
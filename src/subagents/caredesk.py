@@ -1,10 +1,11 @@
 import json
-from ..orchestrator_groq import OmniAgent
+from ..orchestrator_groq import get_agent
 
 class SupportAgent:
     """The modern CareDesk Agent. Part of the Unified Omni-Brain."""
     def __init__(self):
-        self.brain = OmniAgent()
+        # One process-wide agent: schemas, connections and LLM client are shared by every sub-agent
+        self.brain = get_agent()
 
     def query(self, user_query):
         # This agent now uses the consolidated high-performance engine
@@ -1,9 +1,10 @@
-from ..orchestrator_groq import OmniAgent
+from ..orchestrator_groq import get_agent
 
 class LogisticsAgent:
     """The modern ShipStream Agent. Part of the Unified Omni-Brain."""
     def __init__(self):
-        self.brain = OmniAgent()
+        # One process-wide agent: schemas, connections and LLM client are shared by every sub-agent
+        self.brain = get_agent()
 
     def query(self, user_query):
         ans, thoughts = self.brain.run_query(user_query)
@@ -1,9 +1,34 @@
 import sqlite3
 import os
 import json
+import threading
+from .result_cache import ResultCache
+from . import sql_guard
 
-def get_db_connection(db_name: str):
-    """Returns a connection to the specified database."""
+# Read-only connection tuning for the pooled query path
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the file mapped into memory
+SQLITE_CACHE_SIZE = -64000            # negative = KiB, i.e. ~64 MB page cache per connection
+SQLITE_CACHED_STATEMENTS = 256        # prepared statements kept per connection
+# Rows past a fetch_rows cap are counted, but only up to this many
+OMITTED_COUNT_LIMIT = 100000
+
+# On-disk copy of each database's schema, reused while the file and its schema_version are unchanged
+SCHEMA_SNAPSHOT_PATH = os.environ.get(
+    "OMNI_SCHEMA_SNAPSHOT",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "schema_snapshot.json"),
+)
+
+# Pseudo database for federated queries: ShopCore as main, the others ATTACHed under these aliases
+FEDERATED_DB = "federated"
+FEDERATED_MAIN = "DB_ShopCore.db"
+FEDERATED_ATTACHMENTS = {
+    "ShipStream": "DB_ShipStream.db",
+    "PayGuard": "DB_PayGuard.db",
+    "CareDesk": "DB_CareDesk.db",
+}
+
+def get_db_path(db_name: str) -> str:
+    """Resolves a database file name to its path in the data/ folder."""
     # Assuming run from root omni_retail or similar, adjust path
     # We look for data/ folder relative to current working dir or this file
     
@@ -14,39 +39,244 @@ def get_db_connection(db_name: str):
     
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"Database {db_name} not found at {db_path}")
-        
-    return sqlite3.connect(db_path)
+    return db_path
+
+def get_db_connection(db_name: str):
+    """Returns a (writable) connection to the specified database."""
+    return sqlite3.connect(get_db_path(db_name))
+
+class ConnectionPool:
+    """Read-only SQLite connections keyed by database file, one per thread.
+
+    Connections are opened once with a `mode=ro` URI and query-only pragmas,
+    then reused (together with their prepared-statement cache) by every later
+    query on the same thread.
+    """
+    def __init__(self, mmap_size=SQLITE_MMAP_SIZE, cache_size=SQLITE_CACHE_SIZE,
+                 cached_statements=SQLITE_CACHED_STATEMENTS):
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._generation = 0
+        self._stats = {}
+
+    def _open(self, db_name: str) -> sqlite3.Connection:
+        federated = db_name == FEDERATED_DB
+        uri = f"file:{get_db_path(FEDERATED_MAIN if federated else db_name)}?mode=ro"
+        # The owning thread is the only user; check_same_thread=False just lets close_all() run anywhere
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        schemas = ["main"]
+        if federated:
+            for alias, file_name in FEDERATED_ATTACHMENTS.items():
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (f"file:{get_db_path(file_name)}?mode=ro",))
+                schemas.append(alias)
+        conn.execute("PRAGMA query_only = ON")
+        for schema in schemas:
+            conn.execute(f"PRAGMA {schema}.mmap_size = {int(self.mmap_size)}")
+            conn.execute(f"PRAGMA {schema}.cache_size = {int(self.cache_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _count(self, db_name: str, key: str):
+        with self._lock:
+            stats = self._stats.setdefault(db_name, {"opened": 0, "reused": 0})
+            stats[key] += 1
+
+    def get(self, db_name: str) -> sqlite3.Connection:
+        """Returns this thread's read-only connection to db_name, opening it on first use."""
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.connections = {}
+            local.generation = self._generation
+        conn = local.connections.get(db_name)
+        if conn is None:
+            conn = self._open(db_name)
+            local.connections[db_name] = conn
+            self._count(db_name, "opened")
+        else:
+            self._count(db_name, "reused")
+        return conn
+
+    def close_all(self):
+        """Closes every pooled connection; threads reopen lazily on their next query."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+
+    def stats(self) -> dict:
+        """Per-database counters plus the number of live connections."""
+        with self._lock:
+            return {
+                "open_connections": len(self._connections),
+                "databases": {db: dict(s) for db, s in self._stats.items()},
+            }
+
+_pool = ConnectionPool()
+
+def get_pool() -> ConnectionPool:
+    return _pool
+
+def pool_stats() -> dict:
+    return _pool.stats()
+
+_result_cache = ResultCache()
+
+def get_result_cache() -> ResultCache:
+    return _result_cache
+
+def fetch_rows(db_name: str, query: str, max_rows: int = None, use_cache: bool = True,
+               row_limit: int = sql_guard.ROW_LIMIT, timeout: float = sql_guard.TIMEOUT_SECONDS):
+    """Executes a SQL query and returns (rows as dicts, number of rows left out by max_rows).
+
+    Rows are streamed from the cursor, so only the first max_rows are ever
+    turned into dicts; the rest are only counted (up to OMITTED_COUNT_LIMIT).
+    A statement without a LIMIT gets `row_limit`, and it is interrupted with
+    sql_guard.QueryTimeout after `timeout` seconds. Raises on SQL errors.
+    """
+    # Federated results span four files; the result cache versions one file per entry
+    use_cache = use_cache and db_name != FEDERATED_DB
+    if use_cache:
+        cached, omitted, version = _result_cache.get(db_name, get_db_path(db_name), query, max_rows)
+        if cached is not None:
+            return cached, omitted
+
+    if row_limit and max_rows is not None:
+        # One row past max_rows must still be reachable, or omitted rows would go unnoticed
+        row_limit = max(row_limit, max_rows + 1)
+    conn = _pool.get(db_name)
+    cursor = conn.cursor()
+    try:
+        with sql_guard.time_limit(conn, timeout):
+            cursor.execute(sql_guard.cap_rows(query, row_limit))
+
+            columns = [description[0] for description in cursor.description]
+            if max_rows is None:
+                rows = cursor.fetchall()
+                omitted = 0
+            else:
+                rows = cursor.fetchmany(max_rows)
+                omitted = 0
+                for _ in cursor:
+                    omitted += 1
+                    if omitted >= OMITTED_COUNT_LIMIT:
+                        break
+    finally:
+        cursor.close()
+    
+    results = [dict(zip(columns, row)) for row in rows]
+    if use_cache:
+        _result_cache.put(db_name, query, results, version, max_rows, omitted)
+    return results, omitted
+
+def query_rows(db_name: str, query: str, use_cache: bool = True) -> list:
+    """Executes a SQL query against the given DB and returns every row as a dict. Raises on SQL errors."""
+    return fetch_rows(db_name, query, use_cache=use_cache)[0]
 
 def execute_sql_query(db_name: str, query: str) -> str:
     """Executes a SQL query against the given DB and returns JSON string results."""
     try:
-        conn = get_db_connection(db_name)
-        cursor = conn.cursor()
-        cursor.execute(query)
-        
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
-        
-        results = []
-        for row in rows:
-            results.append(dict(zip(columns, row)))
-            
-        conn.close()
-        return json.dumps(results)
+        return json.dumps(query_rows(db_name, query))
     except Exception as e:
         return json.dumps({"error": str(e)})
 
+def validate_sql(db_name: str, query: str):
+    """Compiles query without running it (EXPLAIN QUERY PLAN); raises sqlite3.Error if it is invalid."""
+    cursor = _pool.get(db_name).cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    finally:
+        cursor.close()
+
+def inspect_sql(db_name: str, query: str):
+    """Cost-guard findings for query on db_name, as [(reason, blocking)] (see sql_guard.inspect)."""
+    return sql_guard.inspect(_pool.get(db_name), query)
+
+def get_federated_schema(aliases=None) -> str:
+    """Combined schema of the federated connection, with attached tables qualified by their alias.
+
+    `aliases` limits the attached databases listed (ShopCore, the main database, is always included).
+    """
+    conn = _pool.get(FEDERATED_DB)
+    schema_str = "Schema for ShopCore (main database, tables unqualified):\n"
+    for (sql,) in conn.execute("SELECT sql FROM main.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"):
+        schema_str += sql + "\n"
+    for alias in FEDERATED_ATTACHMENTS:
+        if aliases is not None and alias not in aliases:
+            continue
+        schema_str += f"Schema for {alias} (attached, qualify tables as {alias}.<Table>):\n"
+        for name, sql in conn.execute(f"SELECT name, sql FROM {alias}.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"):
+            schema_str += sql.replace(f"CREATE TABLE {name}", f"CREATE TABLE {alias}.{name}", 1) + "\n"
+    return schema_str
+
+_schema_snapshot = None  # db_name -> {"version": [inode, schema_version], "schema": text}
+_schema_lock = threading.Lock()
+
+def _load_schema_snapshot() -> dict:
+    """The snapshot file's contents, read once per process. Caller holds _schema_lock."""
+    global _schema_snapshot
+    if _schema_snapshot is None:
+        try:
+            with open(SCHEMA_SNAPSHOT_PATH, encoding="utf-8") as f:
+                _schema_snapshot = json.load(f)
+        except (OSError, ValueError):
+            _schema_snapshot = {}
+    return _schema_snapshot
+
+def _save_schema_snapshot(snapshot: dict):
+    if not SCHEMA_SNAPSHOT_PATH:
+        return
+    tmp = f"{SCHEMA_SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=1)
+        # Atomic, so other workers never read half a file
+        os.replace(tmp, SCHEMA_SNAPSHOT_PATH)
+    except OSError as e:
+        print(f"Schema snapshot not saved ({e}).")
+
 def get_schema(db_name: str) -> str:
-    """Returns the schema of the database as a string."""
-    conn = get_db_connection(db_name)
+    """Returns the schema of the database as a string.
+
+    Comes from the schema snapshot while the database's schema_version says no
+    table was created, altered or dropped since; otherwise it is read from
+    sqlite_master and the snapshot is updated.
+    """
+    conn = _pool.get(db_name)
+    version = [os.stat(get_db_path(db_name)).st_ino, conn.execute("PRAGMA schema_version").fetchone()[0]]
+    with _schema_lock:
+        entry = _load_schema_snapshot().get(db_name)
+    if entry is not None and entry.get("version") == version:
+        return entry["schema"]
+
     cursor = conn.cursor()
-    
-    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table';")
+    # sqlite_stat1 & co. (written by ANALYZE) are not part of the data model
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
     tables = cursor.fetchall()
+    cursor.close()
     
     schema_str = f"Schema for {db_name}:\n"
     for table in tables:
         schema_str += table[0] + "\n"
-        
-    conn.close()
+
+    with _schema_lock:
+        snapshot = _load_schema_snapshot()
+        snapshot[db_name] = {"version": version, "schema": schema_str}
+        _save_schema_snapshot(snapshot)
     return schema_str
+
+def warm_databases(db_names):
+    """Opens this thread's connections and reads every table's row estimate (first-query page faults, guard cache)."""
+    for db_name in db_names:
+        conn = _pool.get(db_name)
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        for table in tables:
+            sql_guard.estimate_rows(conn, table)
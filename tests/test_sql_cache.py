@@ -0,0 +1,27 @@
+"""SQL template cache: entities must bind to the slots they filled in the original question."""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.sql_cache import SQLTemplateCache, intent_signature
+
+SCHEMA = "CREATE TABLE Users (UserID INTEGER, Name TEXT); CREATE TABLE Products (ProductID INTEGER, Name TEXT)"
+SQL = ("SELECT o.OrderID FROM Orders o JOIN Users u ON u.UserID = o.UserID JOIN Products p ON p.ProductID = o.ProductID "
+       "WHERE u.Name = 'Alice Johnson' AND p.Name = 'Gaming Monitor'")
+ALICE = "I am Alice Johnson and I ordered a 'Gaming Monitor'. Where is it?"
+BOB_REORDERED = "I ordered a 'Gaming Monitor' and I am Bob Smith. Where is it?"
+
+def test_reordered_entities_get_their_own_signature():
+    assert intent_signature(ALICE) != intent_signature(BOB_REORDERED)
+
+def test_reordered_question_does_not_reuse_the_template():
+    cache = SQLTemplateCache(shared=False)
+    cache.store("DB_ShopCore.db", ALICE, {}, SCHEMA, SQL)
+    assert cache.lookup("DB_ShopCore.db", BOB_REORDERED, {}, SCHEMA) is None
+
+def test_same_order_binds_each_entity_to_its_own_column():
+    cache = SQLTemplateCache(shared=False)
+    cache.store("DB_ShopCore.db", ALICE, {}, SCHEMA, SQL)
+    sql = cache.lookup("DB_ShopCore.db", "I am Bob Smith and I ordered a 'Desk Lamp'. Where is it?", {}, SCHEMA)
+    assert sql is not None
+    assert "u.Name = 'Bob Smith'" in sql and "p.Name = 'Desk Lamp'" in sql